@@ -0,0 +1,10 @@
+"""
+Punto de entrada del bot: python -m <paquete>.
+
+Solo importa y arranca bot.main(). Los procesos hijo (spawn) del hash perceptual no
+vuelven a ejecutar un __main__.py de paquete, así que no repiten el arranque de bot.py.
+"""
+import asyncio
+from .bot import main
+
+asyncio.run(main())
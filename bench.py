@@ -0,0 +1,435 @@
+"""
+Banco de pruebas de los handlers con eventos sintéticos (sin red).
+
+Arma una base de datos temporal con resellers, clientes y pagos pendientes, sustituye
+el cliente de Telegram por un stub y reproduce una mezcla de tráfico (mensajes y
+callbacks con la forma de los eventos de Telethon) a través de on_message y cb, los
+mismos puntos de entrada que usa el bot. Por cada tipo de evento informa p50/p95/p99,
+eventos por segundo y sentencias SQL por evento.
+
+Uso:
+    python -m <paquete>.bench [--events N] [--seed S] [--record trafico.jsonl]
+    python -m <paquete>.bench --replay trafico.jsonl --max-p95 20 --max-sql 12
+
+Termina con código 1 si algún handler lanza una excepción o, con --max-p95 /
+--max-sql, si algún tipo de evento supera esos límites, para usarlo como control
+antes de desplegar. Los eventos se procesan de uno en uno; la cola de salida y la
+descarga de comprobantes no se arrancan (solo se encola).
+"""
+import os
+import sys
+import tempfile
+
+# La configuración se lee al importar: valores de prueba y una carpeta de datos desechable.
+# DATA_DIR se fuerza siempre: la siembra y el escenario "approve" escriben en la base de
+# datos, y con un DATA_DIR heredado del entorno serían los de producción. La sesión de
+# Telethon se crea al importar el bot, así que también va a esa carpeta.
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "bench")
+os.environ.setdefault("BOT_TOKEN", "bench")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-")
+os.environ["SESSION"] = os.path.join(os.environ["DATA_DIR"], "reseller_mgr")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+from . import bot as app
+from . import metrics
+from .models_db import DB, cx, init_db, set_setting
+from .router import cbdata
+
+BOSS = 1000
+RESELLER_BASE = 2000
+CLIENT_BASE = 100000
+
+# Mezcla por defecto: escenario -> peso
+DEFAULT_MIX = {
+    "start": 30,
+    "my_plan": 10,
+    "my_clients": 10,
+    "boss_clients": 8,
+    "boss_resellers": 5,
+    "boss_payments": 7,
+    "pay_reseller": 15,
+    "pay_client": 10,
+    "approve": 5,
+}
+
+
+# ---------- Stub de Telegram ----------
+class StubClient:
+    """
+    Sustituto de TelegramClient: acepta las llamadas que hacen los handlers sin red.
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def send_message(self, *args, **kwargs):
+        self._count("send_message")
+
+    async def forward_messages(self, *args, **kwargs):
+        self._count("forward_messages")
+
+    async def get_entity(self, *args, **kwargs):
+        self._count("get_entity")
+        return object()
+
+    async def get_messages(self, *args, **kwargs):
+        self._count("get_messages")
+        return None
+
+    async def iter_download(self, *args, **kwargs):
+        self._count("iter_download")
+        yield b""
+
+
+@dataclass
+class _File:
+    ext: str = ".jpg"
+    size: int = 48_000
+
+
+class _Message:
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, media: bool):
+        self.id = next(self._ids)
+        self.media = object() if media else None
+        self.photo = self.media
+        self.document = None
+        self.file = _File() if media else None
+
+
+class _Event:
+    """Base común de los eventos sintéticos (respuestas sin efecto)."""
+
+    def __init__(self, sender_id: int):
+        self.sender_id = sender_id
+        self.chat_id = sender_id
+        self.pattern_match = None
+
+    async def reply(self, *args, **kwargs):
+        return None
+
+    async def respond(self, *args, **kwargs):
+        return None
+
+
+class MessageEvent(_Event):
+    """Forma mínima de events.NewMessage.Event que usan los handlers."""
+
+    def __init__(self, sender_id: int, text: str = "", media: bool = False):
+        super().__init__(sender_id)
+        self.raw_text = text
+        self.message = _Message(media)
+        self.photo = self.message.photo
+        self.document = None
+
+
+class CallbackEvent(_Event):
+    """Forma mínima de events.CallbackQuery.Event que usan los handlers."""
+
+    def __init__(self, sender_id: int, data: bytes):
+        super().__init__(sender_id)
+        self.data = data
+
+    async def edit(self, *args, **kwargs):
+        return None
+
+    async def answer(self, *args, **kwargs):
+        return None
+
+
+# ---------- Tráfico ----------
+@dataclass
+class Step:
+    """
+    Un evento del tráfico, serializable a JSONL para reproducirlo.
+
+    Attributes:
+        label: Tipo de evento para el informe (ej. "cb:pay.res").
+        user: Remitente.
+        text: Texto del mensaje (mensajes).
+        data: callback_data (callbacks).
+        media: El mensaje lleva una foto adjunta.
+    """
+    label: str
+    user: int
+    text: Optional[str] = None
+    data: Optional[str] = None
+    media: bool = False
+
+    def event(self) -> _Event:
+        if self.data is not None:
+            return CallbackEvent(self.user, self.data.encode())
+        return MessageEvent(self.user, self.text or "", self.media)
+
+
+def _msg(label: str, user: int, text: str, media: bool = False) -> Step:
+    return Step(label, user, text=text, media=media)
+
+
+def _cb(user: int, action: str, *args) -> Step:
+    return Step(f"cb:{action}", user, data=cbdata(action, *args).decode())
+
+
+@dataclass
+class Dataset:
+    """Identificadores sembrados en la base de datos de prueba."""
+    resellers: List[int] = field(default_factory=list)
+    clients: List[int] = field(default_factory=list)
+    pending: List[str] = field(default_factory=list)
+
+
+def seed(resellers: int, clients_per_reseller: int, pending: int, rng: random.Random) -> Dataset:
+    """
+    Crea el esquema y siembra resellers, clientes y pagos pendientes.
+
+    Args:
+        resellers (int): Número de resellers.
+        clients_per_reseller (int): Clientes por reseller.
+        pending (int): Pagos pendientes (los que aprobará el escenario "approve").
+        rng: Generador aleatorio (para que el tráfico sea reproducible).
+
+    Returns:
+        Dataset: IDs sembrados.
+
+    Raises:
+        RuntimeError: Si la base de datos ya tiene datos (por ejemplo, si la configuración
+            se cargó antes de importar este módulo con el DATA_DIR real).
+    """
+    init_db()
+    with cx(readonly=True) as c:
+        used = c.execute(
+            "SELECT EXISTS(SELECT 1 FROM resellers) OR EXISTS(SELECT 1 FROM clients) OR EXISTS(SELECT 1 FROM payments)"
+        ).fetchone()[0]
+    if used:
+        raise RuntimeError(f"La base de datos {DB} ya tiene datos; el benchmark solo siembra una vacía.")
+    set_setting("owner_id", str(BOSS))
+    today = dt.date.today()
+    now = dt.datetime.now().isoformat(timespec="seconds")
+    data = Dataset()
+    res_rows, cli_rows, pay_rows = [], [], []
+    for r in range(resellers):
+        rid = RESELLER_BASE + r
+        data.resellers.append(rid)
+        exp = today + dt.timedelta(days=rng.randint(-10, 60))
+        res_rows.append((str(rid), rng.choice(("res_b", "res_p", "res_e")), today.isoformat(), exp.isoformat(), None))
+        for c in range(clients_per_reseller):
+            cid = CLIENT_BASE + r * clients_per_reseller + c
+            data.clients.append(cid)
+            exp = today + dt.timedelta(days=rng.randint(-30, 365))
+            cli_rows.append((f"{cid}", cid, None, str(rid), rng.choice(("plan_estandar", "plan_plus", "plan_pro")),
+                             exp.isoformat(), now, f"/tmp/bench/{cid}"))
+    for i in range(pending):
+        uid = rng.choice(data.resellers)
+        pid = f"{i:012x}"
+        data.pending.append(pid)
+        pay_rows.append((pid, uid, "reseller", "cup", 10.0, 3600.0, "res_b", str(uid), i + 1,
+                         "pending", now, 360.0))
+    with cx() as c:
+        cur = c.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany("INSERT INTO resellers(id, plan, started, expires, contact) VALUES (?, ?, ?, ?, ?)", res_rows)
+        cur.executemany(
+            """INSERT INTO clients(slug, owner_id, username, reseller_id, plan, expires, created, workdir)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", cli_rows)
+        cur.executemany(
+            """INSERT INTO payments(id, user_id, role, type, amount_usd, amount_cup, plan, item_id,
+                                    receipt_msg_id, status, created, rate_used)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", pay_rows)
+    return data
+
+
+def _scenario(name: str, data: Dataset, rng: random.Random) -> List[Step]:
+    """Secuencia de eventos de un escenario de la mezcla."""
+    res = rng.choice(data.resellers)
+    cli = rng.choice(data.clients)
+    if name == "start":
+        return [_msg("/start", rng.choice((BOSS, res, cli, cli)), "/start")]
+    if name == "my_plan":
+        return [_msg("📄 Mi plan", cli, "📄 Mi plan")]
+    if name == "my_clients":
+        return [_msg("👥 Mis clientes", res, "👥 Mis clientes"), _cb(res, "mycl", "s", 1, "n", str(cli))]
+    if name == "boss_clients":
+        return [_msg("👥 Clientes", BOSS, "👥 Clientes"), _cb(BOSS, "cl", "s", rng.randint(1, 20), "n", str(cli)),
+                _cb(BOSS, "cl", "e")]
+    if name == "boss_resellers":
+        return [_msg("💼 Resellers", BOSS, "💼 Resellers"), _cb(BOSS, "rs", "i", 1, "n", str(res))]
+    if name == "boss_payments":
+        return [_msg("💳 Pagos", BOSS, "💳 Pagos"), _msg("/payments", BOSS, "/payments pending cup")]
+    if name == "pay_reseller":
+        return [_msg("💳 Pagar / Renovar", res, "💳 Pagar / Renovar"), _cb(res, "pay.plan"),
+                _cb(res, "pay.res", rng.choice(("res_b", "res_p", "res_e"))),
+                _cb(res, "pay.method", rng.choice(("saldo", "cup"))), _cb(res, "pay.receipt"),
+                _msg("flows_input", res, "", media=True)]
+    if name == "pay_client":
+        return [_msg("💳 Pagar / Renovar", cli, "💳 Pagar / Renovar"), _cb(cli, "pay.client"),
+                _cb(cli, "pay.term", rng.choice(("30", "90", "365"))), _cb(cli, "pay.method", "cup"),
+                _cb(cli, "pay.receipt"), _msg("flows_input", cli, "", media=True)]
+    if name == "approve":
+        if not data.pending:
+            return [_msg("/start", BOSS, "/start")]
+        pid = data.pending.pop()
+        return [_msg("/approve", BOSS, f"/approve {pid}")]
+    raise ValueError(f"Escenario desconocido: {name}")
+
+
+def generate(data: Dataset, events: int, mix: Dict[str, int], rng: random.Random) -> Iterator[Step]:
+    """
+    Genera tráfico según la mezcla hasta completar `events` eventos (sin cortar escenarios).
+    """
+    names, weights = list(mix), list(mix.values())
+    n = 0
+    while n < events:
+        steps = _scenario(rng.choices(names, weights)[0], data, rng)
+        n += len(steps)
+        yield from steps
+
+
+def load_traffic(path: str) -> Iterator[Step]:
+    """Lee tráfico grabado con --record (una línea JSON por evento)."""
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield Step(**json.loads(line))
+
+
+# ---------- Medición ----------
+def _pct(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def replay(steps: Iterator[Step], record: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Entrega cada evento a on_message o cb y mide latencia y sentencias SQL.
+
+    Args:
+        steps: Tráfico a reproducir.
+        record: Si se indica, guarda ahí el tráfico en JSONL.
+
+    Returns:
+        Dict: Por tipo de evento (y "TOTAL"): n, p50/p95/p99 en ms, eventos/s, SQL/evento
+        y excepciones.
+    """
+    lat: Dict[str, List[float]] = {}
+    sql: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    out = open(record, "w", encoding="utf-8") if record else None
+    started = time.perf_counter()
+    try:
+        for step in steps:
+            if out is not None:
+                out.write(json.dumps(step.__dict__, ensure_ascii=False) + "\n")
+            ev = step.event()
+            handler = app.cb if isinstance(ev, CallbackEvent) else app.on_message
+            before = metrics.DB_STATEMENTS.total()
+            t0 = time.perf_counter()
+            try:
+                await handler(ev)
+            except Exception as e:
+                # Telethon registra la excepción y sigue con el siguiente evento; aquí igual
+                errors[step.label] = errors.get(step.label, 0) + 1
+                if errors[step.label] == 1:
+                    print(f"⚠️ {step.label}: {e.__class__.__name__}: {e}", file=sys.stderr)
+            lat.setdefault(step.label, []).append(time.perf_counter() - t0)
+            sql[step.label] = sql.get(step.label, 0) + int(metrics.DB_STATEMENTS.total() - before)
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - started
+    report = {}
+    all_lat = sorted(x for v in lat.values() for x in v)
+    for label, values in sorted(lat.items()) + [("TOTAL", all_lat)]:
+        values = sorted(values)
+        n = len(values)
+        statements = sum(sql.values()) if label == "TOTAL" else sql[label]
+        failed = sum(errors.values()) if label == "TOTAL" else errors.get(label, 0)
+        report[label] = {
+            "n": n,
+            "p50_ms": _pct(values, 0.50) * 1000,
+            "p95_ms": _pct(values, 0.95) * 1000,
+            "p99_ms": _pct(values, 0.99) * 1000,
+            "events_s": n / elapsed if label == "TOTAL" and elapsed else n / sum(values) if sum(values) else 0.0,
+            "sql_per_event": statements / n if n else 0.0,
+            "errors": failed,
+        }
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'evento':<22}{'n':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ev/s':>10}{'SQL/ev':>8}{'err':>6}")
+    for label, r in report.items():
+        print(f"{label[:21]:<22}{r['n']:>7}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['events_s']:>10.0f}{r['sql_per_event']:>8.1f}{r['errors']:>6}")
+
+
+def check(report: Dict[str, Dict[str, float]], max_p95: Optional[float], max_sql: Optional[float]) -> List[str]:
+    """
+    Returns:
+        List[str]: Tipos de evento con excepciones o que superan los límites (vacía si todo
+        está bien).
+    """
+    bad = []
+    for label, r in report.items():
+        if r["errors"] and label != "TOTAL":
+            bad.append(f"{label}: {r['errors']} excepciones")
+        if max_p95 is not None and r["p95_ms"] > max_p95:
+            bad.append(f"{label}: p95 {r['p95_ms']:.2f} ms > {max_p95} ms")
+        if max_sql is not None and label != "TOTAL" and r["sql_per_event"] > max_sql:
+            bad.append(f"{label}: {r['sql_per_event']:.1f} SQL/evento > {max_sql}")
+    return bad
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark de los handlers del bot con eventos sintéticos.")
+    ap.add_argument("--events", type=int, default=5000, help="Eventos a generar (por defecto 5000).")
+    ap.add_argument("--seed", type=int, default=1, help="Semilla del tráfico y de los datos.")
+    ap.add_argument("--resellers", type=int, default=200)
+    ap.add_argument("--clients", type=int, default=50, help="Clientes por reseller.")
+    ap.add_argument("--pending", type=int, default=2000, help="Pagos pendientes sembrados.")
+    ap.add_argument("--mix", help='Pesos por escenario en JSON, ej. \'{"start": 1, "approve": 1}\'.')
+    ap.add_argument("--replay", help="Reproduce tráfico grabado (JSONL) en lugar de generarlo.")
+    ap.add_argument("--record", help="Guarda el tráfico reproducido en este archivo JSONL.")
+    ap.add_argument("--json", help="Escribe el informe en JSON en este archivo.")
+    ap.add_argument("--max-p95", type=float, help="Falla si el p95 de algún evento supera estos ms.")
+    ap.add_argument("--max-sql", type=float, help="Falla si algún evento supera estas sentencias de media.")
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    try:
+        data = seed(args.resellers, args.clients, args.pending, rng)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    stub = StubClient()
+    app.bot = app.outbox.client = app.receipts.client = stub
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    steps = load_traffic(args.replay) if args.replay else generate(data, args.events, mix, rng)
+
+    report = await replay(steps, args.record)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+    bad = check(report, args.max_p95, args.max_sql)
+    for line in bad:
+        print(f"❌ {line}", file=sys.stderr)
+    app.db.shutdown()
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,53 +1,142 @@
 import asyncio
 import datetime as dt
+import re
+from typing import Dict, Optional, Set, Union
 from telethon import TelegramClient, events, Button
 from .config import SET
 from .models_db import (
-    init_db, cx, get_setting, set_setting, role_for, limits, prices,
-    prorate, ensure_client_workdir, slugify, new_id, iso_now
+    init_db, close_db, get_setting, set_setting, role_for, cached_role, invalidate_role,
+    locale_for, cached_locale, set_locale,
+    begin_write, verify_client_counts, repair_client_counts,
+    limits, prices, settings_snapshot, load_settings, refresh_settings, SETTINGS_RECHECK,
+    prorate, allocate_client, new_id, iso_now
 )
+from . import db_async as db
+from .scheduler import ExpiryScheduler, reminder_horizons
+from .outbox import Outbox, PRIO_ALERT, PRIO_REMINDER, PRIO_USER
+from .flowstate import FlowStore
+from . import metrics
+from .receipts import ReceiptIngestor, receipt_path
+from .dupes import find_duplicates
+from .export import ExportFilter, KINDS as EXPORT_KINDS, FORMATS as EXPORT_FORMATS, export
+from .router import Router, CallbackRouter
+from .listings import PaymentFilter, PaymentsPage, payments_page, clients_listing, resellers_listing
 from .ui import (
     kb_boss, kb_reseller, kb_client,
     inline_plans_reseller, inline_pay_methods, inline_client_terms, inline_pick_client,
-    btn_send_receipt, inline_client_plans,  # Nueva función para planes de cliente
-    fmt_clients_list, fmt_payments_pretty, fmt_client_card,
+    btn_send_receipt, inline_client_plans, inline_pay_pick, inline_payments_nav, inline_list_nav,
+    inline_review,
+    fmt_payments_pretty, fmt_client_card,
+)
+from .messages import (
+    Message, Rendered, markdown_text, resolve_locale, join, code_list, LOCALE_NAMES,
     MSG_WELCOME_GUEST, MSG_WELCOME_BOSS, MSG_WELCOME_RESELLER, MSG_WELCOME_CLIENT,
     MSG_ERROR_NO_PERMISSION, MSG_ERROR_INVALID_ID,
     MSG_CLIENT_CREATED, MSG_RESELLER_CREATED,
     MSG_PAYMENT_PICK, MSG_PAYMENT_SALDO, MSG_PAYMENT_CUP, MSG_PAYMENT_SUCCESS,
-    MSG_EXPIRES_TOMORROW, MSG_EXPIRED, MSG_RES_LIMIT
+    MSG_EXPIRES_TOMORROW, MSG_EXPIRES_SOON, MSG_EXPIRED, MSG_RES_LIMIT,
+    MSG_LANG_PICK, MSG_LANG_SET, MSG_CLIENT_WELCOME,
+    MSG_PAYMENT_PENDING, MSG_PAYMENT_DUPLICATES, MSG_DUPLICATE_EXACT, MSG_DUPLICATE_SIMILAR,
+    MSG_RECEIPT_MISSING, MSG_PAYMENT_APPROVED, MSG_PAYMENTS_APPROVED, MSG_PAYMENT_REJECTED
 )
 import logging
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filename=str(SET.data_dir / "logs" / "bot.log")
-)
+log = logging.getLogger(__name__)
 
 # Inicializar cliente de Telegram
-bot = TelegramClient("reseller_mgr", SET.api_id, SET.api_hash)
-flows = {}  # Diccionario para almacenar el estado de conversación por usuario
+bot = TelegramClient(SET.session, SET.api_id, SET.api_hash)
+flows = FlowStore()  # Estado de conversación por usuario (con TTL, persistido en la DB)
+outbox = Outbox(bot)  # Cola de mensajes salientes (avisos, notificaciones)
+router = Router()  # Comandos y botones del teclado; ver on_message
+callbacks = CallbackRouter(flows.get)  # Botones inline; ver cb
+receipts = ReceiptIngestor(bot)  # Descarga de comprobantes a data_dir/invoices
+
+# Botones de orden de los listados: (etiqueta, código de listings.*_SORTS)
+CLIENT_SORT_BUTTONS = [("Slug", "s"), ("Vencimiento", "e"), ("Reseller", "r")]
+MY_CLIENT_SORT_BUTTONS = [("Slug", "s"), ("Vencimiento", "e")]
+RESELLER_SORT_BUTTONS = [("ID", "i"), ("Vencimiento", "e")]
+ALL_CLIENTS_TITLE = "👥 **Todos los Clientes del Sistema**"
+
+async def user_locale(uid: int, lang_code: Optional[str] = None) -> str:
+    """
+    Resuelve el idioma del usuario: el elegido con /lang, si no el de su cliente de
+    Telegram (lang_code) y si no el idioma por defecto. Solo va a la DB si no está en caché.
+    """
+    pref = cached_locale(uid)
+    if pref is None:
+        pref = await db.run(locale_for, uid)
+    return resolve_locale(pref, lang_code)
+
+async def localize(uid: int, message: Message, lang_code: Optional[str] = None) -> Rendered:
+    """
+    Traduce un mensaje del catálogo al idioma del usuario (texto y entidades ya parseados).
+    """
+    return message.render(await user_locale(uid, lang_code))
 
-async def reply(ev, message: str, buttons=None, parse_mode: str = "markdown") -> None:
+def _lang_code(ev) -> Optional[str]:
+    return getattr(getattr(ev, "sender", None), "lang_code", None)
+
+async def reply(ev, message: Union[str, Message], buttons=None, parse_mode: str = "markdown") -> None:
     """
     Enviar un mensaje con formato Markdown y botones opcionales.
     
+    Los mensajes del catálogo (Message) se envían ya traducidos y con sus entidades,
+    sin pasar por el parser Markdown.
+    
     Args:
         ev: Evento de Telegram (mensaje o callback).
-        message: Mensaje a enviar.
+        message: Mensaje a enviar (texto Markdown o mensaje del catálogo).
         buttons: Botones opcionales (ReplyKeyboard o InlineKeyboard).
         parse_mode: Formato del mensaje (por defecto, Markdown).
     """
     try:
-        await ev.reply(message, buttons=buttons or Button.clear(), parse_mode=parse_mode)
-        logging.info(f"Mensaje enviado a {ev.sender_id}: {message[:50]}...")
+        if isinstance(message, Message):
+            r = await localize(ev.sender_id, message, _lang_code(ev))
+            await ev.reply(r.text, formatting_entities=r.entities, parse_mode=None, buttons=buttons or Button.clear())
+        else:
+            await ev.reply(message, buttons=buttons or Button.clear(), parse_mode=parse_mode)
+        log.debug("Mensaje enviado a %s: %.50s...", ev.sender_id, message)
     except Exception as e:
-        logging.error(f"Error al enviar mensaje a {ev.sender_id}: {e}")
+        log.error("Error al enviar mensaje a %s: %s", ev.sender_id, e)
+
+async def edit(ev, message: Message, buttons=None) -> None:
+    """
+    Edita el mensaje de un callback con un mensaje del catálogo, en el idioma del usuario.
+    """
+    r = await localize(ev.sender_id, message, _lang_code(ev))
+    await ev.edit(r.text, formatting_entities=r.entities, parse_mode=None, buttons=buttons)
+
+async def notify(uid: int, message: Union[Message, Rendered], prio: int = PRIO_USER) -> None:
+    """
+    Encola un mensaje del catálogo para otro usuario, en su idioma (o uno ya
+    renderizado en su idioma).
+    """
+    r = message if isinstance(message, Rendered) else await localize(uid, message)
+    outbox.send(uid, r.text, prio, formatting_entities=r.entities, parse_mode=None)
+
+async def notify_many(messages: Dict[int, Message], prio: int = PRIO_USER) -> int:
+    """
+    Encola de una vez un mensaje del catálogo por usuario, cada uno en su idioma.
+
+    Returns:
+        int: Número de mensajes encolados.
+    """
+    uids = list(messages)
+    rendered = await asyncio.gather(*(localize(uid, messages[uid]) for uid in uids))
+    return outbox.send_many(
+        ((uid, r.text, {"formatting_entities": r.entities}) for uid, r in zip(uids, rendered)),
+        prio, parse_mode=None
+    )
+
+async def user_role(uid: int) -> str:
+    """
+    Resuelve el rol del usuario; solo va al hilo de la DB si no está en la caché.
+    """
+    role = cached_role(uid)
+    return role if role is not None else await db.run(role_for, uid)
 
 # ---------- /start ----------
-@bot.on(events.NewMessage(pattern=r"^/start$"))
+@router.command("start")
 async def start(ev):
     """
     Maneja el comando /start y muestra el panel correspondiente según el rol del usuario.
@@ -57,10 +146,9 @@ async def start(ev):
     - Reseller: Muestra el panel de reseller.
     - Client: Muestra detalles del plan del cliente.
     """
-    init_db()
     user_id = ev.sender_id
-    role = role_for(user_id)
-    logging.info(f"Comando /start ejecutado por {user_id} (rol: {role})")
+    role = await user_role(user_id)
+    log.info("Comando /start ejecutado por %s (rol: %s)", user_id, role)
 
     if role == "guest":
         support_contact = get_setting("support_contact", "soporte")
@@ -73,10 +161,7 @@ async def start(ev):
         await reply(ev, MSG_WELCOME_RESELLER, kb_reseller())
         return
     if role == "client":
-        with cx() as c:
-            cur = c.cursor()
-            cur.execute("SELECT slug, plan, expires, username FROM clients WHERE owner_id=?", (user_id,))
-            row = cur.fetchone()
+        row = await db.query_one("SELECT slug, plan, expires, username FROM clients WHERE owner_id=?", (user_id,))
         if row:
             username = row["username"] or f"Usuario {user_id}"
             await reply(ev, MSG_WELCOME_CLIENT.format(
@@ -86,8 +171,23 @@ async def start(ev):
             await reply(ev, "❌ **Error**: No se encontraron detalles de tu plan. Contacta a soporte.", kb_client())
         return
 
+# ---------- Idioma ----------
+@router.command("lang", r"([A-Za-z_-]*)")
+async def lang(ev):
+    """
+    Muestra o cambia el idioma de los mensajes del usuario (/lang, /lang en).
+    """
+    user_id = ev.sender_id
+    code = ev.pattern_match.group(1).lower()
+    if code and code in LOCALE_NAMES:
+        await db.run(set_locale, user_id, code)
+        await reply(ev, MSG_LANG_SET.format(name=LOCALE_NAMES[code]))
+        return
+    current = await user_locale(user_id, _lang_code(ev))
+    await reply(ev, MSG_LANG_PICK.format(name=LOCALE_NAMES[current], codes=", ".join(LOCALE_NAMES)))
+
 # ---------- Configurar Owner ----------
-@bot.on(events.NewMessage(pattern=r"^/set_owner\s+(\d+)$"))
+@router.command("set_owner", r"(\d+)")
 async def set_owner(ev):
     """
     Establece el dueño del sistema (solo si no hay dueño o lo ejecuta el dueño actual).
@@ -102,15 +202,16 @@ async def set_owner(ev):
     new_owner_id = ev.pattern_match.group(1)
     try:
         await bot.get_entity(int(new_owner_id))
-        set_setting("owner_id", new_owner_id)
+        await db.run(set_setting, "owner_id", new_owner_id)
+        invalidate_role()
         await reply(ev, f"👑 **Dueño establecido**\nID: `{new_owner_id}`\nEl sistema está ahora bajo tu control.", kb_boss())
-        logging.info(f"Nuevo dueño establecido: {new_owner_id}")
+        log.info("Nuevo dueño establecido: %s", new_owner_id)
     except ValueError:
         await reply(ev, MSG_ERROR_INVALID_ID)
-        logging.error(f"Intento de set_owner con ID inválido: {new_owner_id}")
+        log.error("Intento de set_owner con ID inválido: %s", new_owner_id)
 
 # ---------- Boss: Crear Reseller ----------
-@bot.on(events.NewMessage(pattern=r"^/reseller_add\s+(\d+)$"))
+@router.command("reseller_add", r"(\d+)")
 async def reseller_add(ev):
     """
     Crea un nuevo reseller con un plan básico y 30 días de validez (solo boss).
@@ -118,7 +219,7 @@ async def reseller_add(ev):
     Args:
         ev: Evento con el comando /reseller_add <id>.
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     rid = ev.pattern_match.group(1)
@@ -126,22 +227,20 @@ async def reseller_add(ev):
         await bot.get_entity(int(rid))
         today = dt.date.today().isoformat()
         expires = (dt.date.today() + dt.timedelta(days=30)).isoformat()
-        with cx() as c:
-            cur = c.cursor()
-            cur.execute(
-                """INSERT OR REPLACE INTO resellers(id, plan, started, expires, contact)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (rid, "res_b", today, expires, "@contacto")
-            )
-            c.commit()
+        await db.execute(
+            """INSERT OR REPLACE INTO resellers(id, plan, started, expires, contact)
+               VALUES (?, ?, ?, ?, ?)""",
+            (rid, "res_b", today, expires, "@contacto")
+        )
+        invalidate_role(int(rid))
         await reply(ev, MSG_RESELLER_CREATED.format(rid=rid, plan="res_b", expires=expires), kb_boss())
-        logging.info(f"Reseller creado: ID={rid}, plan=res_b, vence={expires}")
+        log.info("Reseller creado: ID=%s, plan=res_b, vence=%s", rid, expires)
     except ValueError:
         await reply(ev, MSG_ERROR_INVALID_ID)
-        logging.error(f"Intento de reseller_add con ID inválido: {rid}")
+        log.error("Intento de reseller_add con ID inválido: %s", rid)
 
 # ---------- Boss: Actualizar Contacto de Reseller ----------
-@bot.on(events.NewMessage(pattern=r"^/reseller_contact\s+(\d+)\s+(@\S+)$"))
+@router.command("reseller_contact", r"(\d+)\s+(@\S+)")
 async def reseller_contact(ev):
     """
     Actualiza el contacto de un reseller (solo boss).
@@ -149,67 +248,67 @@ async def reseller_contact(ev):
     Args:
         ev: Evento con el comando /reseller_contact <id> <contacto>.
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     rid = ev.pattern_match.group(1)
     tag = ev.pattern_match.group(2)
     if not tag.startswith("@") or len(tag) < 3:
         await reply(ev, "❌ **Error**: El contacto debe ser un @usuario válido (ej. @Soporte).")
-        logging.error(f"Contacto inválido para reseller {rid}: {tag}")
-        return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT 1 FROM resellers WHERE id=?", (rid,))
-        if not cur.fetchone():
-            await reply(ev, f"❌ **Error**: No existe un reseller con ID `{rid}`.")
-            logging.error(f"Reseller no encontrado: {rid}")
-            return
-        cur.execute("UPDATE resellers SET contact=? WHERE id=?", (tag, rid))
-        c.commit()
+        log.error("Contacto inválido para reseller %s: %s", rid, tag)
+        return
+    found = await db.execute("UPDATE resellers SET contact=? WHERE id=?", (tag, rid))
+    if not found:
+        await reply(ev, f"❌ **Error**: No existe un reseller con ID `{rid}`.")
+        log.error("Reseller no encontrado: %s", rid)
+        return
     await reply(ev, f"📞 **Contacto actualizado**\nReseller `{rid}` ahora tiene contacto: `{tag}`.", kb_boss())
-    logging.info(f"Contacto actualizado para reseller {rid}: {tag}")
+    log.info("Contacto actualizado para reseller %s: %s", rid, tag)
 
 # ---------- Boss: Listar todos los clientes ----------
-@bot.on(events.NewMessage(pattern=r"^👥 Clientes$"))
+@router.text("👥 Clientes")
 async def boss_clients(ev):
     """
-    Muestra la lista de todos los clientes del sistema (solo boss).
+    Muestra la lista paginada de todos los clientes del sistema (solo boss).
     
     Args:
         ev: Evento con el comando "Clientes".
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT slug, plan, expires, reseller_id FROM clients ORDER BY slug")
-        rows = cur.fetchall()
-    await reply(ev, fmt_clients_list(rows, "👥 **Todos los Clientes del Sistema**"), kb_boss())
-    logging.info(f"Lista de clientes solicitada por boss {ev.sender_id}")
+    lst = await db.read(clients_listing, "s", 0, None, ALL_CLIENTS_TITLE)
+    await reply(ev, lst.text, inline_list_nav("cl", "s", lst.page, CLIENT_SORT_BUTTONS, lst.prev_key, lst.next_key))
+    log.info("Lista de clientes solicitada por boss %s", ev.sender_id)
+
+@callbacks.action("cl", page=int)
+async def cb_boss_clients_page(ev, sort, page=0, way="", *key):
+    """
+    Cambia de página u orden en el listado de todos los clientes (solo boss).
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await ev.answer("⛔ Sin permiso.", alert=True)
+        return
+    lst = await db.read(clients_listing, sort, page, None, ALL_CLIENTS_TITLE, way, key)
+    await ev.edit(lst.text, buttons=inline_list_nav("cl", sort, lst.page, CLIENT_SORT_BUTTONS, lst.prev_key, lst.next_key))
 
 # ---------- Boss: Mostrar facturas (pagos aprobados) ----------
-@bot.on(events.NewMessage(pattern=r"^🧾 Facturas$"))
+@router.text("🧾 Facturas")
 async def boss_invoices(ev):
     """
-    Muestra los últimos 30 pagos aprobados como facturas (solo boss).
+    Muestra los pagos aprobados como facturas, paginados (solo boss).
     
     Args:
         ev: Evento con el comando "Facturas".
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT * FROM payments WHERE status='approved' ORDER BY created DESC LIMIT 30")
-        rows = cur.fetchall()
-    await reply(ev, fmt_payments_pretty(rows), kb_boss())
-    logging.info(f"Lista de facturas solicitada por boss {ev.sender_id}")
+    await show_payments(ev, PaymentFilter(status="approved"))
+    log.info("Lista de facturas solicitada por boss %s", ev.sender_id)
 
 # ---------- Boss: Mostrar ajustes ----------
-@bot.on(events.NewMessage(pattern=r"^⚙️ Ajustes$"))
+@router.text("⚙️ Ajustes")
 async def boss_settings(ev):
     """
     Muestra las configuraciones actuales (precios, tasas, límites) al boss.
@@ -217,13 +316,10 @@ async def boss_settings(ev):
     Args:
         ev: Evento con el comando "Ajustes".
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        pr = prices(cur)
-        lim = limits(cur)
+    pr, lim = prices(), limits()
     text = (
         "⚙️ **Ajustes actuales**\n\n"
         f"💱 **Tasa USD→CUP**: {pr['usd_to_cup']}\n\n"
@@ -242,10 +338,10 @@ async def boss_settings(ev):
         "Usa comandos como /set_rate o /set_price para cambiarlos."
     )
     await reply(ev, text, kb_boss())
-    logging.info(f"Ajustes solicitados por boss {ev.sender_id}")
+    log.info("Ajustes solicitados por boss %s", ev.sender_id)
 
 # ---------- Boss: Crear cliente ----------
-@bot.on(events.NewMessage(pattern=r"^➕ Crear cliente$"))
+@router.text("➕ Crear cliente")
 async def boss_create_client(ev):
     """
     Inicia el proceso de creación de un cliente por el boss.
@@ -253,15 +349,15 @@ async def boss_create_client(ev):
     Args:
         ev: Evento con el comando "Crear cliente".
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    flows[ev.sender_id] = {"mode": "newcli_boss", "step": "client_id", "rid": str(ev.sender_id)}
+    flows.start(ev.sender_id, "newcli_boss", "client_id", rid=str(ev.sender_id))
     await reply(ev, "🆕 **Crear Cliente como Boss**\nEnvía el **ID numérico** del cliente final:", kb_boss())
-    logging.info(f"Boss {ev.sender_id} inició flujo de creación de cliente")
+    log.info("Boss %s inició flujo de creación de cliente", ev.sender_id)
 
 # ---------- Client: Mostrar mi plan ----------
-@bot.on(events.NewMessage(pattern=r"^📄 Mi plan$"))
+@router.text("📄 Mi plan")
 async def cli_my_plan(ev):
     """
     Muestra los detalles del plan del cliente.
@@ -269,22 +365,34 @@ async def cli_my_plan(ev):
     Args:
         ev: Evento con el comando "Mi plan".
     """
-    if role_for(ev.sender_id) != "client":
+    if await user_role(ev.sender_id) != "client":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT * FROM clients WHERE owner_id=?", (ev.sender_id,))
-        row = cur.fetchone()
+    row = await db.query_one("SELECT * FROM clients WHERE owner_id=?", (ev.sender_id,))
     if not row:
         await reply(ev, "❌ **Error**: No tienes un plan registrado.", kb_client())
-        logging.error(f"Cliente {ev.sender_id} no encontrado en la base de datos")
+        log.error("Cliente %s no encontrado en la base de datos", ev.sender_id)
         return
     await reply(ev, fmt_client_card(row), kb_client())
-    logging.info(f"Detalles del plan mostrados para cliente {ev.sender_id}")
+    log.info("Detalles del plan mostrados para cliente %s", ev.sender_id)
 
 # ---------- Client: Provisionar (toggle estado del servicio) ----------
-@bot.on(events.NewMessage(pattern=r"^⚙️ Provisionar$"))
+def _tx_toggle_service(cur, owner_id: int):
+    """
+    Alterna svc_status del cliente dentro de una transacción.
+
+    Returns:
+        tuple: (fila del cliente o None, nuevo estado o None).
+    """
+    cur.execute("SELECT slug, svc_status FROM clients WHERE owner_id=?", (owner_id,))
+    row = cur.fetchone()
+    if not row:
+        return None, None
+    new_status = "active" if row["svc_status"] == "stopped" else "stopped"
+    cur.execute("UPDATE clients SET svc_status=? WHERE slug=?", (new_status, row["slug"]))
+    return row, new_status
+
+@router.text("⚙️ Provisionar")
 async def cli_provision(ev):
     """
     Alterna el estado del servicio del cliente (active/stopped).
@@ -292,25 +400,19 @@ async def cli_provision(ev):
     Args:
         ev: Evento con el comando "Provisionar".
     """
-    if role_for(ev.sender_id) != "client":
+    if await user_role(ev.sender_id) != "client":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT slug, svc_status FROM clients WHERE owner_id=?", (ev.sender_id,))
-        row = cur.fetchone()
-        if not row:
-            await reply(ev, "❌ **Error**: No tienes un plan registrado.", kb_client())
-            logging.error(f"Cliente {ev.sender_id} no encontrado para provisionar")
-            return
-        new_status = "active" if row["svc_status"] == "stopped" else "stopped"
-        cur.execute("UPDATE clients SET svc_status=? WHERE slug=?", (new_status, row["slug"]))
-        c.commit()
+    row, new_status = await db.transaction(_tx_toggle_service, ev.sender_id)
+    if not row:
+        await reply(ev, "❌ **Error**: No tienes un plan registrado.", kb_client())
+        log.error("Cliente %s no encontrado para provisionar", ev.sender_id)
+        return
     await reply(ev, f"⚙️ **Servicio {new_status}**\nSlug: `{row['slug']}`.\nUsa **📄 Mi plan** para verificar.", kb_client())
-    logging.info(f"Servicio provisionado para cliente {ev.sender_id}: {new_status}")
+    log.info("Servicio provisionado para cliente %s: %s", ev.sender_id, new_status)
 
 # ---------- Configurar Tasas y Precios ----------
-@bot.on(events.NewMessage(pattern=r"^/set_rate\s+(\d+(\.\d+)?)$"))
+@router.command("set_rate", r"(\d+(\.\d+)?)")
 async def set_rate(ev):
     """
     Actualiza la tasa de cambio USD a CUP (solo boss).
@@ -318,19 +420,19 @@ async def set_rate(ev):
     Args:
         ev: Evento con el comando /set_rate <tasa>.
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     rate = float(ev.pattern_match.group(1))
     if rate <= 0:
         await reply(ev, "❌ **Error**: La tasa debe ser un número positivo.")
-        logging.error(f"Intento de set_rate con valor inválido: {rate}")
+        log.error("Intento de set_rate con valor inválido: %s", rate)
         return
-    set_setting("usd_to_cup", rate)
+    await db.run(set_setting, "usd_to_cup", rate)
     await reply(ev, f"💱 **Tasa actualizada**\nNueva tasa USD→CUP: `{rate}`.", kb_boss())
-    logging.info(f"Tasa USD→CUP actualizada a {rate} por boss {ev.sender_id}")
+    log.info("Tasa USD→CUP actualizada a %s por boss %s", rate, ev.sender_id)
 
-@bot.on(events.NewMessage(pattern=r"^/set_price\s+(res_b|res_p|res_e|c30|c90|c365)\s+(\d+(\.\d+)?)$"))
+@router.command("set_price", r"(res_b|res_p|res_e|c30|c90|c365)\s+(\d+(\.\d+)?)")
 async def set_price(ev):
     """
     Actualiza el precio de un plan (solo boss).
@@ -338,25 +440,83 @@ async def set_price(ev):
     Args:
         ev: Evento con el comando /set_price <plan> <precio>.
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     key = ev.pattern_match.group(1)
     val = float(ev.pattern_match.group(2))
     if val < 0:
         await reply(ev, "❌ **Error**: El precio debe ser no negativo.")
-        logging.error(f"Intento de set_price con valor inválido: {val} para {key}")
+        log.error("Intento de set_price con valor inválido: %s para %s", val, key)
         return
     mapk = {
         "res_b": "price_res_b", "res_p": "price_res_p", "res_e": "price_res_e",
         "c30": "price_client_30", "c90": "price_client_90", "c365": "price_client_365"
     }[key]
-    set_setting(mapk, val)
+    await db.run(set_setting, mapk, val)
     await reply(ev, f"💵 **Precio actualizado**\nPlan `{key}` establecido en `{val}` USD.", kb_boss())
-    logging.info(f"Precio actualizado para {key}: {val} por boss {ev.sender_id}")
+    log.info("Precio actualizado para %s: %s por boss %s", key, val, ev.sender_id)
+
+@router.command("set_reminders", r"(\d+(?:\s*,\s*\d+)*)")
+async def set_reminders(ev):
+    """
+    Configura los días de anticipación de los recordatorios de vencimiento (solo boss).
+    
+    Args:
+        ev: Evento con el comando /set_reminders <d1,d2,...> (por ejemplo, 7,3,1).
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    days = sorted({int(d) for d in ev.pattern_match.group(1).split(",") if int(d) > 0}, reverse=True)
+    if not days:
+        await reply(ev, "❌ **Error**: Indica al menos un día mayor que 0 (ej. `/set_reminders 7,3,1`).")
+        return
+    await db.run(set_setting, "reminder_days", ",".join(map(str, days)))
+    expiry.reload()
+    await reply(ev, f"⏰ **Recordatorios actualizados**\nSe avisará {', '.join(map(str, reminder_horizons()))} días antes del vencimiento.", kb_boss())
+    log.info("Recordatorios actualizados a %s por boss %s", days, ev.sender_id)
+
+@router.command("verify_counts", r"(fix)?")
+async def verify_counts(ev):
+    """
+    Comprueba (y con "fix", corrige) los contadores de clientes de los resellers (solo boss).
+    
+    Args:
+        ev: Evento con el comando /verify_counts [fix].
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    if ev.pattern_match.group(1):
+        bad = await db.transaction(repair_client_counts)
+        verb = "corregidos"
+    else:
+        bad = await db.read(verify_client_counts)
+        verb = "descuadrados"
+    if not bad:
+        await reply(ev, "✅ **Contadores de clientes correctos.**", kb_boss())
+    else:
+        lines = "\n".join(f"• `{rid}`: {stored} → {actual}" for rid, stored, actual in bad[:50])
+        await reply(ev, f"⚠️ **{len(bad)} contadores {verb}**\n{lines}", kb_boss())
+    log.info("Verificación de contadores por boss %s: %s %s", ev.sender_id, len(bad), verb)
+
+@router.command("metrics")
+async def show_metrics(ev):
+    """
+    Muestra al boss un resumen de latencias, uso de la base de datos y colas.
+    
+    Args:
+        ev: Evento con el comando /metrics.
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    await reply(ev, metrics.summary(), kb_boss())
+    log.info("Métricas solicitadas por boss %s", ev.sender_id)
 
 # ---------- Vistas (Reply Keyboard) ----------
-@bot.on(events.NewMessage(pattern=r"^💼 Resellers$"))
+@router.text("💼 Resellers")
 async def boss_resellers(ev):
     """
     Muestra la lista de resellers al administrador.
@@ -364,35 +524,54 @@ async def boss_resellers(ev):
     Args:
         ev: Evento con el comando "Resellers".
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT id, plan, expires, contact, (SELECT COUNT(*) FROM clients WHERE reseller_id=resellers.id) AS clients FROM resellers ORDER BY id")
-        rows = cur.fetchall()
-    await reply(ev, fmt_resellers_list(rows), kb_boss())
-    logging.info(f"Lista de resellers solicitada por boss {ev.sender_id}")
+    lst = await db.read(resellers_listing, "i", 0)
+    await reply(ev, lst.text, inline_list_nav("rs", "i", lst.page, RESELLER_SORT_BUTTONS, lst.prev_key, lst.next_key))
+    log.info("Lista de resellers solicitada por boss %s", ev.sender_id)
 
-@bot.on(events.NewMessage(pattern=r"^👥 Mis clientes$"))
+@callbacks.action("rs", page=int)
+async def cb_boss_resellers_page(ev, sort, page=0, way="", *key):
+    """
+    Cambia de página u orden en el listado de resellers (solo boss).
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await ev.answer("⛔ Sin permiso.", alert=True)
+        return
+    lst = await db.read(resellers_listing, sort, page, way, key)
+    await ev.edit(lst.text, buttons=inline_list_nav("rs", sort, lst.page, RESELLER_SORT_BUTTONS, lst.prev_key, lst.next_key))
+
+@router.text("👥 Mis clientes")
 async def res_my_clients(ev):
     """
-    Muestra la lista de clientes de un reseller.
+    Muestra la lista paginada de clientes de un reseller.
     
     Args:
         ev: Evento con el comando "Mis clientes".
     """
-    if role_for(ev.sender_id) != "reseller":
+    if await user_role(ev.sender_id) != "reseller":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT slug, plan, expires, reseller_id FROM clients WHERE reseller_id=?", (str(ev.sender_id),))
-        rows = cur.fetchall()
-    await reply(ev, fmt_clients_list(rows), kb_reseller())
-    logging.info(f"Lista de clientes solicitada por reseller {ev.sender_id}")
+    lst = await db.read(clients_listing, "s", 0, str(ev.sender_id))
+    if lst.pages > 1:
+        await reply(ev, lst.text, inline_list_nav("mycl", "s", lst.page, MY_CLIENT_SORT_BUTTONS, lst.prev_key, lst.next_key))
+    else:
+        await reply(ev, lst.text, kb_reseller())
+    log.info("Lista de clientes solicitada por reseller %s", ev.sender_id)
+
+@callbacks.action("mycl", page=int)
+async def cb_res_clients_page(ev, sort, page=0, way="", *key):
+    """
+    Cambia de página u orden en el listado de clientes propios (reseller).
+    """
+    if await user_role(ev.sender_id) != "reseller":
+        await ev.answer("⛔ Sin permiso.", alert=True)
+        return
+    lst = await db.read(clients_listing, sort, page, str(ev.sender_id), "👥 CLIENTES", way, key)
+    await ev.edit(lst.text, buttons=inline_list_nav("mycl", sort, lst.page, MY_CLIENT_SORT_BUTTONS, lst.prev_key, lst.next_key))
 
-@bot.on(events.NewMessage(pattern=r"^📞 Soporte Boss$"))
+@router.text("📞 Soporte Boss")
 async def res_support_boss(ev):
     """
     Muestra el contacto del boss al reseller.
@@ -400,15 +579,15 @@ async def res_support_boss(ev):
     Args:
         ev: Evento con el comando "Soporte Boss".
     """
-    if role_for(ev.sender_id) != "reseller":
+    if await user_role(ev.sender_id) != "reseller":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     boss_id = get_setting("owner_id", "")
     tag = f"@{boss_id}" if boss_id and boss_id.isdigit() else "No disponible"
     await reply(ev, f"📞 **Contacto del Boss**\nEscribe a: {tag}", kb_reseller())
-    logging.info(f"Soporte boss solicitado por reseller {ev.sender_id}")
+    log.info("Soporte boss solicitado por reseller %s", ev.sender_id)
 
-@bot.on(events.NewMessage(pattern=r"^📞 Soporte$"))
+@router.text("📞 Soporte")
 async def cli_support(ev):
     """
     Muestra el contacto del reseller al cliente.
@@ -416,30 +595,28 @@ async def cli_support(ev):
     Args:
         ev: Evento con el comando "Soporte".
     """
-    if role_for(ev.sender_id) != "client":
+    if await user_role(ev.sender_id) != "client":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT reseller_id FROM clients WHERE owner_id=?", (ev.sender_id,))
-        row = cur.fetchone()
-        if not row:
-            await reply(ev, "❌ **Error**: No estás registrado como cliente.", kb_client())
-            logging.error(f"Cliente {ev.sender_id} no encontrado para soporte")
-            return
-        rid = row["reseller_id"]
-        cur.execute("SELECT contact FROM resellers WHERE id=?", (rid,))
-        rr = cur.fetchone()
-        contact = rr["contact"] if rr else "No disponible"
+    row = await db.query_one(
+        """SELECT c.reseller_id, r.contact FROM clients c
+           LEFT JOIN resellers r ON r.id = c.reseller_id WHERE c.owner_id=?""",
+        (ev.sender_id,)
+    )
+    if not row:
+        await reply(ev, "❌ **Error**: No estás registrado como cliente.", kb_client())
+        log.error("Cliente %s no encontrado para soporte", ev.sender_id)
+        return
+    contact = row["contact"] or "No disponible"
     if contact and contact.startswith("@"):
         link = f"https://t.me/{contact.lstrip('@')}"
         await reply(ev, f"📞 **Tu reseller**\nContacta a: {contact}", [[Button.url("💬 Abrir chat", link)]])
     else:
         await reply(ev, f"📞 **Tu reseller**: No disponible\nIntenta de nuevo más tarde.", kb_client())
-    logging.info(f"Soporte solicitado por cliente {ev.sender_id}")
+    log.info("Soporte solicitado por cliente %s", ev.sender_id)
 
 # ---------- Entrada de Pagos ----------
-@bot.on(events.NewMessage(pattern=r"^💳 Pagar / Renovar$"))
+@router.text("💳 Pagar / Renovar")
 async def pay_entry(ev):
     """
     Inicia el proceso de pago para resellers o clientes.
@@ -447,193 +624,176 @@ async def pay_entry(ev):
     Args:
         ev: Evento con el comando "Pagar / Renovar".
     """
-    role = role_for(ev.sender_id)
+    role = await user_role(ev.sender_id)
     if role not in ("client", "reseller"):
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    flows[ev.sender_id] = {"mode": "pay", "step": "target", "as": ("reseller" if role == "reseller" else "client")}
-    await reply(ev, MSG_PAYMENT_PICK, [
-        [Button.inline("Plan Reseller", b"pay:plan"), Button.inline("Renovar Cliente", b"pay:client")]
-    ])
-    logging.info(f"Flujo de pago iniciado por {ev.sender_id} ({role})")
+    flows.start(ev.sender_id, "pay", "target", role=("reseller" if role == "reseller" else "client"))
+    await reply(ev, MSG_PAYMENT_PICK, inline_pay_pick())
+    log.info("Flujo de pago iniciado por %s (%s)", ev.sender_id, role)
 
 # ---------- Flujos Inline (Pagos y Creación de Clientes) ----------
 @bot.on(events.CallbackQuery)
 async def cb(ev):
     """
-    Maneja las interacciones con botones inline en los flujos de pagos y creación de clientes.
+    Único handler de botones inline: delega en el router de callbacks.
     
     Args:
         ev: Evento de CallbackQuery con datos de la acción seleccionada.
     """
-    user_id = ev.sender_id
-    role = role_for(user_id)
-    data = (ev.data or b"").decode()
-    logging.debug(f"Callback recibido de {user_id}: {data}")
-
-    # Seleccionar plan de reseller
-    if data == "pay:plan" and user_id in flows and flows[user_id]["mode"] == "pay":
-        with cx() as c:
-            cur = c.cursor()
-            pr = prices(cur)
-            rate = pr["usd_to_cup"]
-        txt, btn = inline_plans_reseller(pr, rate)
-        await ev.edit(txt, buttons=btn)
-        logging.info(f"Planes de reseller mostrados a {user_id}")
-        return
-
-    # Seleccionar plan específico de reseller
-    if data.startswith("pay:res_") and user_id in flows and flows[user_id]["mode"] == "pay":
-        code = data.split(":", 1)[1]
-        with cx() as c:
-            cur = c.cursor()
-            pr = prices(cur)
-            rate = pr["usd_to_cup"]
-            usd = {"res_b": pr["res_b"], "res_p": pr["res_p"], "res_e": pr["res_e"]}[code]
-            cup = int(usd * rate)
-        flows[user_id].update({"step": "pay_method", "plan_code": code, "amount_usd": usd, "amount_cup": cup, "item_id": str(user_id)})
-        txt, btn = inline_pay_methods(usd, cup)
-        await ev.edit(txt, buttons=btn)
-        logging.info(f"Métodos de pago mostrados a {user_id} para plan {code}")
-        return
-
-    # Renovar cliente: elegir cliente
-    if data == "pay:client" and user_id in flows and flows[user_id]["mode"] == "pay":
-        if role == "client":
-            with cx() as c:
-                cur = c.cursor()
-                cur.execute("SELECT slug FROM clients WHERE owner_id=?", (user_id,))
-                row = cur.fetchone()
-            if not row:
-                await ev.answer("❌ No estás registrado como cliente.", alert=True)
-                logging.error(f"Cliente {user_id} no encontrado para renovar")
-                return
-            flows[user_id]["client_slug"] = row["slug"]
-        else:
-            with cx() as c:
-                cur = c.cursor()
-                cur.execute("SELECT slug FROM clients WHERE reseller_id=?", (str(user_id),))
-                slugs = [x["slug"] for x in cur.fetchall()]
-            if not slugs:
-                await ev.answer("📭 No tienes clientes registrados.", alert=True)
-                logging.info(f"Reseller {user_id} no tiene clientes para renovar")
-                return
-            await ev.edit("👥 **Elige un cliente para renovar**:", buttons=inline_pick_client(slugs))
+    log.debug("Callback recibido de %s: %r", ev.sender_id, ev.data)
+    await callbacks.dispatch(ev)
+
+# Seleccionar plan de reseller
+@callbacks.action("pay.plan", "pay")
+async def cb_pay_plan(ev, f):
+    snap = settings_snapshot()
+    txt, btn = inline_plans_reseller(snap.prices, snap.prices["usd_to_cup"], snap.rev)
+    await ev.edit(txt, buttons=btn)
+    log.info("Planes de reseller mostrados a %s", f.uid)
+
+# Seleccionar plan específico de reseller
+@callbacks.action("pay.res", "pay")
+async def cb_pay_res(ev, f, code):
+    pr = prices()
+    if code not in ("res_b", "res_p", "res_e"):
+        return
+    usd = pr[code]
+    cup = int(usd * pr["usd_to_cup"])
+    flows.update(f.uid, step="pay_method", plan_code=code, amount_usd=usd, amount_cup=cup, item_id=str(f.uid))
+    txt, btn = inline_pay_methods(usd, cup)
+    await ev.edit(txt, buttons=btn)
+    log.info("Métodos de pago mostrados a %s para plan %s", f.uid, code)
+
+# Renovar cliente: elegir cliente
+@callbacks.action("pay.client", "pay")
+async def cb_pay_client(ev, f):
+    user_id = f.uid
+    if await user_role(user_id) == "client":
+        row = await db.query_one("SELECT slug FROM clients WHERE owner_id=?", (user_id,))
+        if not row:
+            await ev.answer("❌ No estás registrado como cliente.", alert=True)
+            log.error("Cliente %s no encontrado para renovar", user_id)
             return
-        with cx() as c:
-            cur = c.cursor()
-            pr = prices(cur)
-        txt, btn = inline_client_terms(pr)
-        await ev.edit(txt, buttons=btn)
-        logging.info(f"Términos de cliente mostrados a {user_id}")
-        return
-
-    # Reseller elige cliente
-    if data.startswith("pay:cli:") and user_id in flows and flows[user_id]["mode"] == "pay":
-        flows[user_id]["client_slug"] = data.split(":", 2)[2]
-        with cx() as c:
-            cur = c.cursor()
-            pr = prices(cur)
-        txt, btn = inline_client_terms(pr)
-        await ev.edit(txt, buttons=btn)
-        logging.info(f"Cliente seleccionado por reseller {user_id}: {flows[user_id]['client_slug']}")
-        return
-
-    # Elegir duración del plan de cliente
-    if data in ("pay:c:30", "pay:c:90", "pay:c:365") and user_id in flows and flows[user_id]["mode"] == "pay":
-        term = data.split(":")[2]
-        with cx() as c:
-            cur = c.cursor()
-            pr = prices(cur)
-            rate = pr["usd_to_cup"]
-            usd = {"30": pr["c30"], "90": pr["c90"], "365": pr["c365"]}[term]
-            cup = int(usd * rate)
-        flows[user_id].update({
-            "step": "pay_method",
-            "plan_code": f"client_{term}",
-            "amount_usd": usd,
-            "amount_cup": cup,
-            "item_id": flows[user_id].get("client_slug")
-        })
-        txt, btn = inline_pay_methods(usd, cup)
-        await ev.edit(txt, buttons=btn)
-        logging.info(f"Métodos de pago mostrados a {user_id} para cliente {term} días")
-        return
-
-    # Seleccionar método de pago
-    if data in ("pay:m:saldo", "pay:m:cup") and user_id in flows and flows[user_id]["mode"] == "pay":
-        mtype = "saldo" if data.endswith("saldo") else "cup"
-        f = flows[user_id]
-        f["method"] = mtype
-        f["step"] = "receipt"
-        ps = get_setting("pay_text_saldo")
-        pc = get_setting("pay_text_cup")
-        txt = (MSG_PAYMENT_SALDO.format(txt=ps, monto_saldo=f["amount_cup"]) if mtype == "saldo"
-               else MSG_PAYMENT_CUP.format(txt=pc, monto_cup=f["amount_cup"]))
-        await ev.edit(txt, buttons=btn_send_receipt())
-        logging.info(f"Método de pago seleccionado por {user_id}: {mtype}")
-        return
-
-    # Subir comprobante
-    if data == "pay:receipt" and user_id in flows and flows[user_id]["mode"] == "pay":
-        flows[user_id]["await_receipt"] = True
-        await ev.answer("📎 Por favor, adjunta la imagen del comprobante en el chat.", alert=True)
-        logging.info(f"{user_id} solicitado para adjuntar comprobante")
-
-    # Seleccionar plan para cliente (boss)
-    if data in ("plan:estandar", "plan:plus", "plan:pro") and user_id in flows and flows[user_id]["mode"] == "newcli_boss":
-        plan_code = data.split(":")[1]
-        flows[user_id]["plan_code"] = f"plan_{plan_code}"
-        flows[user_id]["step"] = "duration_select"
-        with cx() as c:
-            cur = c.cursor()
-            pr = prices(cur)
-        txt, btn = inline_client_terms(pr)
-        await ev.edit(txt, buttons=btn)
-        logging.info(f"Plan seleccionado por boss {user_id}: {plan_code}")
-        return
-
-    # Seleccionar duración para cliente (boss)
-    if data in ("pay:c:30", "pay:c:90", "pay:c:365") and user_id in flows and flows[user_id]["mode"] == "newcli_boss":
-        term = data.split(":")[2]
-        days = {"30": 30, "90": 90, "365": 365}[term]
-        expires = (dt.date.today() + dt.timedelta(days=days)).isoformat()
-        with cx() as c:
-            cur = c.cursor()
-            cur.execute(
-                """INSERT INTO clients(slug, owner_id, username, reseller_id, plan, expires, created, workdir, svc_status)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (flows[user_id]["slug"], flows[user_id]["client_id"], None, flows[user_id]["rid"],
-                 flows[user_id]["plan_code"], expires, iso_now(), flows[user_id]["workdir"], "stopped")
-            )
-            c.commit()
-        await ev.edit(MSG_CLIENT_CREATED.format(slug=flows[user_id]["slug"], rid=flows[user_id]["rid"], expires=expires))
-        logging.info(f"Cliente creado por boss {user_id}: slug={flows[user_id]['slug']}, plan={flows[user_id]['plan_code']}")
-        try:
-            await bot.send_message(
-                flows[user_id]["client_id"],
-                f"🎉 **¡Bienvenido!**\nHas sido registrado como cliente.\nTu slug es `{flows[user_id]['slug']}` y tu plan `{flows[user_id]['plan_code']}` vence el `{expires}`.\nUsa /start para más detalles."
-            )
-        except Exception:
-            logging.warning(f"No se pudo notificar al cliente {flows[user_id]['client_id']}")
-        flows.pop(user_id, None)
+        flows.update(user_id, client_slug=row["slug"])
+    else:
+        rows = await db.query("SELECT slug FROM clients WHERE reseller_id=?", (str(user_id),))
+        slugs = [x["slug"] for x in rows]
+        if not slugs:
+            await ev.answer("📭 No tienes clientes registrados.", alert=True)
+            log.info("Reseller %s no tiene clientes para renovar", user_id)
+            return
+        await ev.edit("👥 **Elige un cliente para renovar**:", buttons=inline_pick_client(slugs))
+        return
+    snap = settings_snapshot()
+    txt, btn = inline_client_terms(snap.prices, snap.rev)
+    await ev.edit(txt, buttons=btn)
+    log.info("Términos de cliente mostrados a %s", user_id)
+
+# Reseller elige cliente
+@callbacks.action("pay.cli", "pay")
+async def cb_pay_cli(ev, f, slug):
+    flows.update(f.uid, client_slug=slug)
+    snap = settings_snapshot()
+    txt, btn = inline_client_terms(snap.prices, snap.rev)
+    await ev.edit(txt, buttons=btn)
+    log.info("Cliente seleccionado por reseller %s: %s", f.uid, slug)
+
+# Elegir duración del plan de cliente
+@callbacks.action("pay.term", "pay")
+async def cb_pay_term(ev, f, term):
+    pr = prices()
+    usd = {"30": pr["c30"], "90": pr["c90"], "365": pr["c365"]}.get(term)
+    if usd is None:
         return
+    cup = int(usd * pr["usd_to_cup"])
+    flows.update(f.uid, step="pay_method", plan_code=f"client_{term}",
+                 amount_usd=usd, amount_cup=cup, item_id=f.client_slug)
+    txt, btn = inline_pay_methods(usd, cup)
+    await ev.edit(txt, buttons=btn)
+    log.info("Métodos de pago mostrados a %s para cliente %s días", f.uid, term)
 
-    # Volver atrás
-    if data == "pay:back" and user_id in flows:
-        if flows[user_id]["mode"] == "pay":
-            flows[user_id]["step"] = "target"
-            await ev.edit(MSG_PAYMENT_PICK, buttons=[
-                [Button.inline("Plan Reseller", b"pay:plan"), Button.inline("Renovar Cliente", b"pay:client")]
-            ])
-        elif flows[user_id]["mode"] == "newcli_boss":
-            flows[user_id]["step"] = "client_id"
-            await ev.edit("🆕 **Crear Cliente como Boss**\nEnvía el **ID numérico** del cliente final:", buttons=kb_boss())
-        logging.info(f"{user_id} volvió atrás en el flujo")
+# Seleccionar método de pago
+@callbacks.action("pay.method", "pay")
+async def cb_pay_method(ev, f, mtype):
+    if mtype not in ("saldo", "cup"):
         return
+    flows.update(f.uid, method=mtype, step="receipt")
+    msg = (MSG_PAYMENT_SALDO.format(txt=markdown_text(get_setting("pay_text_saldo")), monto_saldo=f.amount_cup)
+           if mtype == "saldo"
+           else MSG_PAYMENT_CUP.format(txt=markdown_text(get_setting("pay_text_cup")), monto_cup=f.amount_cup))
+    await edit(ev, msg, btn_send_receipt())
+    log.info("Método de pago seleccionado por %s: %s", f.uid, mtype)
+
+# Subir comprobante
+@callbacks.action("pay.receipt", "pay")
+async def cb_pay_receipt(ev, f):
+    flows.update(f.uid, await_receipt=True)
+    await ev.answer("📎 Por favor, adjunta la imagen del comprobante en el chat.", alert=True)
+    log.info("%s solicitado para adjuntar comprobante", f.uid)
+
+# Seleccionar plan para cliente (boss)
+@callbacks.action("plan", "newcli_boss")
+async def cb_boss_plan(ev, f, plan_code):
+    if plan_code not in ("estandar", "plus", "pro"):
+        return
+    flows.update(f.uid, plan_code=f"plan_{plan_code}", step="duration_select")
+    snap = settings_snapshot()
+    txt, btn = inline_client_terms(snap.prices, snap.rev)
+    await ev.edit(txt, buttons=btn)
+    log.info("Plan seleccionado por boss %s: %s", f.uid, plan_code)
+
+# Seleccionar duración para cliente (boss)
+@callbacks.action("pay.term", "newcli_boss")
+async def cb_boss_term(ev, f, term):
+    days = {"30": 30, "90": 90, "365": 365}.get(term)
+    if days is None:
+        return
+    expires = (dt.date.today() + dt.timedelta(days=days)).isoformat()
+    slug = await db.transaction(allocate_client, f.client_id, f.rid, f.plan_code, expires)
+    invalidate_role(f.client_id)
+    expiry.schedule(slug, f.client_id, expires)
+    await edit(ev, MSG_CLIENT_CREATED.format(slug=slug, rid=f.rid, plan=f.plan_code, expires=expires))
+    log.info("Cliente creado por boss %s: slug=%s, plan=%s", f.uid, slug, f.plan_code)
+    await notify(f.client_id, MSG_CLIENT_WELCOME.format(slug=slug, plan=f.plan_code, expires=expires))
+    flows.pop(f.uid)
+
+# Volver atrás
+@callbacks.action("pay.back", "pay")
+async def cb_pay_back(ev, f):
+    flows.update(f.uid, step="target")
+    await edit(ev, MSG_PAYMENT_PICK, inline_pay_pick())
+    log.info("%s volvió atrás en el flujo", f.uid)
+
+@callbacks.action("pay.back", "newcli_boss")
+async def cb_boss_back(ev, f):
+    flows.update(f.uid, step="client_id")
+    await ev.edit("🆕 **Crear Cliente como Boss**\nEnvía el **ID numérico** del cliente final:", buttons=kb_boss())
+    log.info("%s volvió atrás en el flujo", f.uid)
 
 # ---------- Entrada de Datos (Texto/Medios) ----------
-@bot.on(events.NewMessage)
+def _tx_create_reseller_client(cur, rid: str, cid: int):
+    """
+    Comprueba el límite del plan del reseller y crea el cliente en la misma transacción
+    (BEGIN IMMEDIATE, con el contador resellers.client_count).
+
+    Returns:
+        tuple: (reseller, límite, usados, slug, vencimiento); slug es None si no se creó.
+    """
+    begin_write(cur)  # Nadie más puede crear clientes entre la comprobación y el INSERT
+    cur.execute("SELECT plan, started, expires, client_count FROM resellers WHERE id=?", (rid,))
+    reseller = cur.fetchone()
+    if not reseller:
+        return None, 0, 0, None, None
+    lim = limits().get(reseller["plan"], 0)
+    used = reseller["client_count"]
+    if lim and used >= lim:
+        return reseller, lim, used, None, None
+    expires = (dt.date.today() + dt.timedelta(days=30)).isoformat()
+    slug = allocate_client(cur, cid, rid, "plan_estandar", expires)
+    return reseller, lim, used, slug, expires
+
+@router.fallback
 async def flows_input(ev):
     """
     Maneja entradas de texto o medios en los flujos de conversación (crear cliente, subir comprobante).
@@ -642,143 +802,245 @@ async def flows_input(ev):
         ev: Evento con el mensaje del usuario.
     """
     user_id = ev.sender_id
-    if user_id not in flows:
+    f = flows.get(user_id)
+    if f is None:
         return
-    f = flows[user_id]
 
     # Crear cliente (reseller)
-    if f.get("mode") == "newcli" and f.get("step") == "client_id":
+    if f.mode == "newcli" and f.step == "client_id":
         try:
             cid = int((ev.raw_text or "").strip())
         except ValueError:
             await reply(ev, MSG_ERROR_INVALID_ID, kb_reseller())
-            logging.error(f"ID inválido proporcionado por reseller {user_id}: {ev.raw_text}")
+            log.error("ID inválido proporcionado por reseller %s: %s", user_id, ev.raw_text)
             return
-        with cx() as c:
-            cur = c.cursor()
-            cur.execute("SELECT plan, started, expires FROM resellers WHERE id=?", (f["rid"],))
-            reseller = cur.fetchone()
-            if not reseller:
-                await reply(ev, "❌ **Error**: No eres un reseller válido.", kb_reseller())
-                flows.pop(user_id, None)
-                logging.error(f"Reseller {user_id} no encontrado")
-                return
-            lims = limits(cur)
-            lim = lims.get(reseller["plan"], 0)
-            cur.execute("SELECT COUNT(*) AS n FROM clients WHERE reseller_id=?", (f["rid"],))
-            used = cur.fetchone()["n"]
-            if lim and used >= lim:
-                await reply(ev, MSG_RES_LIMIT.format(limit=lim), kb_reseller())
-                flows.pop(user_id, None)
-                logging.info(f"Límite de clientes alcanzado por reseller {user_id}: {used}/{lim}")
-                return
-            slug = slugify(str(cid))
-            base = slug
-            i = 2
-            while True:
-                cur.execute("SELECT 1 FROM clients WHERE slug=?", (slug,))
-                if not cur.fetchone():
-                    break
-                slug = f"{base}{i}"
-                i += 1
-            wdir = ensure_client_workdir(slug)
-            expires = (dt.date.today() + dt.timedelta(days=30)).isoformat()
-            cur.execute(
-                """INSERT INTO clients(slug, owner_id, username, reseller_id, plan, expires, created, workdir, svc_status)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (slug, cid, None, f["rid"], "plan_estandar", expires, iso_now(), str(wdir), "stopped")
-            )
-            c.commit()
-        await reply(ev, MSG_CLIENT_CREATED.format(slug=slug, rid=f["rid"], expires=expires), kb_reseller())
-        logging.info(f"Cliente creado por reseller {user_id}: slug={slug}, vence={expires}")
-        try:
-            await bot.send_message(
-                cid,
-                f"🎉 **¡Bienvenido!**\nHas sido registrado como cliente.\nTu slug es `{slug}` y tu plan vence el `{expires}`.\nUsa /start para más detalles."
-            )
-        except Exception:
-            logging.warning(f"No se pudo notificar al cliente {cid}")
-        flows.pop(user_id, None)
+        reseller, lim, used, slug, expires = await db.transaction(_tx_create_reseller_client, f.rid, cid)
+        if slug is not None:
+            invalidate_role(cid)
+            expiry.schedule(slug, cid, expires)
+        if not reseller:
+            await reply(ev, "❌ **Error**: No eres un reseller válido.", kb_reseller())
+            flows.pop(user_id)
+            log.error("Reseller %s no encontrado", user_id)
+            return
+        if slug is None:
+            await reply(ev, MSG_RES_LIMIT.format(limit=lim), kb_reseller())
+            flows.pop(user_id)
+            log.info("Límite de clientes alcanzado por reseller %s: %s/%s", user_id, used, lim)
+            return
+        await reply(ev, MSG_CLIENT_CREATED.format(slug=slug, rid=f.rid, plan="plan_estandar", expires=expires), kb_reseller())
+        log.info("Cliente creado por reseller %s: slug=%s, vence=%s", user_id, slug, expires)
+        await notify(cid, MSG_CLIENT_WELCOME.format(slug=slug, plan="plan_estandar", expires=expires))
+        flows.pop(user_id)
         return
 
     # Crear cliente (boss)
-    if f.get("mode") == "newcli_boss" and f.get("step") == "client_id":
+    if f.mode == "newcli_boss" and f.step == "client_id":
         try:
             cid = int((ev.raw_text or "").strip())
         except ValueError:
             await reply(ev, MSG_ERROR_INVALID_ID, kb_boss())
-            logging.error(f"ID inválido proporcionado por boss {user_id}: {ev.raw_text}")
+            log.error("ID inválido proporcionado por boss %s: %s", user_id, ev.raw_text)
             return
-        with cx() as c:
-            cur = c.cursor()
-            slug = slugify(str(cid))
-            base = slug
-            i = 2
-            while True:
-                cur.execute("SELECT 1 FROM clients WHERE slug=?", (slug,))
-                if not cur.fetchone():
-                    break
-                slug = f"{base}{i}"
-                i += 1
-            wdir = ensure_client_workdir(slug)
-        flows[user_id].update({"client_id": cid, "slug": slug, "workdir": str(wdir), "step": "plan_select"})
+        flows.update(user_id, client_id=cid, step="plan_select")
         await ev.reply("🏷 **Selecciona el plan para el cliente:**", buttons=inline_client_plans())
-        logging.info(f"Boss {user_id} proporcionó ID de cliente: {cid}, slug={slug}")
+        log.info("Boss %s proporcionó ID de cliente: %s", user_id, cid)
         return
 
     # Recepción de comprobante de pago
-    if f.get("mode") == "pay" and f.get("await_receipt"):
+    if f.mode == "pay" and f.await_receipt:
         if not (ev.photo or ev.document):
             await reply(ev, "📎 **Error**: Por favor, adjunta una imagen del comprobante.")
-            logging.error(f"Comprobante inválido enviado por {user_id}")
+            log.error("Comprobante inválido enviado por %s", user_id)
             return
-        with cx() as c:
-            cur = c.cursor()
-            pid = new_id()
-            cur.execute(
-                """INSERT INTO payments(id, user_id, role, type, amount_usd, amount_cup, plan, item_id, receipt_msg_id, status, created, rate_used)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (pid, user_id, f["as"], f["method"], f["amount_usd"], f["amount_cup"],
-                 f.get("plan_code", "res_b"), str(f.get("item_id") or user_id),
-                 ev.message.id, "pending", iso_now(), prices(cur)["usd_to_cup"])
-            )
-            c.commit()
+        pid = new_id()
+        await db.transaction(lambda cur: cur.execute(
+            """INSERT INTO payments(id, user_id, role, type, amount_usd, amount_cup, plan, item_id, receipt_msg_id, status, created, rate_used)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (pid, user_id, f.role, f.method, f.amount_usd, f.amount_cup,
+             f.plan_code or "res_b", str(f.item_id or user_id),
+             ev.message.id, "pending", iso_now(), prices()["usd_to_cup"])
+        ))
+        receipts.submit(pid, ev.message)
         await reply(ev, MSG_PAYMENT_SUCCESS.format(
-            pid=pid, amount_usd=f["amount_usd"], amount_cup=f["amount_cup"], method=f["method"], plan=f["plan_code"]
+            pid=pid, amount_usd=f.amount_usd, amount_cup=f.amount_cup, method=f.method, plan=f.plan_code
         ))
-        logging.info(f"Pago registrado por {user_id}: ID={pid}, plan={f['plan_code']}")
-        boss_id = int(get_setting("owner_id", "0") or 0)
-        if boss_id:
-            try:
-                await bot.send_message(
-                    boss_id,
-                    f"🧾 **Nuevo pago pendiente**\n- Usuario: `{user_id}`\n- Monto: {f['amount_usd']} USD ({f['amount_cup']} CUP)\n- Método: {f['method']}\n- ID: `{pid}`\n\nUsa /approve `{pid}` o /reject `{pid}` <motivo> para gestionarlo."
-                )
-            except Exception:
-                logging.warning(f"No se pudo notificar al boss {boss_id}")
-        flows.pop(user_id, None)
+        log.info("Pago registrado por %s: ID=%s, plan=%s", user_id, pid, f.plan_code)
+        # El aviso al boss sale cuando el comprobante está descargado y comparado (ver _alert_payment)
+        flows.pop(user_id)
         return
 
+# ---------- Pagos: Aviso al boss ----------
+def _fmt_duplicates(dups, locale: str) -> Rendered:
+    """
+    Advertencia de comprobante repetido para el aviso de pago pendiente.
+    """
+    lines = [MSG_PAYMENT_DUPLICATES.render(locale)]
+    for d in dups:
+        if d.exact:
+            line = MSG_DUPLICATE_EXACT.format(pid=d.pid, user_id=d.user_id, status=d.status)
+        else:
+            line = MSG_DUPLICATE_SIMILAR.format(pid=d.pid, user_id=d.user_id, status=d.status, distance=d.distance)
+        lines.append(line.render(locale))
+    return join(lines, "\n")
+
+
+async def _alert_payment(pid: str, receipt=None) -> None:
+    """
+    Avisa al boss de un pago pendiente, señalando si el comprobante ya se usó en otro pago.
+
+    Args:
+        pid (str): ID del pago.
+        receipt: Receipt descargado, o None si no se pudo descargar.
+    """
+    boss_id = int(get_setting("owner_id", "0") or 0)
+    if not boss_id:
+        return
+    p = await db.query_one(
+        "SELECT user_id, status, type, amount_usd, amount_cup FROM payments WHERE id=?", (pid,)
+    )
+    if not p or p["status"] != "pending":
+        return
+    dups = []
+    if receipt is not None:
+        dups = await db.read(find_duplicates, pid, receipt.sha256, receipt.dhash)
+        if dups:
+            log.warning("Pago %s: comprobante repetido de %s", pid, ', '.join(d.pid for d in dups))
+    locale = await user_locale(boss_id)
+    notes = []
+    if dups:
+        notes.append(_fmt_duplicates(dups, locale))
+    if receipt is None:
+        notes.append(MSG_RECEIPT_MISSING.render(locale))
+    text = MSG_PAYMENT_PENDING.format(
+        user_id=p["user_id"], amount_usd=p["amount_usd"], amount_cup=p["amount_cup"],
+        method=p["type"], pid=pid, notes=join(["", *notes], "\n\n")
+    )
+    await notify(boss_id, text.render(locale), PRIO_ALERT)
+
+
+async def _receipt_stored(receipt) -> None:
+    await _alert_payment(receipt.pid, receipt)
+
+
+async def _receipt_failed(pid: str) -> None:
+    await _alert_payment(pid)
+
+
+receipts.on_stored = _receipt_stored
+receipts.on_failed = _receipt_failed
+
+
 # ---------- Pagos: Listar/Aprobar/Rechazar (Boss) ----------
-@bot.on(events.NewMessage(pattern=r"^💳 Pagos$|^/payments$"))
+def _payments_view(flt: PaymentFilter, page: PaymentsPage):
+    """
+    Texto y botones de una página de pagos.
+    """
+    if flt == PaymentFilter(status="approved"):
+        title = "🧾 **Facturas**"
+    elif flt == PaymentFilter():
+        title = "🧾 **Pagos recientes**"
+    else:
+        title = "🧾 **Pagos** (" + ", ".join(v for v in (flt.status, flt.role, flt.method) if v) + ")"
+    nav = inline_payments_nav(flt.code, page.first_id, page.last_id, page.newer, page.older)
+    return fmt_payments_pretty(page.rows, title), nav
+
+async def show_payments(ev, flt: PaymentFilter) -> None:
+    """
+    Envía la primera página (la más reciente) de pagos que cumplen el filtro.
+    """
+    page = await db.read(payments_page, flt)
+    text, nav = _payments_view(flt, page)
+    await reply(ev, text, nav or kb_boss())
+
+@router.text("💳 Pagos")
+@router.command("payments", r"((?:\w+\s*)*)")
 async def list_payments(ev):
     """
-    Muestra los últimos 30 pagos al administrador.
+    Muestra los pagos al administrador, paginados y del más reciente al más antiguo.
     
     Args:
-        ev: Evento con el comando "Pagos" o /payments.
+        ev: Evento con el comando "Pagos" o /payments [estado] [rol] [método]
+            (ej. /payments pending reseller cup).
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT * FROM payments ORDER BY created DESC LIMIT 30")
-        rows = cur.fetchall()
-    await reply(ev, fmt_payments_pretty(rows), kb_boss())
-    logging.info(f"Lista de pagos solicitada por boss {ev.sender_id}")
+    words = ev.pattern_match.group(1).split() if ev.pattern_match else []
+    try:
+        flt = PaymentFilter.parse(words)
+    except ValueError as e:
+        await reply(ev, f"❌ **Error**: {e}\nUso: `/payments [pending|approved|rejected] [client|reseller] [saldo|cup]`", kb_boss())
+        return
+    await show_payments(ev, flt)
+    log.info("Lista de pagos solicitada por boss %s (filtro %s)", ev.sender_id, flt.code)
+
+@callbacks.action("pays", flt=PaymentFilter.from_code)
+async def cb_payments_page(ev, flt, direction, pid):
+    """
+    Navega entre páginas de pagos (direction: "n" más antiguos, "p" más recientes).
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await ev.answer("⛔ Sin permiso.", alert=True)
+        return
+    if direction == "n":
+        page = await db.read(payments_page, flt, before=pid)
+    else:
+        page = await db.read(payments_page, flt, after=pid)
+    if not page.rows:
+        await ev.answer("📭 No hay más pagos.")
+        return
+    text, nav = _payments_view(flt, page)
+    await ev.edit(text, buttons=nav or None)
 
-@bot.on(events.NewMessage(pattern=r"^/approve\s+([a-f0-9]{10,})$"))
+def _tx_approve(cur, pid: str, actor_id: int):
+    """
+    Aprueba un pago pendiente y aplica sus efectos en una sola transacción.
+
+    Returns:
+        tuple: (fila del pago tal como estaba antes de aprobarse o None si no existe,
+        (slug, owner_id, nuevo vencimiento) si se renovó un cliente o None).
+    """
+    cur.execute("SELECT * FROM payments WHERE id=?", (pid,))
+    p = cur.fetchone()
+    renewed = None
+    if not p or p["status"] != "pending":
+        return p, renewed
+    if p["plan"].startswith("res_") and p["role"] == "reseller":
+        rid = p["item_id"]
+        cur.execute("SELECT plan, started, expires FROM resellers WHERE id=?", (rid,))
+        r = cur.fetchone()
+        if r:
+            pr = prices()
+            old_base = pr[r["plan"]]
+            new_base = pr[p["plan"]]
+            extra = prorate(old_base, new_base, r["started"], r["expires"])
+            cur.execute("UPDATE resellers SET plan=? WHERE id=?", (p["plan"], rid))
+            cur.execute(
+                "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)",
+                (actor_id, "approve_reseller_upgrade",
+                 f"rid={rid}; old={r['plan']}; new={p['plan']}; extra={extra}", iso_now())
+            )
+    elif p["plan"].startswith("client_"):
+        slug = p["item_id"]
+        days = {"client_30": 30, "client_90": 90, "client_365": 365}[p["plan"]]
+        cur.execute("SELECT owner_id, expires FROM clients WHERE slug=?", (slug,))
+        r = cur.fetchone()
+        base_date = dt.date.fromisoformat(r["expires"]) if r else dt.date.today()
+        if base_date < dt.date.today():
+            base_date = dt.date.today()
+        new_exp = (base_date + dt.timedelta(days=days)).isoformat()
+        cur.execute("UPDATE clients SET expires=? WHERE slug=?", (new_exp, slug))
+        cur.execute(
+            "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)",
+            (actor_id, "approve_client_renew", f"slug={slug}; +{days}d -> {new_exp}", iso_now())
+        )
+        if r:
+            renewed = (slug, r["owner_id"], new_exp)
+    cur.execute("UPDATE payments SET status='approved' WHERE id=?", (pid,))
+    return p, renewed
+
+@router.command("approve", r"([a-f0-9]{10,})")
 async def approve(ev):
     """
     Aprueba un pago pendiente y aplica los cambios correspondientes (solo boss).
@@ -786,62 +1048,43 @@ async def approve(ev):
     Args:
         ev: Evento con el comando /approve <id>.
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     pid = ev.pattern_match.group(1)
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT * FROM payments WHERE id=?", (pid,))
-        p = cur.fetchone()
-        if not p:
-            await reply(ev, f"❌ **Error**: No existe el pago con ID `{pid}`.", kb_boss())
-            logging.error(f"Pago no encontrado para aprobar: {pid}")
-            return
-        if p["status"] != "pending":
-            await reply(ev, f"⚠️ **Error**: El pago `{pid}` no está pendiente.", kb_boss())
-            logging.error(f"Intento de aprobar pago no pendiente: {pid}")
-            return
-
-        if p["plan"].startswith("res_") and p["role"] == "reseller":
-            rid = p["item_id"]
-            cur.execute("SELECT plan, started, expires FROM resellers WHERE id=?", (rid,))
-            r = cur.fetchone()
-            if r:
-                pr = prices(cur)
-                old_base = pr[r["plan"]]
-                new_base = pr[p["plan"]]
-                extra = prorate(old_base, new_base, r["started"], r["expires"])
-                cur.execute("UPDATE resellers SET plan=? WHERE id=?", (p["plan"], rid))
-                cur.execute(
-                    "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)",
-                    (ev.sender_id, "approve_reseller_upgrade",
-                     f"rid={rid}; old={r['plan']}; new={p['plan']}; extra={extra}", iso_now())
-                )
-        elif p["plan"].startswith("client_"):
-            slug = p["item_id"]
-            days = {"client_30": 30, "client_90": 90, "client_365": 365}[p["plan"]]
-            cur.execute("SELECT expires FROM clients WHERE slug=?", (slug,))
-            r = cur.fetchone()
-            base_date = dt.date.fromisoformat(r["expires"]) if r else dt.date.today()
-            if base_date < dt.date.today():
-                base_date = dt.date.today()
-            new_exp = (base_date + dt.timedelta(days=days)).isoformat()
-            cur.execute("UPDATE clients SET expires=? WHERE slug=?", (new_exp, slug))
-            cur.execute(
-                "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)",
-                (ev.sender_id, "approve_client_renew", f"slug={slug}; +{days}d -> {new_exp}", iso_now())
-            )
-        cur.execute("UPDATE payments SET status='approved' WHERE id=?", (pid,))
-        c.commit()
+    p, renewed = await db.transaction(_tx_approve, pid, ev.sender_id)
+    if not p:
+        await reply(ev, f"❌ **Error**: No existe el pago con ID `{pid}`.", kb_boss())
+        log.error("Pago no encontrado para aprobar: %s", pid)
+        return
+    if p["status"] != "pending":
+        await reply(ev, f"⚠️ **Error**: El pago `{pid}` no está pendiente.", kb_boss())
+        log.error("Intento de aprobar pago no pendiente: %s", pid)
+        return
+    if renewed:
+        expiry.schedule(*renewed)
     await reply(ev, f"✅ **Pago aprobado**\nID: `{pid}`\nEl usuario ha sido notificado.", kb_boss())
-    logging.info(f"Pago aprobado por boss {ev.sender_id}: ID={pid}")
-    try:
-        await bot.send_message(p["user_id"], f"✅ **¡Pago aprobado!**\nTu plan `{p['plan']}` ha sido actualizado. Gracias por tu pago.")
-    except Exception:
-        logging.warning(f"No se pudo notificar al usuario {p['user_id']} de aprobación")
+    log.info("Pago aprobado por boss %s: ID=%s", ev.sender_id, pid)
+    await notify(p["user_id"], MSG_PAYMENT_APPROVED.format(plan=p["plan"]))
+
+def _tx_reject(cur, pid: str, actor_id: int, reason: str):
+    """
+    Marca un pago pendiente como rechazado y lo registra en la auditoría.
 
-@bot.on(events.NewMessage(pattern=r"^/reject\s+([a-f0-9]{10,})\s*(.*)$"))
+    Returns:
+        La fila del pago (user_id, status previo) o None si no existe.
+    """
+    cur.execute("SELECT user_id, status FROM payments WHERE id=?", (pid,))
+    p = cur.fetchone()
+    if p and p["status"] == "pending":
+        cur.execute("UPDATE payments SET status='rejected' WHERE id=?", (pid,))
+        cur.execute(
+            "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)",
+            (actor_id, "reject_payment", f"pid={pid}; reason={reason}", iso_now())
+        )
+    return p
+
+@router.command("reject", r"([a-f0-9]{10,})\s*(.*)")
 async def reject(ev):
     """
     Rechaza un pago pendiente con un motivo (solo boss).
@@ -849,73 +1092,384 @@ async def reject(ev):
     Args:
         ev: Evento con el comando /reject <id> [motivo].
     """
-    if role_for(ev.sender_id) != "boss":
+    if await user_role(ev.sender_id) != "boss":
         await reply(ev, MSG_ERROR_NO_PERMISSION)
         return
     pid = ev.pattern_match.group(1)
     reason = (ev.pattern_match.group(2) or "Sin motivo").strip()
-    with cx() as c:
-        cur = c.cursor()
-        cur.execute("SELECT user_id, status FROM payments WHERE id=?", (pid,))
-        p = cur.fetchone()
-        if not p:
-            await reply(ev, f"❌ **Error**: No existe el pago con ID `{pid}`.", kb_boss())
-            logging.error(f"Pago no encontrado para rechazar: {pid}")
-            return
-        if p["status"] != "pending":
-            await reply(ev, f"⚠️ **Error**: El pago `{pid}` no está pendiente.", kb_boss())
-            logging.error(f"Intento de rechazar pago no pendiente: {pid}")
-            return
-        cur.execute("UPDATE payments SET status='rejected' WHERE id=?", (pid,))
-        c.commit()
+    p = await db.transaction(_tx_reject, pid, ev.sender_id, reason)
+    if not p:
+        await reply(ev, f"❌ **Error**: No existe el pago con ID `{pid}`.", kb_boss())
+        log.error("Pago no encontrado para rechazar: %s", pid)
+        return
+    if p["status"] != "pending":
+        await reply(ev, f"⚠️ **Error**: El pago `{pid}` no está pendiente.", kb_boss())
+        log.error("Intento de rechazar pago no pendiente: %s", pid)
+        return
     await reply(ev, f"❌ **Pago rechazado**\nID: `{pid}`\nMotivo: {reason}", kb_boss())
-    logging.info(f"Pago rechazado por boss {ev.sender_id}: ID={pid}, motivo={reason}")
+    log.info("Pago rechazado por boss %s: ID=%s, motivo=%s", ev.sender_id, pid, reason)
+    await notify(p["user_id"], MSG_PAYMENT_REJECTED.format(pids=code_list([pid]), reason=reason))
+
+@router.command("receipt", r"([a-f0-9]{10,})")
+async def show_receipt(ev):
+    """
+    Envía al boss el comprobante de un pago desde el disco local (o reenvía el mensaje
+    original si aún no se ha descargado).
+    
+    Args:
+        ev: Evento con el comando /receipt <id>.
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    pid = ev.pattern_match.group(1)
+    p = await db.query_one(
+        "SELECT user_id, status, amount_usd, receipt_msg_id, receipt_path, receipt_sha256 FROM payments WHERE id=?",
+        (pid,)
+    )
+    if not p:
+        await reply(ev, f"❌ **Error**: No existe el pago con ID `{pid}`.", kb_boss())
+        return
+    caption = f"🧾 Pago `{pid}` · {p['amount_usd']} USD · {p['status']} · usuario `{p['user_id']}`"
+    if p["receipt_path"]:
+        path = receipt_path(p["receipt_path"])
+        if path.exists():
+            await ev.reply(caption, file=str(path))
+            log.info("Comprobante de %s enviado desde disco al boss %s", pid, ev.sender_id)
+            return
+        log.warning("Comprobante de %s registrado pero no encontrado en %s", pid, path)
+    if p["receipt_msg_id"]:
+        await reply(ev, caption + "\n(aún no descargado; reenviando el original)", kb_boss())
+        await bot.forward_messages(ev.chat_id, p["receipt_msg_id"], from_peer=p["user_id"])
+        return
+    await reply(ev, f"📭 El pago `{pid}` no tiene comprobante.", kb_boss())
+
+# ---------- Exportaciones (Boss) ----------
+EXPORT_MAX_UPLOAD = 50 * 1024 * 1024   # Límite de Telegram para archivos enviados por bots
+EXPORT_PART_KB = 512                   # Tamaño de cada parte de la subida
+_export_lock = asyncio.Lock()          # Una exportación a la vez
+
+@router.command("export", r"(\w+)((?:\s+\S+)*)")
+async def export_data(ev):
+    """
+    Exporta pagos, clientes o auditoría a un CSV/NDJSON comprimido y lo envía como documento.
+    
+    Uso: /export <payments|clients|audit> [csv|ndjson] [since=AAAA-MM-DD] [until=AAAA-MM-DD]
+    [status=...] [reseller=ID]
+    
+    Args:
+        ev: Evento con el comando /export.
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    kind = ev.pattern_match.group(1).lower()
+    words = ev.pattern_match.group(2).split()
+    fmt = words.pop(0).lower() if words and words[0].lower() in EXPORT_FORMATS else "csv"
     try:
-        await bot.send_message(p["user_id"], f"❌ **Pago rechazado**\nID: `{pid}`\nMotivo: {reason}\nPor favor, revisa y vuelve a intentarlo.")
-    except Exception:
-        logging.warning(f"No se pudo notificar al usuario {p['user_id']} de rechazo")
+        if kind not in EXPORT_KINDS:
+            raise ValueError(f"Exportación desconocida: {kind} (usa {', '.join(EXPORT_KINDS)})")
+        flt = ExportFilter.parse(words)
+    except ValueError as e:
+        await reply(ev, f"❌ **Error**: {e}\nUso: `/export payments [csv|ndjson] [since=AAAA-MM-DD] "
+                        f"[until=AAAA-MM-DD] [status=...] [reseller=ID]`", kb_boss())
+        return
+    if _export_lock.locked():
+        await reply(ev, "⏳ Ya hay una exportación en curso; espera a que termine.", kb_boss())
+        return
+    async with _export_lock:
+        await reply(ev, f"⏳ Exportando **{kind}** ({fmt})...", kb_boss())
+        try:
+            result = await export(kind, fmt, flt)
+        except (ValueError, RuntimeError) as e:
+            await reply(ev, f"❌ **Error**: {e}", kb_boss())
+            return
+        caption = f"📦 {kind} · {result.rows} filas · {result.size / 1024:.0f} KB"
+        if result.size > EXPORT_MAX_UPLOAD:
+            await reply(ev, f"{caption}\nEl archivo supera el límite de Telegram; está en el servidor:\n`{result.path}`", kb_boss())
+            return
+        # Subida por partes directamente desde el disco (sin cargar el archivo en memoria)
+        try:
+            handle = await bot.upload_file(str(result.path), part_size_kb=EXPORT_PART_KB)
+        finally:
+            result.path.unlink(missing_ok=True)  # Ya está en Telegram (o la subida falló)
+        await bot.send_file(ev.chat_id, handle, caption=caption, force_document=True)
+    log.info("Exportación %s (%s, %s filas) enviada al boss %s", kind, fmt, result.rows, ev.sender_id)
+
+# ---------- Pagos: Aprobación/Rechazo masivos (Boss) ----------
+BULK_MAX = 100      # Pagos por comando masivo
+REVIEW_SIZE = 20    # Pagos pendientes en la vista de selección
+_PID = re.compile(r"[a-f0-9]{10,}")
+
+def _tx_approve_many(cur, pids, actor_id: int):
+    """
+    Aprueba varios pagos en una sola transacción.
+
+    Returns:
+        tuple: ([(pago, renovación)] de los aprobados, [ids omitidos por no existir o no estar pendientes]).
+    """
+    begin_write(cur)
+    done, skipped = [], []
+    for pid in pids:
+        p, renewed = _tx_approve(cur, pid, actor_id)
+        if p and p["status"] == "pending":
+            done.append((p, renewed))
+        else:
+            skipped.append(pid)
+    return done, skipped
+
+def _tx_reject_many(cur, pids, actor_id: int, reason: str):
+    """
+    Rechaza varios pagos pendientes en una sola transacción, con una fila de auditoría por pago.
+
+    Returns:
+        tuple: ([(id, user_id)] de los rechazados, [ids omitidos]).
+    """
+    begin_write(cur)
+    marks = ",".join("?" * len(pids))
+    cur.execute(f"SELECT id, user_id FROM payments WHERE status='pending' AND id IN ({marks})", list(pids))
+    done = [(r["id"], r["user_id"]) for r in cur.fetchall()]
+    found = {pid for pid, _ in done}
+    now = iso_now()
+    cur.executemany("UPDATE payments SET status='rejected' WHERE id=?", [(pid,) for pid, _ in done])
+    cur.executemany(
+        "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)",
+        [(actor_id, "reject_payment", f"pid={pid}; reason={reason}", now) for pid, _ in done]
+    )
+    return done, [pid for pid in pids if pid not in found]
+
+async def _after_approve_many(done) -> None:
+    """
+    Reprograma los vencimientos renovados y encola un aviso por usuario, en su idioma.
+    """
+    by_user = {}
+    for p, renewed in done:
+        if renewed:
+            expiry.schedule(*renewed)
+        by_user.setdefault(p["user_id"], []).append(p["plan"])
+    await notify_many({
+        uid: MSG_PAYMENT_APPROVED.format(plan=plans[0]) if len(plans) == 1 else
+        MSG_PAYMENTS_APPROVED.format(count=len(plans), plans=code_list(plans))
+        for uid, plans in by_user.items()
+    })
+
+async def _after_reject_many(done, reason: str) -> None:
+    """
+    Encola un aviso por usuario con los pagos rechazados, en su idioma.
+    """
+    by_user = {}
+    for pid, uid in done:
+        by_user.setdefault(uid, []).append(pid)
+    await notify_many({
+        uid: MSG_PAYMENT_REJECTED.format(pids=code_list(pids), reason=reason)
+        for uid, pids in by_user.items()
+    })
+
+def _bulk_summary(verb: str, done, skipped) -> str:
+    text = f"{verb}: **{len(done)}**"
+    if skipped:
+        text += f"\n⚠️ Omitidos (no existen o no están pendientes): {', '.join(f'`{x}`' for x in skipped[:30])}"
+    return text
+
+@router.command("approve_many", r"([a-f0-9,\s]+)")
+async def approve_many(ev):
+    """
+    Aprueba varios pagos pendientes de una vez (solo boss).
+    
+    Args:
+        ev: Evento con el comando /approve_many <id> <id> ... (separados por espacios o comas).
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    pids = list(dict.fromkeys(_PID.findall(ev.pattern_match.group(1))))[:BULK_MAX]
+    if not pids:
+        await reply(ev, "❌ **Error**: Indica al menos un ID de pago.", kb_boss())
+        return
+    done, skipped = await db.transaction(_tx_approve_many, pids, ev.sender_id)
+    await _after_approve_many(done)
+    await reply(ev, _bulk_summary("✅ **Pagos aprobados**", done, skipped), kb_boss())
+    log.info("Aprobación masiva por boss %s: %s aprobados, %s omitidos", ev.sender_id, len(done), len(skipped))
+
+@router.command("reject_many", r"([a-f0-9]{10,}(?:[\s,]+[a-f0-9]{10,})*)\s*(.*)")
+async def reject_many(ev):
+    """
+    Rechaza varios pagos pendientes con un mismo motivo (solo boss).
+    
+    Args:
+        ev: Evento con el comando /reject_many <id> <id> ... [motivo].
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    pids = list(dict.fromkeys(_PID.findall(ev.pattern_match.group(1))))[:BULK_MAX]
+    reason = (ev.pattern_match.group(2) or "Sin motivo").strip()
+    done, skipped = await db.transaction(_tx_reject_many, pids, ev.sender_id, reason)
+    await _after_reject_many(done, reason)
+    await reply(ev, _bulk_summary("❌ **Pagos rechazados**", done, skipped) + f"\nMotivo: {reason}", kb_boss())
+    log.info("Rechazo masivo por boss %s: %s rechazados, motivo=%s", ev.sender_id, len(done), reason)
+
+async def _review_view(uid: int, selected):
+    """
+    Carga los pagos pendientes más antiguos y guarda en el flujo cuáles se muestran.
+    """
+    rows = await db.query(
+        """SELECT id, user_id, amount_usd, type, plan FROM payments
+           WHERE status='pending' ORDER BY created, id LIMIT ?""",
+        (REVIEW_SIZE,)
+    )
+    shown = [r["id"] for r in rows]
+    selected = [x for x in selected if x in shown]
+    flows.update(uid, shown=shown, selected=selected)
+    return inline_review(rows, selected)
+
+@router.command("pending")
+async def review_pending(ev):
+    """
+    Abre la vista de selección de pagos pendientes para aprobarlos o rechazarlos en bloque (solo boss).
+    
+    Args:
+        ev: Evento con el comando /pending.
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await reply(ev, MSG_ERROR_NO_PERMISSION)
+        return
+    flows.start(ev.sender_id, "review", "select", selected=[])
+    text, buttons = await _review_view(ev.sender_id, [])
+    await reply(ev, text, buttons or kb_boss())
+    log.info("Revisión de pagos pendientes abierta por boss %s", ev.sender_id)
+
+@callbacks.action("rv", "review")
+async def cb_review(ev, f, op, pid=None):
+    """
+    Marca/desmarca pagos en la vista de revisión o aplica la acción a los seleccionados.
+    """
+    if await user_role(ev.sender_id) != "boss":
+        await ev.answer("⛔ Sin permiso.", alert=True)
+        return
+    selected = list(f.selected or [])
+    if op == "t" and pid:
+        if pid in selected:
+            selected.remove(pid)
+        else:
+            selected.append(pid)
+    elif op == "all":
+        selected = list(f.shown or [])
+    elif op == "none":
+        selected = []
+    elif op in ("a", "r"):
+        if not selected:
+            await ev.answer("Selecciona al menos un pago.", alert=True)
+            return
+        if op == "a":
+            done, skipped = await db.transaction(_tx_approve_many, selected, ev.sender_id)
+            await _after_approve_many(done)
+            summary = _bulk_summary("✅ Aprobados", done, skipped)
+        else:
+            reason = "Rechazado por el administrador"
+            done, skipped = await db.transaction(_tx_reject_many, selected, ev.sender_id, reason)
+            await _after_reject_many(done, reason)
+            summary = _bulk_summary("❌ Rechazados", done, skipped)
+        log.info("Revisión de pagos por boss %s: %s %s pagos", ev.sender_id, op, len(done))
+        selected = []
+        text, buttons = await _review_view(ev.sender_id, selected)
+        await ev.edit(f"{summary}\n\n{text}", buttons=buttons or None)
+        return
+    text, buttons = await _review_view(ev.sender_id, selected)
+    await ev.edit(text, buttons=buttons or None)
+
+# ---------- Despacho de mensajes ----------
+@bot.on(events.NewMessage)
+async def on_message(ev):
+    """
+    Único handler de mensajes: delega en el router (comandos y botones) y, si el
+    mensaje no es ninguno de ellos, en flows_input.
+    """
+    await router.dispatch(ev)
 
 # ---------- Vencimientos ----------
-async def expiry_loop():
+async def notify_expiry(kind: str, days: int, owner_id: int, slug: str, expires: str) -> None:
     """
-    Verifica periódicamente los vencimientos de clientes y envía notificaciones.
-    - Avisa 1 día antes del vencimiento.
-    - Notifica si el plan ya venció.
+    Envía al cliente el aviso de vencimiento que toca.
+    - "reminder": recordatorio a `days` días del vencimiento (reminder_days).
+    - "expired": el día en que vence el plan.
+    """
+    if kind == "expired":
+        text = MSG_EXPIRED.format(slug=slug, expires=expires)
+    elif days == 1:
+        text = MSG_EXPIRES_TOMORROW.format(slug=slug, expires=expires)
+    else:
+        text = MSG_EXPIRES_SOON.format(days=days, slug=slug, expires=expires)
+    await notify(owner_id, text, PRIO_REMINDER)
+    log.info("Aviso de vencimiento (%s/%s) encolado para %s: slug=%s", kind, days, owner_id, slug)
+
+expiry = ExpiryScheduler(notify_expiry)
+
+metrics.gauge("bot_outbox_queue", "Mensajes en la cola de salida", lambda: len(outbox))
+metrics.gauge("bot_receipts_queue", "Comprobantes pendientes de descarga", lambda: len(receipts))
+metrics.gauge("bot_flows_active", "Flujos de conversación en memoria", lambda: len(flows))
+metrics.gauge("bot_expiry_pending", "Avisos de vencimiento programados", lambda: len(expiry))
+
+# ---------- Main ----------
+# Tareas de fondo: se guardan las referencias para que no las recoja el GC
+_background: Set[asyncio.Task] = set()
+
+def _task_done(task: asyncio.Task) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("La tarea de fondo %s terminó con un error: %s", task.get_name(), task.exception(),
+                  exc_info=task.exception())
+
+def spawn(coro, name: str) -> asyncio.Task:
+    """
+    Arranca una tarea de fondo que se conserva hasta terminar y cuyo error se registra.
+    """
+    task = asyncio.create_task(coro, name=name)
+    _background.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+async def refresh_settings_loop() -> None:
+    """
+    Recoge cada SETTINGS_RECHECK segundos los cambios de ajustes hechos por otros
+    procesos, en el hilo de la DB: los handlers solo leen el snapshot en memoria.
     """
     while True:
+        await asyncio.sleep(SETTINGS_RECHECK)
         try:
-            today = dt.date.today().isoformat()
-            with cx() as c:
-                cur = c.cursor()
-                cur.execute("SELECT owner_id, slug, expires FROM clients WHERE date(expires)=date(?, '+1 day')", (today,))
-                for r in cur.fetchall():
-                    try:
-                        await bot.send_message(r["owner_id"], MSG_EXPIRES_TOMORROW.format(slug=r["slug"], expires=r["expires"]))
-                        logging.info(f"Notificación de vencimiento enviada a {r['owner_id']}: slug={r['slug']}")
-                    except Exception:
-                        logging.warning(f"No se pudo enviar notificación de vencimiento a {r['owner_id']}")
-                cur.execute("SELECT owner_id, slug, expires FROM clients WHERE date(expires)<=date(?)", (today,))
-                for r in cur.fetchall():
-                    try:
-                        await bot.send_message(r["owner_id"], MSG_EXPIRED.format(slug=r["slug"], expires=r["expires"]))
-                        logging.info(f"Notificación de plan vencido enviada a {r['owner_id']}: slug={r['slug']}")
-                    except Exception:
-                        logging.warning(f"No se pudo enviar notificación de vencido a {r['owner_id']}")
-        except Exception as e:
-            logging.error(f"Error en expiry_loop: {e}")
-        await asyncio.sleep(3600)
+            await db.run(refresh_settings)
+        except RuntimeError:
+            pass  # Ya registrado; se reintenta en la siguiente vuelta
 
-# ---------- Main ----------
 async def main():
     """
-    Inicializa la base de datos, arranca el bot y ejecuta la tarea de vencimientos.
+    Inicializa la base de datos, arranca el bot y ejecuta el planificador de vencimientos.
     """
-    init_db()
+    await db.run(init_db)
+    await db.run(load_settings)
+    await flows.load()
     await bot.start(bot_token=SET.bot_token)
-    logging.info("✅ Bot de resellers iniciado correctamente.")
+    log.info("✅ Bot de resellers iniciado correctamente.")
     print("✅ Bot de resellers iniciado correctamente.")
-    asyncio.create_task(expiry_loop())
-    await bot.run_until_disconnected()
+    outbox.start()
+    receipts.start()
+    await receipts.requeue_pending()
+    spawn(expiry.run(), "expiry")
+    spawn(flows.run(), "flows")
+    spawn(refresh_settings_loop(), "settings")
+    server = await metrics.serve()
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        if server is not None:
+            server.close()
+        for task in list(_background):
+            task.cancel()
+        await receipts.stop()
+        await outbox.stop()
+        await flows.flush()
+        db.shutdown()
+        close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
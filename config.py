@@ -3,14 +3,10 @@ from pathlib import Path
 from dataclasses import dataclass
 from dotenv import load_dotenv
 from typing import Optional
+from .logsetup import setup_logging
 import logging
 
-# Configurar logging para errores de configuración
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filename="config.log"
-)
+log = logging.getLogger(__name__)
 
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
@@ -28,6 +24,7 @@ class Settings:
         data_dir (Path): Directorio base para datos, logs, facturas y clientes.
         tz (str): Zona horaria para operaciones del bot (por defecto, UTC).
         support_contact (str): Contacto de soporte (por ejemplo, @Soporte).
+        session (str): Nombre o ruta de la sesión de Telethon (sin la extensión .session).
     """
     api_id: int = 0
     api_hash: str = ""
@@ -36,6 +33,7 @@ class Settings:
     data_dir: Path = Path("./data").absolute()
     tz: str = "UTC"
     support_contact: str = "@Soporte"
+    session: str = "reseller_mgr"
 
     def __post_init__(self):
         """
@@ -48,26 +46,26 @@ class Settings:
             if self.api_id == 0:
                 raise ValueError("API_ID no está configurado o es inválido.")
         except ValueError as e:
-            logging.error(f"Error en API_ID: {e}")
+            log.error("Error en API_ID: %s", e)
             raise ValueError("API_ID debe ser un número entero válido en el archivo .env.")
 
         # Obtener y validar API_HASH
         self.api_hash = os.getenv("API_HASH", "")
         if not self.api_hash:
-            logging.error("API_HASH no está configurado en el archivo .env.")
+            log.error("API_HASH no está configurado en el archivo .env.")
             raise ValueError("API_HASH debe estar configurado en el archivo .env.")
 
         # Obtener y validar BOT_TOKEN
         self.bot_token = os.getenv("BOT_TOKEN", "")
         if not self.bot_token:
-            logging.error("BOT_TOKEN no está configurado en el archivo .env.")
+            log.error("BOT_TOKEN no está configurado en el archivo .env.")
             raise ValueError("BOT_TOKEN debe estar configurado en el archivo .env.")
 
         # Obtener y validar OWNER_ID
         try:
             self.owner_id = int(os.getenv("OWNER_ID", "0"))
         except ValueError:
-            logging.warning("OWNER_ID no es válido, se usará 0 como predeterminado.")
+            log.warning("OWNER_ID no es válido, se usará 0 como predeterminado.")
             self.owner_id = 0
 
         # Configurar directorio de datos
@@ -75,7 +73,7 @@ class Settings:
         try:
             self.data_dir.mkdir(parents=True, exist_ok=True)
         except Exception as e:
-            logging.error(f"Error al crear el directorio de datos {self.data_dir}: {e}")
+            log.error("Error al crear el directorio de datos %s: %s", self.data_dir, e)
             raise RuntimeError(f"No se pudo crear el directorio de datos: {self.data_dir}")
 
         # Configurar zona horaria
@@ -84,15 +82,18 @@ class Settings:
             import pytz
             pytz.timezone(self.tz)  # Validar zona horaria
         except pytz.exceptions.UnknownTimeZoneError:
-            logging.warning(f"Zona horaria inválida: {self.tz}. Se usará UTC.")
+            log.warning("Zona horaria inválida: %s. Se usará UTC.", self.tz)
             self.tz = "UTC"
 
         # Configurar contacto de soporte
         self.support_contact = os.getenv("SUPPORT_CONTACT", "@Soporte")
         if not self.support_contact.startswith("@"):
-            logging.warning(f"SUPPORT_CONTACT inválido: {self.support_contact}. Se usará @Soporte.")
+            log.warning("SUPPORT_CONTACT inválido: %s. Se usará @Soporte.", self.support_contact)
             self.support_contact = "@Soporte"
 
+        # Sesión de Telethon (relativa al directorio de trabajo, como hasta ahora)
+        self.session = os.getenv("SESSION", "reseller_mgr")
+
     def ensure(self):
         """
         Crea los subdirectorios necesarios para el funcionamiento del bot.
@@ -109,9 +110,9 @@ class Settings:
             for subdir in ("logs", "invoices", "clients"):
                 subdir_path = self.data_dir / subdir
                 subdir_path.mkdir(exist_ok=True)
-                logging.info(f"Directorio creado/existe: {subdir_path}")
+                log.info("Directorio creado/existe: %s", subdir_path)
         except Exception as e:
-            logging.error(f"Error al crear subdirectorios en {self.data_dir}: {e}")
+            log.error("Error al crear subdirectorios en %s: %s", self.data_dir, e)
             raise RuntimeError(f"No se pudieron crear los subdirectorios: {e}")
         return self
 
@@ -128,13 +129,14 @@ class Settings:
             raise ValueError("API_HASH es requerido para iniciar el bot.")
         if not self.bot_token:
             raise ValueError("BOT_TOKEN es requerido para iniciar el bot.")
-        logging.info("Configuración validada correctamente.")
+        log.info("Configuración validada correctamente.")
 
 # Crear instancia de configuración y asegurar directorios
 try:
     SET = Settings().ensure()
+    setup_logging(SET.data_dir / "logs")
     SET.validate()
-    logging.info("Configuración cargada correctamente.")
+    log.info("Configuración cargada correctamente.")
 except Exception as e:
-    logging.error(f"Error al inicializar la configuración: {e}")
+    log.error("Error al inicializar la configuración: %s", e)
     raise
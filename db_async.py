@@ -0,0 +1,151 @@
+"""
+Capa de acceso a datos asíncrona.
+
+Todo el trabajo con SQLite se ejecuta en un pool de hilos dedicado para que el
+bucle de eventos de Telethon siga despachando actualizaciones mientras la base de
+datos trabaja (o espera un "database is locked").
+"""
+import asyncio
+import contextvars
+import functools
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Sequence, TypeVar
+from .models_db import cx, READERS
+from .metrics import DB_SECONDS
+import logging
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Un hilo por lector del pool más uno para el escritor
+_executor = ThreadPoolExecutor(max_workers=READERS + 1, thread_name_prefix="db")
+
+
+async def run(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Ejecuta una función síncrona de la capa de datos en el pool de hilos de la DB.
+
+    Args:
+        fn: Función a ejecutar (por ejemplo, role_for o get_setting).
+        *args, **kwargs: Argumentos de la función.
+
+    Returns:
+        El valor devuelto por la función.
+    """
+    loop = asyncio.get_running_loop()
+    # El contexto viaja al hilo de la DB para que las sentencias cuenten en el evento en curso
+    ctx = contextvars.copy_context()
+    with DB_SECONDS.time(_op_name(args[0] if fn in (_read, _write) else fn)):
+        return await loop.run_in_executor(_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def _op_name(fn: Callable) -> str:
+    """Etiqueta de métricas de una llamada: "query.<lambda>", "FlowStore.flush._tx"..."""
+    return getattr(fn, "__qualname__", "?").replace(".<locals>", "")
+
+
+def _read(fn: Callable[..., T], args: tuple) -> T:
+    with cx(readonly=True) as c:
+        return fn(c.cursor(), *args)
+
+
+def _write(fn: Callable[..., T], args: tuple) -> T:
+    with cx() as c:
+        return fn(c.cursor(), *args)
+
+
+async def read(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Ejecuta fn(cur, *args) con un cursor de solo lectura fuera del bucle de eventos.
+
+    Args:
+        fn: Función que recibe un sqlite3.Cursor como primer argumento.
+        *args: Argumentos adicionales para fn.
+
+    Returns:
+        El valor devuelto por fn.
+    """
+    return await run(_read, fn, args)
+
+
+async def transaction(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Ejecuta fn(cur, *args) dentro de una transacción de escritura.
+
+    La transacción se confirma si fn termina sin errores y se revierte si lanza
+    una excepción, que se propaga al llamador.
+
+    Args:
+        fn: Función que recibe un sqlite3.Cursor como primer argumento.
+        *args: Argumentos adicionales para fn.
+
+    Returns:
+        El valor devuelto por fn.
+    """
+    return await run(_write, fn, args)
+
+
+async def query(sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+    """
+    Ejecuta una consulta de lectura y devuelve todas las filas.
+
+    Args:
+        sql (str): Sentencia SELECT.
+        params (Sequence[Any]): Parámetros de la sentencia.
+
+    Returns:
+        List[sqlite3.Row]: Filas obtenidas.
+    """
+    return await read(lambda cur: cur.execute(sql, params).fetchall())
+
+
+async def query_one(sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+    """
+    Ejecuta una consulta de lectura y devuelve la primera fila (o None).
+
+    Args:
+        sql (str): Sentencia SELECT.
+        params (Sequence[Any]): Parámetros de la sentencia.
+
+    Returns:
+        Optional[sqlite3.Row]: Primera fila o None.
+    """
+    return await read(lambda cur: cur.execute(sql, params).fetchone())
+
+
+async def execute(sql: str, params: Sequence[Any] = ()) -> int:
+    """
+    Ejecuta una sentencia de escritura en su propia transacción.
+
+    Args:
+        sql (str): Sentencia INSERT/UPDATE/DELETE.
+        params (Sequence[Any]): Parámetros de la sentencia.
+
+    Returns:
+        int: Número de filas afectadas.
+    """
+    return await transaction(lambda cur: cur.execute(sql, params).rowcount)
+
+
+async def executemany(sql: str, seq: Iterable[Sequence[Any]]) -> int:
+    """
+    Ejecuta una sentencia de escritura para varios juegos de parámetros en una transacción.
+
+    Args:
+        sql (str): Sentencia INSERT/UPDATE/DELETE.
+        seq (Iterable[Sequence[Any]]): Parámetros por fila.
+
+    Returns:
+        int: Número total de filas afectadas.
+    """
+    return await transaction(lambda cur: cur.executemany(sql, seq).rowcount)
+
+
+def shutdown() -> None:
+    """
+    Detiene el pool de hilos de la base de datos esperando las tareas en curso.
+    """
+    _executor.shutdown(wait=True)
+    log.info("Pool de hilos de la base de datos detenido.")
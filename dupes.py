@@ -0,0 +1,241 @@
+"""
+Detección de comprobantes repetidos.
+
+Cada comprobante descargado tiene su SHA-256 (copia exacta del archivo) y, si es una
+imagen, un dHash de 64 bits: la imagen se reduce a 9x8 en escala de grises y cada bit
+indica si un píxel es más claro que su vecino. Una misma captura recortada, recomprimida
+o reenviada da un dHash a pocos bits de distancia aunque el SHA-256 cambie por completo.
+
+El dHash se calcula en un pool de procesos (Pillow es CPU puro y no suelta el GIL) y se
+indexa partido en BANDS bandas de 16 bits. Con distancia <= MAX_DISTANCE < 2 * BANDS,
+alguna banda difiere como mucho en un bit, así que los candidatos salen de buscar en
+la clave de receipt_bands cada banda y sus 16 vecinas a un bit; cada clave tiene 65 536
+valores posibles, así que son pocos, y solo a esos se les mide la distancia real.
+
+Pillow está en requirements.txt; si falta solo se detectan copias exactas.
+"""
+import asyncio
+import multiprocessing
+import sqlite3
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+import logging
+
+log = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - dependencia opcional
+    Image = None
+    log.warning("Pillow no está instalado: solo se detectarán comprobantes repetidos idénticos.")
+
+BANDS = 4               # Bandas de 64 // BANDS bits cada una
+MAX_DISTANCE = 6        # Bits distintos para considerar casi-duplicado (< 2 * BANDS)
+MAX_CANDIDATES = 500    # Pagos candidatos que se comparan como mucho por comprobante
+MAX_REPORTED = 5        # Coincidencias que se muestran en el aviso
+HASH_WORKERS = 1        # Procesos para el hash perceptual
+MAX_PIXELS = 40_000_000 # Imágenes más grandes no se abren (bomba de descompresión)
+
+_BAND_BITS = 64 // BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+@dataclass(frozen=True)
+class Duplicate:
+    """
+    Pago anterior con un comprobante igual o casi igual.
+
+    Attributes:
+        pid: ID del pago anterior.
+        user_id: Usuario que lo envió.
+        status: Estado de ese pago.
+        distance: Bits distintos entre los dHash (0 y exact=True si es el mismo archivo).
+        exact: El archivo es idéntico (mismo SHA-256).
+    """
+    pid: str
+    user_id: int
+    status: str
+    distance: int
+    exact: bool
+
+
+def dhash_file(path: str) -> Optional[int]:
+    """
+    Calcula el dHash de 64 bits de una imagen. Se ejecuta en el pool de procesos.
+
+    Args:
+        path (str): Ruta de la imagen.
+
+    Returns:
+        Optional[int]: Hash sin signo, o None si el archivo no es una imagen legible.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            if img.width * img.height > MAX_PIXELS:
+                return None
+            img.draft("L", (64, 64))  # JPEG: decodifica ya reducido
+            px = list(img.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    h = 0
+    for row in range(8):
+        for col in range(8):
+            h = (h << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return h
+
+
+def _signed(h: int) -> int:
+    """SQLite guarda enteros de 64 bits con signo."""
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def _bands(h: int) -> List[int]:
+    return [(h >> (i * _BAND_BITS)) & _BAND_MASK for i in range(BANDS)]
+
+
+def _probes(value: int) -> List[int]:
+    """Valor de una banda y sus vecinos a un bit de distancia."""
+    return [value] + [value ^ (1 << b) for b in range(_BAND_BITS)]
+
+
+def _distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+_pool: Optional[Executor] = None
+
+
+def _spawn_safe() -> bool:
+    """
+    Si un proceso hijo (spawn) puede arrancar sin efectos secundarios.
+
+    El hijo vuelve a importar el módulo principal salvo que sea un __main__.py de paquete
+    (python -m <paquete>). Con `python -m <paquete>.bot`, un script o el bench, eso
+    ejecutaría de nuevo el cuerpo de bot.py: otro TelegramClient sobre la misma sesión,
+    otro listener de logs, otra cola de salida...
+    """
+    name = getattr(getattr(sys.modules.get("__main__"), "__spec__", None), "name", None) or ""
+    return name == "__main__" or name.endswith(".__main__")
+
+
+async def perceptual_hash(path: str) -> Optional[int]:
+    """
+    Calcula el dHash de una imagen en el pool de procesos sin bloquear el bucle de eventos.
+
+    Args:
+        path (str): Ruta de la imagen.
+
+    Returns:
+        Optional[int]: Hash sin signo, o None si no es una imagen (o falta Pillow).
+    """
+    global _pool
+    if Image is None:
+        return None
+    if _pool is None:
+        if _spawn_safe():
+            # spawn: el proceso hijo no hereda los hilos de la DB ni el bucle de Telethon
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            log.warning("Hash perceptual en un hilo: arranca el bot con `python -m <paquete>` "
+                        "para usar un proceso aparte.")
+            _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="dhash")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool, dhash_file, str(path))
+    except Exception as e:
+        log.warning("No se pudo calcular el hash perceptual de %s: %s", path, e)
+        return None
+
+
+def shutdown() -> None:
+    """
+    Cierra el pool de procesos. Se llama al apagar el bot.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def reindex(cur: sqlite3.Cursor) -> int:
+    """
+    Rehace receipt_bands a partir de payments.receipt_dhash (al cambiar BANDS).
+
+    Returns:
+        int: Pagos indexados.
+    """
+    cur.execute("DELETE FROM receipt_bands")
+    cur.execute("SELECT id, receipt_dhash FROM payments WHERE receipt_dhash IS NOT NULL")
+    n = 0
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            return n
+        cur.connection.executemany(
+            "INSERT OR IGNORE INTO receipt_bands(band, value, pid) VALUES (?, ?, ?)",
+            [(i, v, r[0]) for r in rows for i, v in enumerate(_bands(r[1] & 0xFFFFFFFFFFFFFFFF))]
+        )
+        n += len(rows)
+
+
+def index_receipt(cur: sqlite3.Cursor, pid: str, dhash: int) -> None:
+    """
+    Guarda el dHash de un pago y sus bandas en el índice.
+
+    Args:
+        cur: Cursor dentro de una transacción.
+        pid (str): ID del pago.
+        dhash (int): Hash sin signo devuelto por perceptual_hash.
+    """
+    cur.execute("UPDATE payments SET receipt_dhash=? WHERE id=?", (_signed(dhash), pid))
+    cur.executemany(
+        "INSERT OR IGNORE INTO receipt_bands(band, value, pid) VALUES (?, ?, ?)",
+        [(i, v, pid) for i, v in enumerate(_bands(dhash))]
+    )
+
+
+def find_duplicates(cur: sqlite3.Cursor, pid: str, sha256: Optional[str],
+                    dhash: Optional[int]) -> List[Duplicate]:
+    """
+    Busca pagos anteriores con el mismo comprobante o uno casi igual.
+
+    Args:
+        cur: Cursor de la base de datos.
+        pid (str): Pago que se compara (se excluye del resultado).
+        sha256 (Optional[str]): Hash del archivo.
+        dhash (Optional[int]): Hash perceptual sin signo, si se pudo calcular.
+
+    Returns:
+        List[Duplicate]: Como mucho MAX_REPORTED coincidencias, las exactas primero.
+    """
+    found = {}
+    if sha256:
+        cur.execute(
+            "SELECT id, user_id, status FROM payments WHERE receipt_sha256=? AND id<>? LIMIT ?",
+            (sha256, pid, MAX_REPORTED)
+        )
+        for r in cur.fetchall():
+            found[r["id"]] = Duplicate(r["id"], r["user_id"], r["status"], 0, True)
+    if dhash is not None:
+        marks = ", ".join("?" * (_BAND_BITS + 1))
+        union = " UNION ".join([f"SELECT pid FROM receipt_bands WHERE band=? AND value IN ({marks})"] * BANDS)
+        params = [x for i, v in enumerate(_bands(dhash)) for x in (i, *_probes(v))]
+        cur.execute(
+            f"SELECT id, user_id, status, receipt_dhash FROM payments "
+            f"WHERE id IN (SELECT pid FROM ({union}) LIMIT ?) AND id<>?",
+            params + [MAX_CANDIDATES, pid]
+        )
+        rows = cur.fetchall()
+        if len(rows) >= MAX_CANDIDATES:
+            log.warning("Comprobante de %s: más de %s candidatos casi iguales; se comparan solo esos.",
+                        pid, MAX_CANDIDATES)
+        for r in rows:
+            if r["id"] in found or r["receipt_dhash"] is None:
+                continue
+            d = _distance(dhash, r["receipt_dhash"])
+            if d <= MAX_DISTANCE:
+                found[r["id"]] = Duplicate(r["id"], r["user_id"], r["status"], d, False)
+    return sorted(found.values(), key=lambda d: (not d.exact, d.distance))[:MAX_REPORTED]
@@ -0,0 +1,294 @@
+"""
+Exportación de pagos, clientes y auditoría a CSV o NDJSON comprimidos con gzip.
+
+Las filas se leen del cursor por lotes (fetchmany) y se escriben directamente en el
+archivo comprimido, así que la memoria no depende de cuántas filas haya. Cada
+exportación abre su propia conexión de solo lectura y corre en un hilo aparte: no
+ocupa durante minutos un lector del pool ni el bucle de eventos. Los archivos se
+escriben en data_dir/exports; /export los sube a Telegram por partes y los borra
+después (salvo los que superan el límite de subida, que se quedan en el servidor).
+
+Uso sin el bot:
+    python -m <paquete>.export payments --format csv --since 2025-01-01 --status approved
+    python -m <paquete>.export clients --reseller 123456789
+"""
+import argparse
+import asyncio
+import csv
+import datetime as dt
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from .config import SET
+from .models_db import DB
+import logging
+
+log = logging.getLogger(__name__)
+
+EXPORT_DIR = SET.data_dir / "exports"
+FETCH_SIZE = 2000                   # Filas por lote leído del cursor
+FORMATS = ("csv", "ndjson")
+
+
+@dataclass(frozen=True)
+class _Kind:
+    """
+    Qué se exporta de una tabla y a qué columnas se aplica cada filtro.
+    """
+    columns: Tuple[str, ...]
+    table: str
+    date: str       # Columna para since/until
+    status: str     # Columna para status
+    reseller: str   # Condición para reseller; cada "?" recibe el ID
+    order: str
+
+
+KINDS: Dict[str, _Kind] = {
+    "payments": _Kind(
+        ("id", "created", "status", "user_id", "role", "type", "amount_usd", "amount_cup",
+         "rate_used", "plan", "item_id", "receipt_sha256"),
+        "payments", "created", "status",
+        # Planes del propio reseller (item_id = su ID) y renovaciones de sus clientes
+        "(item_id = ? OR item_id IN (SELECT slug FROM clients WHERE reseller_id = ?))",
+        "created, id",
+    ),
+    "clients": _Kind(
+        ("slug", "owner_id", "username", "reseller_id", "plan", "created", "expires", "svc_status"),
+        "clients", "created", "svc_status", "reseller_id = ?", "slug",
+    ),
+    "audit": _Kind(
+        ("id", "created", "actor_id", "action", "meta"),
+        # Por fecha y luego id (el rowid): el orden de idx_audit_created e idx_audit_actor_created
+        "audit", "created", "action", "actor_id = ?", "created, id",
+    ),
+}
+
+
+@dataclass(frozen=True)
+class ExportFilter:
+    """
+    Filtros de una exportación; None significa "sin filtro".
+
+    Atributos:
+        since (Optional[str]): Fecha inicial (AAAA-MM-DD), incluida.
+        until (Optional[str]): Fecha final (AAAA-MM-DD), incluida.
+        status (Optional[str]): Estado del pago, estado del servicio del cliente o
+            acción de auditoría.
+        reseller (Optional[str]): ID del reseller (en auditoría, del actor).
+    """
+    since: Optional[str] = None
+    until: Optional[str] = None
+    status: Optional[str] = None
+    reseller: Optional[str] = None
+
+    def __post_init__(self):
+        for name in ("since", "until"):
+            value = getattr(self, name)
+            if value is not None:
+                try:
+                    dt.date.fromisoformat(value)
+                except ValueError:
+                    raise ValueError(f"Fecha inválida en {name}: {value} (usa AAAA-MM-DD)")
+
+    @classmethod
+    def parse(cls, words: Sequence[str]) -> "ExportFilter":
+        """
+        Construye un filtro a partir de palabras clave=valor (ej. "since=2025-01-01 status=approved").
+
+        Raises:
+            ValueError: Si una palabra no es un filtro conocido o una fecha no es válida.
+        """
+        values: Dict[str, str] = {}
+        for w in words:
+            key, sep, value = w.partition("=")
+            if not sep or key not in cls.__dataclass_fields__ or not value:
+                raise ValueError(f"Filtro inválido: {w}")
+            values[key] = value
+        return cls(**values)
+
+    def where(self, kind: _Kind) -> Tuple[str, List[object]]:
+        """
+        Returns:
+            tuple: (cláusula WHERE o "", parámetros).
+        """
+        conds: List[str] = []
+        params: List[object] = []
+        if self.since:
+            conds.append(f"{kind.date} >= ?")
+            params.append(self.since)
+        if self.until:
+            conds.append(f"{kind.date} < ?")
+            params.append((dt.date.fromisoformat(self.until) + dt.timedelta(days=1)).isoformat())
+        if self.status:
+            conds.append(f"{kind.status} = ?")
+            params.append(self.status)
+        if self.reseller:
+            # La afinidad de cada columna (INTEGER o TEXT) convierte el ID al comparar
+            conds.append(kind.reseller)
+            params += [self.reseller] * kind.reseller.count("?")
+        return ("WHERE " + " AND ".join(conds)) if conds else "", params
+
+
+@dataclass
+class ExportResult:
+    """
+    Archivo generado por una exportación.
+    """
+    path: Path
+    rows: int
+    size: int
+    seconds: float
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Conexión propia de solo lectura: una exportación larga no retiene un lector del pool.
+    """
+    try:
+        conn = sqlite3.connect(f"file:{DB}?mode=ro", uri=True, timeout=5.0, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    except sqlite3.Error as e:
+        log.error("Error al abrir %s para exportar: %s", DB, e)
+        raise RuntimeError(f"No se pudo abrir la base de datos para exportar: {e}")
+
+
+def export_sql(kind: str, flt: ExportFilter) -> Tuple[str, List[object]]:
+    """
+    Consulta de una exportación, en el orden de un índice cuando lo hay.
+
+    Raises:
+        ValueError: Si el tipo no existe.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Exportación desconocida: {kind} (usa {', '.join(KINDS)})")
+    spec = KINDS[kind]
+    where, params = flt.where(spec)
+    return f"SELECT {', '.join(spec.columns)} FROM {spec.table} {where} ORDER BY {spec.order}", params
+
+
+def write_export(conn: sqlite3.Connection, kind: str, fmt: str, flt: ExportFilter, path: Path) -> ExportResult:
+    """
+    Vuelca las filas de una consulta en un archivo gzip, lote a lote.
+
+    El archivo se escribe con sufijo .part y se renombra al terminar, así que nunca
+    queda a medias con el nombre final.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de lectura.
+        kind (str): "payments", "clients" o "audit".
+        fmt (str): "csv" o "ndjson".
+        flt (ExportFilter): Filtros.
+        path (Path): Archivo de destino (.csv.gz o .ndjson.gz).
+
+    Returns:
+        ExportResult: Archivo, filas escritas, tamaño y duración.
+
+    Raises:
+        ValueError: Si el tipo o el formato no existen.
+        RuntimeError: Si falla la consulta o la escritura.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt} (usa {', '.join(FORMATS)})")
+    sql, params = export_sql(kind, flt)
+    spec = KINDS[kind]
+    tmp = path.with_name(path.name + ".part")
+    start = time.perf_counter()
+    rows = 0
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        with gzip.open(tmp, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+            if fmt == "csv":
+                out = csv.writer(f)
+                out.writerow(spec.columns)
+                while True:
+                    batch = cur.fetchmany(FETCH_SIZE)
+                    if not batch:
+                        break
+                    out.writerows(batch)
+                    rows += len(batch)
+            else:
+                while True:
+                    batch = cur.fetchmany(FETCH_SIZE)
+                    if not batch:
+                        break
+                    f.writelines(json.dumps(dict(zip(spec.columns, r)), ensure_ascii=False) + "\n" for r in batch)
+                    rows += len(batch)
+        os.replace(tmp, path)
+    except (sqlite3.Error, OSError) as e:
+        tmp.unlink(missing_ok=True)
+        log.error("Error al exportar %s a %s: %s", kind, path, e)
+        raise RuntimeError(f"No se pudo exportar {kind}: {e}")
+    result = ExportResult(path, rows, path.stat().st_size, time.perf_counter() - start)
+    log.info("Exportación %s: %s filas, %s bytes en %.1f s -> %s",
+             kind, rows, result.size, result.seconds, path)
+    return result
+
+
+def export_path(kind: str, fmt: str, directory: Optional[Path] = None) -> Path:
+    """
+    Nombre de archivo con la hora UTC (ej. exports/payments-20250924T104400Z.csv.gz).
+    """
+    directory = directory or EXPORT_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = dt.datetime.now(dt.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path, n = directory / f"{kind}-{stamp}.{fmt}.gz", 1
+    while path.exists():
+        n += 1
+        path = directory / f"{kind}-{stamp}-{n}.{fmt}.gz"
+    return path
+
+
+def export_sync(kind: str, fmt: str = "csv", flt: Optional[ExportFilter] = None,
+                directory: Optional[Path] = None) -> ExportResult:
+    """
+    Exporta con una conexión propia (para la línea de comandos o un hilo).
+    """
+    path = export_path(kind, fmt, directory)
+    conn = _connect()
+    try:
+        return write_export(conn, kind, fmt, flt or ExportFilter(), path)
+    finally:
+        conn.close()
+
+
+async def export(kind: str, fmt: str = "csv", flt: Optional[ExportFilter] = None) -> ExportResult:
+    """
+    Exporta en un hilo aparte sin bloquear el bucle de eventos.
+
+    Raises:
+        ValueError: Si el tipo, el formato o los filtros no son válidos.
+        RuntimeError: Si falla la consulta o la escritura.
+    """
+    return await asyncio.to_thread(export_sync, kind, fmt, flt)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Exporta pagos, clientes o auditoría a CSV/NDJSON con gzip.")
+    ap.add_argument("kind", choices=sorted(KINDS))
+    ap.add_argument("--format", choices=FORMATS, default="csv")
+    ap.add_argument("--since", help="Fecha inicial incluida (AAAA-MM-DD).")
+    ap.add_argument("--until", help="Fecha final incluida (AAAA-MM-DD).")
+    ap.add_argument("--status", help="Estado del pago / del servicio, o acción de auditoría.")
+    ap.add_argument("--reseller", help="ID del reseller (en auditoría, del actor).")
+    ap.add_argument("--out", type=Path, help=f"Directorio de destino (por defecto, {EXPORT_DIR}).")
+    args = ap.parse_args(argv)
+    try:
+        flt = ExportFilter(args.since, args.until, args.status, args.reseller)
+        result = export_sync(args.kind, args.format, flt, args.out)
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"{result.path} ({result.rows} filas, {result.size} bytes, {result.seconds:.1f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
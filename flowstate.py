@@ -0,0 +1,251 @@
+"""
+Estado de las conversaciones (flujos de pago y de alta de clientes).
+
+Cada usuario tiene como mucho un Flow, un registro compacto con __slots__. El
+FlowStore los guarda en un OrderedDict ordenado por caducidad: como el TTL es fijo
+y cada escritura mueve el flujo al final, los caducados siempre están al principio
+y el barrido solo recorre los que sobran. Un tope duro expulsa los más antiguos.
+
+Los cambios se escriben en la tabla flows en segundo plano (write-behind), en una
+sola transacción por lote, y se recargan al arrancar para que nadie pierda un pago
+a medias por un reinicio.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set
+from . import db_async as db
+import logging
+
+log = logging.getLogger(__name__)
+
+FLOW_TTL = 3600.0        # Segundos sin actividad antes de descartar un flujo
+MAX_FLOWS = 10000        # Tope de flujos en memoria
+FLUSH_INTERVAL = 2.0     # Segundos entre escrituras a la base de datos
+
+
+class Flow:
+    """
+    Estado de conversación de un usuario.
+
+    Attributes:
+        mode: "pay", "newcli", "newcli_boss" o "review" (revisión de pagos pendientes).
+        step: Paso actual dentro del flujo.
+        role: Rol con el que paga ("reseller" o "client").
+        El resto son los datos que se van reuniendo en cada paso.
+    """
+
+    __slots__ = (
+        "uid", "deadline", "mode", "step", "role", "rid", "client_id", "slug", "workdir",
+        "plan_code", "amount_usd", "amount_cup", "item_id", "client_slug", "method",
+        "await_receipt", "selected", "shown",
+    )
+    _DATA = __slots__[2:]
+
+    def __init__(self, uid: int, mode: str, step: str, deadline: float = 0.0, **fields: Any):
+        self.uid = uid
+        self.deadline = deadline
+        for name in self._DATA:
+            setattr(self, name, None)
+        self.mode = mode
+        self.step = step
+        self.await_receipt = False
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        return f"Flow(uid={self.uid}, mode={self.mode}, step={self.step})"
+
+    def dump(self) -> str:
+        """Serializa los campos con valor a JSON."""
+        return json.dumps({k: getattr(self, k) for k in self._DATA if getattr(self, k) is not None},
+                          separators=(",", ":"))
+
+    @classmethod
+    def load(cls, uid: int, data: str, deadline: float) -> "Flow":
+        """Reconstruye un Flow a partir de su JSON; ignora campos desconocidos."""
+        d = json.loads(data)
+        fields = {k: d[k] for k in cls._DATA if k in d}
+        return cls(uid, fields.pop("mode", None), fields.pop("step", None), deadline, **fields)
+
+
+class FlowStore:
+    """
+    Almacén acotado de flujos con TTL y persistencia diferida en SQLite.
+
+    Args:
+        ttl (float): Segundos de inactividad tras los que caduca un flujo.
+        max_flows (int): Número máximo de flujos en memoria.
+        flush_interval (float): Segundos entre escrituras a la base de datos.
+    """
+
+    def __init__(self, ttl: float = FLOW_TTL, max_flows: int = MAX_FLOWS,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.max_flows = max_flows
+        self.flush_interval = flush_interval
+        self.evicted = 0
+        self._flows: "OrderedDict[int, Flow]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._deleted: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._flows)
+
+    def __contains__(self, uid: int) -> bool:
+        return self.get(uid) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._flows))
+
+    def _touch(self, flow: Flow) -> None:
+        flow.deadline = time.time() + self.ttl
+        self._flows[flow.uid] = flow
+        self._flows.move_to_end(flow.uid)
+        self._dirty.add(flow.uid)
+        self._deleted.discard(flow.uid)
+
+    def _drop(self, uid: int) -> Optional[Flow]:
+        flow = self._flows.pop(uid, None)
+        self._dirty.discard(uid)
+        self._deleted.add(uid)
+        return flow
+
+    def get(self, uid: int) -> Optional[Flow]:
+        """
+        Devuelve el flujo activo del usuario o None si no tiene (o ya caducó).
+        """
+        flow = self._flows.get(uid)
+        if flow is not None and flow.deadline <= time.time():
+            self._drop(uid)
+            return None
+        return flow
+
+    def start(self, uid: int, mode: str, step: str, **fields: Any) -> Flow:
+        """
+        Inicia un flujo nuevo para el usuario, reemplazando el anterior si lo había.
+
+        Args:
+            uid (int): ID del usuario.
+            mode (str): Tipo de flujo.
+            step (str): Paso inicial.
+            **fields: Datos iniciales (role, rid...).
+
+        Returns:
+            Flow: El flujo creado.
+        """
+        flow = Flow(uid, mode, step, **fields)
+        self._touch(flow)
+        self.sweep()
+        while len(self._flows) > self.max_flows:
+            oldest = next(iter(self._flows))
+            self._drop(oldest)
+            self.evicted += 1
+        return flow
+
+    def update(self, uid: int, **fields: Any) -> Optional[Flow]:
+        """
+        Actualiza campos del flujo del usuario y renueva su TTL.
+
+        Returns:
+            Optional[Flow]: El flujo actualizado o None si no había flujo activo.
+        """
+        flow = self.get(uid)
+        if flow is None:
+            return None
+        for name, value in fields.items():
+            setattr(flow, name, value)
+        self._touch(flow)
+        return flow
+
+    def pop(self, uid: int) -> Optional[Flow]:
+        """
+        Termina el flujo del usuario.
+
+        Returns:
+            Optional[Flow]: El flujo eliminado o None.
+        """
+        return self._drop(uid)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Descarta los flujos caducados. Solo recorre los caducados (están al principio).
+
+        Returns:
+            int: Número de flujos descartados.
+        """
+        now = time.time() if now is None else now
+        n = 0
+        while self._flows:
+            uid, flow = next(iter(self._flows.items()))
+            if flow.deadline > now:
+                break
+            self._drop(uid)
+            n += 1
+        return n
+
+    async def load(self) -> int:
+        """
+        Carga los flujos vigentes guardados en la base de datos.
+
+        Returns:
+            int: Número de flujos cargados.
+        """
+        rows = await db.query("SELECT uid, data, deadline FROM flows WHERE deadline > ? ORDER BY deadline",
+                              (time.time(),))
+        for r in rows:
+            try:
+                flow = Flow.load(r["uid"], r["data"], r["deadline"])
+            except (ValueError, TypeError) as e:
+                log.warning("Flujo guardado inválido para %s: %s", r['uid'], e)
+                continue
+            self._flows[flow.uid] = flow
+        log.info("Flujos de conversación restaurados: %s", len(rows))
+        return len(rows)
+
+    async def flush(self) -> int:
+        """
+        Escribe en la base de datos los flujos cambiados y borrados desde la última vez.
+
+        Returns:
+            int: Número de filas escritas o borradas.
+        """
+        dirty, deleted = self._dirty, self._deleted
+        self._dirty, self._deleted = set(), set()
+        upserts = [(f.uid, f.dump(), f.deadline) for f in (self._flows.get(u) for u in dirty) if f is not None]
+        gone = [(u,) for u in deleted]
+        if not upserts and not gone:
+            return 0
+
+        def _tx(cur):
+            if gone:
+                cur.executemany("DELETE FROM flows WHERE uid=?", gone)
+            if upserts:
+                cur.executemany(
+                    """INSERT INTO flows(uid, data, deadline) VALUES (?, ?, ?)
+                       ON CONFLICT(uid) DO UPDATE SET data=excluded.data, deadline=excluded.deadline""",
+                    upserts
+                )
+            cur.execute("DELETE FROM flows WHERE deadline <= ?", (time.time(),))
+
+        try:
+            await db.transaction(_tx)
+        except Exception:
+            # Reintentar en la próxima vuelta lo que no se haya vuelto a tocar
+            self._dirty |= dirty - self._deleted
+            self._deleted |= deleted - self._dirty
+            raise
+        return len(upserts) + len(gone)
+
+    async def run(self) -> None:
+        """
+        Bucle de fondo: barre los caducados y vuelca los cambios cada flush_interval.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.sweep()
+                await self.flush()
+            except Exception as e:
+                log.error("Error guardando flujos de conversación: %s", e)
@@ -0,0 +1,373 @@
+"""
+Listados paginados para el panel del boss.
+
+Los pagos se paginan con cursores de tipo keyset sobre (created, id): cada página
+es un rango sobre idx_payments_created_id o idx_payments_status_created_id, así que
+cuesta lo mismo con mil pagos que con un millón. El cursor es el id de un pago, lo
+que cabe de sobra en un callback_data.
+
+Los listados de clientes y resellers usan el mismo tipo de cursor sobre el índice
+de cada orden; el callback lleva la clave de orden de la fila frontera (ej. vence y
+slug), no un OFFSET. Cada página renderizada, y aparte el total de filas, se cachea
+con la versión de datos de sus tablas (data_versions, mantenida por triggers):
+mientras nadie escriba en clients/resellers, abrir o recorrer el listado no vuelve a
+consultar ni formatear.
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .ui import fmt_clients_list, fmt_resellers_list
+
+PAGE_SIZE = 10  # Pagos por página (cada uno ocupa ~8 líneas en el mensaje)
+
+# Solo las columnas que muestra fmt_payments_pretty
+PAYMENT_COLUMNS = "id, user_id, status, amount_usd, amount_cup, plan, item_id"
+
+# Filtros: valor <-> letra para los callbacks ("-" = sin filtro)
+_STATUS = {"p": "pending", "a": "approved", "r": "rejected"}
+_ROLE = {"c": "client", "r": "reseller"}
+_METHOD = {"s": "saldo", "c": "cup"}
+
+
+def _letter(table: dict, value: Optional[str]) -> str:
+    if value is None:
+        return "-"
+    return next(k for k, v in table.items() if v == value)
+
+
+@dataclass(frozen=True)
+class PaymentFilter:
+    """
+    Filtro del listado de pagos; None significa "todos".
+    """
+    status: Optional[str] = None
+    role: Optional[str] = None
+    method: Optional[str] = None
+
+    @property
+    def code(self) -> str:
+        """Forma compacta de tres letras para callback_data (ej. "p-s")."""
+        return _letter(_STATUS, self.status) + _letter(_ROLE, self.role) + _letter(_METHOD, self.method)
+
+    @classmethod
+    def from_code(cls, code: str) -> "PaymentFilter":
+        """
+        Reconstruye un filtro a partir de su código.
+
+        Raises:
+            ValueError: Si el código no es válido.
+        """
+        if len(code) != 3:
+            raise ValueError(f"Filtro inválido: {code}")
+        try:
+            return cls(*(None if c == "-" else t[c] for c, t in zip(code, (_STATUS, _ROLE, _METHOD))))
+        except KeyError:
+            raise ValueError(f"Filtro inválido: {code}")
+
+    @classmethod
+    def parse(cls, words: Sequence[str], status: Optional[str] = None) -> "PaymentFilter":
+        """
+        Construye un filtro a partir de palabras sueltas (ej. "pending reseller cup").
+
+        Args:
+            words: Palabras del comando, en cualquier orden.
+            status: Estado por defecto si no se indica ninguno.
+
+        Raises:
+            ValueError: Si alguna palabra no es un estado, rol o método conocido.
+        """
+        role = method = None
+        for w in (w.lower() for w in words):
+            if w in _STATUS.values():
+                status = w
+            elif w in _ROLE.values():
+                role = w
+            elif w in _METHOD.values():
+                method = w
+            else:
+                raise ValueError(f"Filtro desconocido: {w}")
+        return cls(status, role, method)
+
+    def where(self) -> tuple:
+        """
+        Returns:
+            tuple: (condiciones SQL, parámetros).
+        """
+        conds, params = [], []
+        for col, value in (("status", self.status), ("role", self.role), ("type", self.method)):
+            if value is not None:
+                conds.append(f"{col} = ?")
+                params.append(value)
+        return conds, params
+
+
+@dataclass
+class PaymentsPage:
+    """
+    Una página de pagos, del más reciente al más antiguo.
+
+    Attributes:
+        rows: Filas de la página.
+        newer: Hay pagos más recientes que la primera fila.
+        older: Hay pagos más antiguos que la última fila.
+    """
+    rows: List[sqlite3.Row] = field(default_factory=list)
+    newer: bool = False
+    older: bool = False
+
+    @property
+    def first_id(self) -> Optional[str]:
+        return self.rows[0]["id"] if self.rows else None
+
+    @property
+    def last_id(self) -> Optional[str]:
+        return self.rows[-1]["id"] if self.rows else None
+
+
+def payments_page(cur: sqlite3.Cursor, flt: PaymentFilter, before: Optional[str] = None,
+                  after: Optional[str] = None, limit: int = PAGE_SIZE) -> PaymentsPage:
+    """
+    Lee una página de pagos con cursor keyset sobre (created, id).
+
+    Args:
+        cur: Cursor de la base de datos.
+        flt: Filtro de estado/rol/método.
+        before: Id del pago a partir del cual seguir hacia los más antiguos.
+        after: Id del pago a partir del cual volver hacia los más recientes.
+        limit: Tamaño de página.
+
+    Returns:
+        PaymentsPage: Filas (de más reciente a más antiguo) e indicadores de navegación.
+    """
+    conds, params = flt.where()
+    pivot, backwards = None, False
+    if before or after:
+        cur.execute("SELECT created, id FROM payments WHERE id=?", (before or after,))
+        pivot = cur.fetchone()
+        backwards = pivot is not None and after is not None
+    if pivot is not None:
+        conds.append("(created, id) > (?, ?)" if backwards else "(created, id) < (?, ?)")
+        params += [pivot["created"], pivot["id"]]
+    where = f"WHERE {' AND '.join(conds)}" if conds else ""
+    order = "ASC" if backwards else "DESC"
+    cur.execute(
+        f"SELECT {PAYMENT_COLUMNS} FROM payments {where} ORDER BY created {order}, id {order} LIMIT ?",
+        params + [limit + 1]
+    )
+    rows = cur.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        return PaymentsPage(rows, newer=more, older=True)
+    return PaymentsPage(rows, newer=pivot is not None, older=more)
+
+
+# ---------- Clientes y resellers ----------
+LIST_PAGE_SIZE = 20     # Filas por página (~120 caracteres cada una, lejos de 4096)
+LIST_CACHE_SIZE = 256   # Páginas renderizadas y totales en caché
+
+# Solo las columnas que muestran fmt_clients_list / fmt_resellers_list (incluyen las de cada orden)
+CLIENT_COLUMNS = "slug, plan, expires, reseller_id"
+RESELLER_COLUMNS = "id, plan, expires, contact, client_count AS clients"
+
+# Órdenes disponibles: código -> ORDER BY (siempre con desempate único)
+CLIENT_SORTS = {
+    "s": "slug",
+    "e": "expires, slug",
+    "r": "reseller_id, slug",
+}
+RESELLER_SORTS = {
+    "i": "id",
+    "e": "expires, id",
+}
+
+
+@dataclass(frozen=True)
+class Listing:
+    """
+    Página renderizada de un listado.
+
+    Attributes:
+        text: Texto listo para enviar.
+        page: Número de página (desde 0) para el indicador "Página x/y".
+        pages: Total de páginas (al menos 1).
+        prev_key: Clave de orden de la primera fila, si hay filas anteriores.
+        next_key: Clave de orden de la última fila, si hay filas posteriores.
+    """
+    text: str
+    page: int
+    pages: int
+    prev_key: Optional[Tuple[str, ...]] = None
+    next_key: Optional[Tuple[str, ...]] = None
+
+
+_cache: "OrderedDict[Tuple, Any]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cached(key: Tuple) -> Any:
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+        return hit
+
+
+def _store(key: Tuple, value: Any) -> Any:
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > LIST_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+def data_versions(cur: sqlite3.Cursor) -> Dict[str, int]:
+    """
+    Versión actual de cada tabla cacheable.
+
+    Returns:
+        Dict[str, int]: {"clients": n, "resellers": m}.
+    """
+    cur.execute("SELECT name, version FROM data_versions")
+    return {r["name"]: r["version"] for r in cur.fetchall()}
+
+
+def _count(cur: sqlite3.Cursor, table: str, version: Optional[int], where: str, params: List[object]) -> int:
+    """
+    Filas del listado, cacheadas por versión de datos aparte de las páginas: recorrer
+    el listado no vuelve a contar.
+    """
+    key = ("count", table, version, where, tuple(params))
+    n = _cached(key)
+    if n is None:
+        cur.execute(f"SELECT COUNT(*) AS n FROM {table} {where}", params)
+        n = _store(key, cur.fetchone()["n"])
+    return n
+
+
+def _keyset(cur: sqlite3.Cursor, table: str, columns: str, conds: List[str], params: List[object], order: str,
+            way: str, key: Sequence[str]) -> Tuple[List[sqlite3.Row], bool, bool]:
+    """
+    Lee una página a partir de la clave de orden de la fila frontera.
+
+    Args:
+        table, columns: Tabla y columnas a leer.
+        conds, params: Condiciones fijas del listado (ej. el reseller).
+        order: Columnas del orden, separadas por comas (la última, única).
+        way: "n" para seguir tras `key`, "p" para volver antes de `key`, "" desde el principio.
+        key: Valores de las columnas de `order` en la fila frontera.
+
+    Returns:
+        tuple: (filas en el orden del listado, hay anteriores, hay posteriores).
+
+    Raises:
+        ValueError: Si la clave no corresponde al orden.
+    """
+    cols = [c.strip() for c in order.split(",")]
+    conds, params = list(conds), list(params)
+    backwards = way == "p"
+    if key:
+        if len(key) != len(cols) or way not in ("n", "p"):
+            raise ValueError(f"Cursor inválido para {order}: {way} {tuple(key)}")
+        conds.append(f"({order}) {'<' if backwards else '>'} ({', '.join('?' * len(cols))})")
+        params += list(key)
+    where = f"WHERE {' AND '.join(conds)}" if conds else ""
+    direction = " DESC" if backwards else ""
+    cur.execute(
+        f"SELECT {columns} FROM {table} {where} ORDER BY {', '.join(c + direction for c in cols)} LIMIT ?",
+        params + [LIST_PAGE_SIZE + 1]
+    )
+    rows = cur.fetchall()
+    more = len(rows) > LIST_PAGE_SIZE
+    rows = rows[:LIST_PAGE_SIZE]
+    if backwards:
+        rows.reverse()
+        return rows, more, True
+    return rows, bool(key), more
+
+
+def _listing(text: str, rows: List[sqlite3.Row], order: str, page: int, total: int,
+             has_prev: bool, has_next: bool) -> Listing:
+    pages = max(1, -(-total // LIST_PAGE_SIZE))
+    # El número de página viaja en el callback solo para el indicador; se corrige en los extremos
+    page = 0 if not has_prev else min(max(page, 1), pages - 1)
+    if pages > 1:
+        text += f"\n\n📄 Página {page + 1}/{pages}"
+    cols = [c.strip() for c in order.split(",")]
+    row_key = lambda r: tuple(str(r[c]) for c in cols)
+    return Listing(text, page, pages,
+                   row_key(rows[0]) if has_prev and rows else None,
+                   row_key(rows[-1]) if has_next and rows else None)
+
+
+def clients_listing(cur: sqlite3.Cursor, sort: str = "s", page: int = 0,
+                    reseller_id: Optional[str] = None, title: str = "👥 CLIENTES",
+                    way: str = "", key: Sequence[str] = ()) -> Listing:
+    """
+    Página del listado de clientes (todos o los de un reseller).
+
+    Args:
+        cur: Cursor de la base de datos.
+        sort: Código de orden (ver CLIENT_SORTS).
+        page: Número de la página pedida, desde 0 (solo para el indicador).
+        reseller_id: Si se indica, solo los clientes de ese reseller.
+        title: Título del listado.
+        way: "n" (siguiente) o "p" (anterior) respecto a `key`; "" para la primera página.
+        key: Clave de orden de la fila frontera (ver Listing.prev_key / next_key).
+
+    Returns:
+        Listing: Página renderizada (desde la caché si los datos no han cambiado).
+
+    Raises:
+        ValueError: Si la clave no corresponde al orden.
+    """
+    order = CLIENT_SORTS.get(sort, CLIENT_SORTS["s"])
+    version = data_versions(cur).get("clients")
+    ck = ("clients", version, reseller_id, order, way, tuple(key), page, title)
+    hit = _cached(ck)
+    if hit is not None:
+        return hit
+    conds, params = (["reseller_id = ?"], [reseller_id]) if reseller_id is not None else ([], [])
+    rows, has_prev, has_next = _keyset(cur, "clients", CLIENT_COLUMNS, conds, params, order, way, key)
+    if key and not rows:
+        # La frontera quedó fuera (filas borradas o cambiadas): volver al principio
+        rows, has_prev, has_next = _keyset(cur, "clients", CLIENT_COLUMNS, conds, params, order, "", ())
+    total = _count(cur, "clients", version, f"WHERE {conds[0]}" if conds else "", params)
+    lst = _listing(fmt_clients_list(rows, title), rows, order, page, total, has_prev, has_next)
+    return _store(ck, lst)
+
+
+def resellers_listing(cur: sqlite3.Cursor, sort: str = "i", page: int = 0,
+                      way: str = "", key: Sequence[str] = ()) -> Listing:
+    """
+    Página del listado de resellers con su número de clientes.
+
+    Args:
+        cur: Cursor de la base de datos.
+        sort: Código de orden (ver RESELLER_SORTS).
+        page: Número de la página pedida, desde 0 (solo para el indicador).
+        way: "n" (siguiente) o "p" (anterior) respecto a `key`; "" para la primera página.
+        key: Clave de orden de la fila frontera (ver Listing.prev_key / next_key).
+
+    Returns:
+        Listing: Página renderizada (desde la caché si los datos no han cambiado).
+
+    Raises:
+        ValueError: Si la clave no corresponde al orden.
+    """
+    order = RESELLER_SORTS.get(sort, RESELLER_SORTS["i"])
+    versions = data_versions(cur)
+    # client_count cambia con clients, no con resellers
+    ck = ("resellers", versions.get("resellers"), versions.get("clients"), order, way, tuple(key), page)
+    hit = _cached(ck)
+    if hit is not None:
+        return hit
+    rows, has_prev, has_next = _keyset(cur, "resellers", RESELLER_COLUMNS, [], [], order, way, key)
+    if key and not rows:
+        rows, has_prev, has_next = _keyset(cur, "resellers", RESELLER_COLUMNS, [], [], order, "", ())
+    total = _count(cur, "resellers", versions.get("resellers"), "", [])
+    lst = _listing(fmt_resellers_list([dict(r) for r in rows]), rows, order, page, total, has_prev, has_next)
+    return _store(ck, lst)
@@ -0,0 +1,161 @@
+"""
+Configuración única de logging para todo el bot.
+
+Los módulos solo crean su logger (logging.getLogger(__name__)) y registran con
+formato diferido ("... %s", valor). Aquí se instala en el logger raíz un QueueHandler
+que solo encola el registro; un QueueListener en su propio hilo lo formatea como una
+línea JSON y lo escribe en data_dir/logs/bot.log, con rotación por tamaño. Así el
+bucle de eventos nunca espera al disco.
+
+Variables de entorno:
+    LOG_LEVEL: Nivel general (por defecto INFO).
+    LOG_LEVELS: Niveles por logger (nombre=NIVEL separados por comas), ej. "telethon=INFO".
+    LOG_MAX_BYTES / LOG_BACKUPS: Tamaño de rotación y copias que se conservan.
+
+Para eventos de mucho volumen, extra={"sample": n} deja pasar solo 1 de cada n
+registros con el mismo mensaje; el registro que pasa lleva "sampled": n.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+LOG_FILE = "bot.log"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 5
+QUEUE_SIZE = 10000  # Registros en espera; si se llena se descartan (nunca bloquea)
+
+# Atributos estándar de LogRecord; el resto viene de extra= y va al JSON
+_STD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatea cada registro como un objeto JSON en una línea.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STD:
+                out[key] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Deja pasar 1 de cada n registros marcados con extra={"sample": n}.
+
+    Se cuenta por (logger, plantilla del mensaje), así que con formato diferido todos
+    los "Mensaje enviado a %s" comparten contador aunque cambie el destinatario.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        n = getattr(record, "sample", None)
+        if not n or n <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            seen = self._counts.get(key, 0)
+            self._counts[key] = seen + 1
+        if seen % n:
+            return False
+        record.sampled = n
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea; el JSON y la escritura quedan para el listener."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # Preferimos perder un log a frenar el bucle de eventos
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo se hace en el listener; aquí solo se congela el texto y la excepción
+        # para no compartir objetos mutables con el otro hilo.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _levels(spec: str) -> Dict[str, str]:
+    out = {}
+    for part in spec.split(","):
+        name, _, level = part.strip().partition("=")
+        if name and level:
+            out[name.strip()] = level.strip().upper()
+    return out
+
+
+def setup_logging(log_dir: Path) -> None:
+    """
+    Instala el pipeline de logging en el logger raíz. Llamadas repetidas no hacen nada.
+
+    Args:
+        log_dir (Path): Directorio donde se escribe bot.log y sus rotaciones.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_dir.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_dir / LOG_FILE,
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", MAX_BYTES)),
+        backupCount=int(os.getenv("LOG_BACKUPS", BACKUPS)),
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(JsonFormatter())
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(QUEUE_SIZE)
+    handler = _QueueHandler(q)
+    handler.addFilter(SampleFilter())
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logging.getLogger("telethon").setLevel(logging.WARNING)
+    for name, level in _levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(q, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """
+    Vacía la cola y detiene el hilo escritor. Se llama al apagar el bot.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
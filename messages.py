@@ -1,6 +1,17 @@
 """
 Mensajes para el bot en múltiples idiomas.
+
+Las plantillas de MESSAGES se compilan bajo demanda a texto plano más entidades de
+Telegram, así que enviarlas no vuelve a pasar por el parser Markdown. Los MSG_* son
+referencias al catálogo: bot.py los rellena con .format() y los traduce al idioma del
+destinatario al enviarlos.
 """
+import copy
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+from telethon.extensions import markdown
+from telethon.tl.types import MessageEntityCode, TypeMessageEntity
 
 MESSAGES = {
     "es": {
@@ -88,4 +99,422 @@ MESSAGES = {
             "Tu plan `{slug}` vence **mañana** ({expires}).\n"
             "Renueva ahora para evitar interrupciones en el servicio."
         ),
-        "MSG_EX
+        "MSG_EXPIRES_SOON": (
+            "⏳ **Recordatorio de vencimiento**\n"
+            "Tu plan `{slug}` vence en **{days} días** ({expires}).\n"
+            "Renueva a tiempo en **💳 Pagar / Renovar** para evitar interrupciones."
+        ),
+        "MSG_EXPIRED": (
+            "🔴 **Servicio pausado por vencimiento**\n"
+            "Tu plan `{slug}` venció el {expires}.\n"
+            "Renueva en **💳 Pagar / Renovar** para reactivar tu servicio."
+        ),
+        "MSG_RES_LIMIT": (
+            "⛔ **Límite de clientes alcanzado**\n"
+            "Tu plan permite un máximo de {limit} clientes.\n"
+            "Actualiza tu plan en **💳 Pagar / Renovar** para crear más."
+        ),
+        "MSG_LANG_PICK": (
+            "🌐 **Idioma**\n"
+            "Idioma actual: **{name}**.\n"
+            "Para cambiarlo, usa `/lang <código>` ({codes})."
+        ),
+        "MSG_LANG_SET": "🌐 Idioma actualizado: **{name}**.",
+        "MSG_CLIENT_WELCOME": (
+            "🎉 **¡Bienvenido!**\n"
+            "Has sido registrado como cliente.\n"
+            "Tu slug es `{slug}` y tu plan `{plan}` vence el `{expires}`.\n"
+            "Usa /start para más detalles."
+        ),
+        "MSG_PAYMENT_PENDING": (
+            "🧾 **Nuevo pago pendiente**\n"
+            "- Usuario: `{user_id}`\n"
+            "- Monto: {amount_usd} USD ({amount_cup} CUP)\n"
+            "- Método: {method}\n"
+            "- ID: `{pid}`{notes}\n\n"
+            "Usa /receipt `{pid}` para ver el comprobante y /approve `{pid}` o /reject `{pid}` <motivo> para gestionarlo."
+        ),
+        "MSG_PAYMENT_DUPLICATES": "⚠️ **Posible comprobante repetido:**",
+        "MSG_DUPLICATE_EXACT": "- Pago `{pid}` de `{user_id}` ({status}): mismo archivo",
+        "MSG_DUPLICATE_SIMILAR": "- Pago `{pid}` de `{user_id}` ({status}): imagen casi igual ({distance} bits)",
+        "MSG_RECEIPT_MISSING": "📭 No se pudo descargar el comprobante.",
+        "MSG_PAYMENT_APPROVED": (
+            "✅ **¡Pago aprobado!**\n"
+            "Tu plan `{plan}` ha sido actualizado. Gracias por tu pago."
+        ),
+        "MSG_PAYMENTS_APPROVED": (
+            "✅ **¡{count} pagos aprobados!**\n"
+            "Planes: {plans}. Gracias por tus pagos."
+        ),
+        "MSG_PAYMENT_REJECTED": (
+            "❌ **Pago rechazado**\n"
+            "ID: {pids}\n"
+            "Motivo: {reason}\n"
+            "Por favor, revisa y vuelve a intentarlo."
+        ),
+    },
+    "en": {
+        "MSG_WELCOME_GUEST": (
+            "👋 **Welcome!**\n"
+            "You are not registered yet. To get started, contact your reseller or write to our support at @{support_contact}.\n"
+            "We are here to help!"
+        ),
+        "MSG_WELCOME_BOSS": (
+            "👑 **Admin Panel**\n"
+            "Welcome, boss! You have full control of the system. From here you can:\n"
+            "- Create and manage resellers.\n"
+            "- Set prices and rates.\n"
+            "- Approve or reject payments.\n"
+            "- Create clients directly.\n\n"
+            "Pick an option to continue:"
+        ),
+        "MSG_WELCOME_RESELLER": (
+            "💼 **Reseller Panel**\n"
+            "Hi! As a reseller you can:\n"
+            "- Create and manage clients.\n"
+            "- Renew client plans.\n"
+            "- Browse your client list.\n\n"
+            "Pick an action to get started:"
+        ),
+        "MSG_WELCOME_CLIENT": (
+            "👤 **Hi, {username}!**\n"
+            "Your account is active. These are your plan details:\n"
+            "- **Plan**: {plan}\n"
+            "- **Expires**: {expires}\n"
+            "- **Slug**: `{slug}`\n\n"
+            "Use the buttons to renew your plan or contact your reseller for support."
+        ),
+        "MSG_ERROR_NO_PERMISSION": (
+            "🔒 **Access denied**\n"
+            "You are not allowed to do this. Check your role or contact support."
+        ),
+        "MSG_ERROR_INVALID_ID": (
+            "❌ **Invalid ID**\n"
+            "The ID must be a valid number (for example, 123456789). Please try again."
+        ),
+        "MSG_CLIENT_CREATED": (
+            "🎉 **Client created**\n"
+            "- **Slug**: `{slug}`\n"
+            "- **Reseller ID**: `{rid}`\n"
+            "- **Plan**: {plan}\n"
+            "- **Expires**: `{expires}`\n\n"
+            "The client can start using the service. Send them their slug."
+        ),
+        "MSG_RESELLER_CREATED": (
+            "🎉 **Reseller created**\n"
+            "- **ID**: `{rid}`\n"
+            "- **Plan**: {plan}\n"
+            "- **Expires**: `{expires}`\n\n"
+            "The reseller is registered and can start creating clients."
+        ),
+        "MSG_PAYMENT_PICK": (
+            "💳 **Make a payment**\n"
+            "Choose what you want to pay or renew:\n"
+            "- **Reseller Plan**: Upgrade or renew your reseller plan.\n"
+            "- **Renew Client**: Extend the plan of an existing client."
+        ),
+        "MSG_PAYMENT_SALDO": (
+            "💵 **Pay with balance**\n"
+            "{txt}\n"
+            "Amount due: **{monto_saldo} CUP**\n\n"
+            "Please attach the payment receipt in the chat."
+        ),
+        "MSG_PAYMENT_CUP": (
+            "💵 **Pay in CUP**\n"
+            "{txt}\n"
+            "Amount due: **{monto_cup} CUP**\n\n"
+            "Please attach the payment receipt in the chat."
+        ),
+        "MSG_PAYMENT_SUCCESS": (
+            "✅ **Payment recorded**\n"
+            "- **Transaction ID**: `{pid}`\n"
+            "- **Amount**: {amount_usd} USD ({amount_cup} CUP)\n"
+            "- **Method**: {method}\n"
+            "- **Plan**: {plan}\n\n"
+            "Your payment is under review. We will let you know once it is approved."
+        ),
+        "MSG_EXPIRES_TOMORROW": (
+            "⚠️ **Expiry reminder**\n"
+            "Your plan `{slug}` expires **tomorrow** ({expires}).\n"
+            "Renew now to avoid service interruptions."
+        ),
+        "MSG_EXPIRES_SOON": (
+            "⏳ **Expiry reminder**\n"
+            "Your plan `{slug}` expires in **{days} days** ({expires}).\n"
+            "Renew in time from **💳 Pagar / Renovar** to avoid interruptions."
+        ),
+        "MSG_EXPIRED": (
+            "🔴 **Service paused: plan expired**\n"
+            "Your plan `{slug}` expired on {expires}.\n"
+            "Renew from **💳 Pagar / Renovar** to reactivate your service."
+        ),
+        "MSG_RES_LIMIT": (
+            "⛔ **Client limit reached**\n"
+            "Your plan allows up to {limit} clients.\n"
+            "Upgrade your plan from **💳 Pagar / Renovar** to create more."
+        ),
+        "MSG_LANG_PICK": (
+            "🌐 **Language**\n"
+            "Current language: **{name}**.\n"
+            "To change it, use `/lang <code>` ({codes})."
+        ),
+        "MSG_LANG_SET": "🌐 Language updated: **{name}**.",
+        "MSG_CLIENT_WELCOME": (
+            "🎉 **Welcome!**\n"
+            "You have been registered as a client.\n"
+            "Your slug is `{slug}` and your plan `{plan}` expires on `{expires}`.\n"
+            "Use /start for more details."
+        ),
+        "MSG_PAYMENT_PENDING": (
+            "🧾 **New pending payment**\n"
+            "- User: `{user_id}`\n"
+            "- Amount: {amount_usd} USD ({amount_cup} CUP)\n"
+            "- Method: {method}\n"
+            "- ID: `{pid}`{notes}\n\n"
+            "Use /receipt `{pid}` to see the receipt and /approve `{pid}` or /reject `{pid}` <reason> to handle it."
+        ),
+        "MSG_PAYMENT_DUPLICATES": "⚠️ **Possible duplicate receipt:**",
+        "MSG_DUPLICATE_EXACT": "- Payment `{pid}` from `{user_id}` ({status}): same file",
+        "MSG_DUPLICATE_SIMILAR": "- Payment `{pid}` from `{user_id}` ({status}): near-identical image ({distance} bits)",
+        "MSG_RECEIPT_MISSING": "📭 The receipt could not be downloaded.",
+        "MSG_PAYMENT_APPROVED": (
+            "✅ **Payment approved!**\n"
+            "Your plan `{plan}` has been updated. Thank you for your payment."
+        ),
+        "MSG_PAYMENTS_APPROVED": (
+            "✅ **{count} payments approved!**\n"
+            "Plans: {plans}. Thank you for your payments."
+        ),
+        "MSG_PAYMENT_REJECTED": (
+            "❌ **Payment rejected**\n"
+            "ID: {pids}\n"
+            "Reason: {reason}\n"
+            "Please review it and try again."
+        ),
+    },
+}
+
+DEFAULT_LOCALE = "es"
+LOCALE_NAMES = {"es": "Español", "en": "English"}
+
+# ---------- Catálogo compilado ----------
+# Cada plantilla se pasa por el parser Markdown de Telethon una sola vez, la primera
+# vez que se usa en un idioma, y queda como (texto, entidades). Al rellenarla solo se
+# sustituyen los campos y se desplazan las entidades (en unidades UTF-16, como las
+# cuenta Telegram); los valores van tal cual, sin interpretarse como Markdown.
+
+# "{{", "}}" o un campo "{nombre[!conv][:formato]}", como en str.format
+_HOLE = re.compile(r"\{\{|\}\}|\{(\w+)(?:!([rsa]))?(?::([^{}]*))?\}")
+
+
+def _u16(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+
+class Rendered(NamedTuple):
+    """
+    Mensaje listo para enviar con formatting_entities y parse_mode=None.
+    """
+    text: str
+    entities: List[TypeMessageEntity]
+
+
+def _moved(entity: TypeMessageEntity, offset: int, length: int) -> TypeMessageEntity:
+    e = copy.copy(entity)
+    e.offset, e.length = offset, length
+    return e
+
+
+class Template:
+    """
+    Plantilla ya parseada: texto plano, entidades y posición de cada campo.
+
+    Args:
+        source (str): Plantilla en Markdown con campos de str.format.
+    """
+    __slots__ = ("text", "entities", "_holes", "_static")
+
+    def __init__(self, source: str):
+        text, entities = markdown.parse(source)
+        self.text = text
+        self.entities = tuple(entities)
+        # (inicio, fin, inicio UTF-16, fin UTF-16, campo, conversión, formato); campo None = llave escapada
+        holes = []
+        last = pos = 0
+        for m in _HOLE.finditer(text):
+            pos += _u16(text[last:m.start()])
+            end = pos + _u16(m.group())
+            holes.append((m.start(), m.end(), pos, end, m.group(1), m.group(2), m.group(3) or ""))
+            last, pos = m.end(), end
+        self._holes = tuple(holes)
+        self._static = None if holes else Rendered(text, list(entities))
+
+    def render(self, **values: Any) -> Rendered:
+        """
+        Rellena los campos de la plantilla.
+
+        Args:
+            **values: Valor de cada campo. Un Rendered se inserta con sus entidades.
+
+        Returns:
+            Rendered: Texto y entidades.
+
+        Raises:
+            KeyError: Si falta el valor de un campo.
+        """
+        if self._static is not None:
+            return self._static
+        out: List[str] = []
+        extra: List[TypeMessageEntity] = []
+        shifts: List[Tuple[int, int]] = []  # (fin UTF-16 del campo, desplazamiento que introduce)
+        last = delta = 0
+        for start, end, u_start, u_end, name, conv, spec in self._holes:
+            out.append(self.text[last:start])
+            if name is None:
+                value = self.text[start]
+            else:
+                v = values[name]
+                if isinstance(v, Rendered):
+                    value = v.text
+                    extra += [_moved(e, e.offset + u_start + delta, e.length) for e in v.entities]
+                else:
+                    if conv:
+                        v = {"r": repr, "s": str, "a": ascii}[conv](v)
+                    value = format(v, spec)
+            out.append(value)
+            d = _u16(value) - (u_end - u_start)
+            shifts.append((u_end, d))
+            delta += d
+            last = end
+        out.append(self.text[last:])
+
+        def at(p: int) -> int:
+            return p + sum(d for end, d in shifts if end <= p)
+
+        entities = []
+        for e in self.entities:
+            start = at(e.offset)
+            entities.append(_moved(e, start, at(e.offset + e.length) - start))
+        return Rendered("".join(out), entities + extra)
+
+
+_compiled: Dict[Tuple[str, str], Template] = {}
+
+
+def template(key: str, locale: str = DEFAULT_LOCALE) -> Template:
+    """
+    Devuelve la plantilla compilada de un mensaje, compilándola la primera vez.
+
+    Si el idioma no tiene ese mensaje se usa el de DEFAULT_LOCALE.
+
+    Raises:
+        KeyError: Si el mensaje no existe.
+    """
+    tpl = _compiled.get((locale, key))
+    if tpl is None:
+        source = MESSAGES.get(locale, {}).get(key)
+        if source is None:
+            source = MESSAGES[DEFAULT_LOCALE][key]
+        tpl = _compiled[(locale, key)] = Template(source)
+    return tpl
+
+
+@lru_cache(maxsize=256)
+def markdown_text(text: str) -> Rendered:
+    """
+    Parsea (una vez) un texto Markdown que se inserta como campo de una plantilla,
+    como los textos de pago configurados por el boss.
+    """
+    return Rendered(*markdown.parse(text))
+
+
+def join(parts: Sequence[Union[str, Rendered]], sep: str = "") -> Rendered:
+    """
+    Concatena textos planos y mensajes ya renderizados, desplazando sus entidades.
+    """
+    out: List[str] = []
+    entities: List[TypeMessageEntity] = []
+    pos = 0
+    for i, part in enumerate(parts):
+        if i and sep:
+            out.append(sep)
+            pos += _u16(sep)
+        if isinstance(part, Rendered):
+            entities += [_moved(e, e.offset + pos, e.length) for e in part.entities]
+            part = part.text
+        out.append(part)
+        pos += _u16(part)
+    return Rendered("".join(out), entities)
+
+
+def code_list(items: Sequence[Any], sep: str = ", ") -> Rendered:
+    """
+    Lista de valores en monoespaciado (IDs, planes) para insertar en una plantilla.
+    """
+    return join([Rendered(str(x), [MessageEntityCode(0, _u16(str(x)))]) for x in items], sep)
+
+
+def resolve_locale(*candidates: Optional[str]) -> str:
+    """
+    Elige el primer idioma disponible entre los candidatos (preferencia guardada,
+    idioma de Telegram...). Acepta códigos regionales como "en-US".
+
+    Returns:
+        str: Código de idioma del catálogo, o DEFAULT_LOCALE.
+    """
+    for c in candidates:
+        if c:
+            code = c.lower().replace("_", "-").split("-")[0]
+            if code in MESSAGES:
+                return code
+    return DEFAULT_LOCALE
+
+
+class Message:
+    """
+    Mensaje del catálogo con sus campos, todavía sin idioma: se resuelve al enviarlo,
+    con el idioma del destinatario.
+    """
+    __slots__ = ("key", "values")
+
+    def __init__(self, key: str, values: Optional[Dict[str, Any]] = None):
+        self.key = key
+        self.values = values or {}
+
+    def format(self, **values: Any) -> "Message":
+        return Message(self.key, values)
+
+    def render(self, locale: str = DEFAULT_LOCALE) -> Rendered:
+        return template(self.key, locale).render(**self.values)
+
+    def __repr__(self) -> str:
+        return f"Message({self.key!r})"
+
+
+MSG_WELCOME_GUEST = Message("MSG_WELCOME_GUEST")
+MSG_WELCOME_BOSS = Message("MSG_WELCOME_BOSS")
+MSG_WELCOME_RESELLER = Message("MSG_WELCOME_RESELLER")
+MSG_WELCOME_CLIENT = Message("MSG_WELCOME_CLIENT")
+MSG_ERROR_NO_PERMISSION = Message("MSG_ERROR_NO_PERMISSION")
+MSG_ERROR_INVALID_ID = Message("MSG_ERROR_INVALID_ID")
+MSG_CLIENT_CREATED = Message("MSG_CLIENT_CREATED")
+MSG_RESELLER_CREATED = Message("MSG_RESELLER_CREATED")
+MSG_PAYMENT_PICK = Message("MSG_PAYMENT_PICK")
+MSG_PAYMENT_SALDO = Message("MSG_PAYMENT_SALDO")
+MSG_PAYMENT_CUP = Message("MSG_PAYMENT_CUP")
+MSG_PAYMENT_SUCCESS = Message("MSG_PAYMENT_SUCCESS")
+MSG_EXPIRES_TOMORROW = Message("MSG_EXPIRES_TOMORROW")
+MSG_EXPIRES_SOON = Message("MSG_EXPIRES_SOON")
+MSG_EXPIRED = Message("MSG_EXPIRED")
+MSG_RES_LIMIT = Message("MSG_RES_LIMIT")
+MSG_LANG_PICK = Message("MSG_LANG_PICK")
+MSG_LANG_SET = Message("MSG_LANG_SET")
+MSG_CLIENT_WELCOME = Message("MSG_CLIENT_WELCOME")
+MSG_PAYMENT_PENDING = Message("MSG_PAYMENT_PENDING")
+MSG_PAYMENT_DUPLICATES = Message("MSG_PAYMENT_DUPLICATES")
+MSG_DUPLICATE_EXACT = Message("MSG_DUPLICATE_EXACT")
+MSG_DUPLICATE_SIMILAR = Message("MSG_DUPLICATE_SIMILAR")
+MSG_RECEIPT_MISSING = Message("MSG_RECEIPT_MISSING")
+MSG_PAYMENT_APPROVED = Message("MSG_PAYMENT_APPROVED")
+MSG_PAYMENTS_APPROVED = Message("MSG_PAYMENTS_APPROVED")
+MSG_PAYMENT_REJECTED = Message("MSG_PAYMENT_REJECTED")
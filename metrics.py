@@ -0,0 +1,331 @@
+"""
+Métricas internas del bot en formato de texto de Prometheus.
+
+Contadores, gauges e histogramas simples (sin dependencias) con etiquetas. Los
+registran el router (latencia por handler), la capa de datos (tiempo por llamada y
+sentencias SQL, también por evento), la cola de salida (envíos y FloodWait) y el
+planificador de vencimientos (retraso). Se exponen en http://127.0.0.1:METRICS_PORT/metrics
+y, resumidas, con /metrics para el boss.
+
+Las sentencias por evento se cuentan con una ContextVar: el router abre un EventStats
+para cada mensaje o callback, db_async propaga el contexto al hilo de la DB y el trace
+callback de sqlite3 suma en él cada sentencia ejecutada.
+"""
+import asyncio
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+log = logging.getLogger(__name__)
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # 0 desactiva el endpoint HTTP
+
+# Segundos: de 1 ms a 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+Labels = Tuple[str, ...]
+
+
+def _fmt_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if v != v:
+        return "NaN"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """
+    Contador monótono con etiquetas.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.labels, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Valor instantáneo. Con `fn` se calcula al exportar (por ejemplo, el largo de una cola).
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        if self.fn is not None:
+            try:
+                return float(self.fn())
+            except Exception:
+                return math.nan
+        return self.value
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name} {_num(self.get())}"]
+
+
+class Histogram(_Metric):
+    """
+    Histograma de buckets fijos con etiquetas.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # etiquetas -> [cuentas por bucket (+Inf al final), suma, total]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def series(self) -> Dict[Labels, Tuple[List[int], float, int]]:
+        with self._lock:
+            return {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """
+        Cuantil aproximado (límite superior del bucket que lo contiene).
+        """
+        s = self.series().get(labels)
+        if not s or not s[2]:
+            return math.nan
+        rank, acc = q * s[2], 0
+        for bound, n in zip(self.buckets + (math.inf,), s[0]):
+            acc += n
+            if acc >= rank:
+                return bound
+        return math.inf
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, (counts, total, n) in sorted(self.series().items()):
+            acc = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                le = 'le="%s"' % _num(bound)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {total!r}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {n}")
+        return out
+
+
+REGISTRY: List[_Metric] = []
+
+# ---------- Métricas del bot ----------
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Latencia de cada handler", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Excepciones no capturadas por handler", ("handler",))
+HANDLER_SQL = Histogram("bot_handler_sql_statements", "Sentencias SQL por evento", ("handler",), COUNT_BUCKETS)
+DB_SECONDS = Histogram("bot_db_call_seconds", "Duración de cada llamada a la capa de datos", ("op",))
+DB_STATEMENTS = Counter("bot_db_statements_total", "Sentencias SQL ejecutadas", ("verb",))
+OUTBOX_SENT = Counter("bot_outbox_sent_total", "Mensajes salientes por resultado", ("result",))
+FLOOD_WAIT_SECONDS = Counter("bot_flood_wait_seconds_total", "Segundos de FloodWait impuestos por Telegram")
+EXPIRY_LAG = Gauge("bot_expiry_lag_seconds", "Retraso del último aviso de vencimiento respecto a su hora")
+
+
+def gauge(name: str, help: str, fn: Callable[[], float]) -> Gauge:
+    """
+    Registra un gauge calculado al exportar (largo de colas, flujos activos...).
+    """
+    return Gauge(name, help, fn)
+
+
+def render() -> str:
+    """
+    Returns:
+        str: Todas las métricas en formato de texto de Prometheus.
+    """
+    lines: List[str] = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Sentencias por evento ----------
+class EventStats:
+    """Contador de sentencias SQL del evento en curso."""
+    __slots__ = ("statements",)
+
+    def __init__(self):
+        self.statements = 0
+
+
+_event: contextvars.ContextVar[Optional[EventStats]] = contextvars.ContextVar("metrics_event", default=None)
+
+
+def on_statement(sql: str) -> None:
+    """
+    Trace callback de sqlite3: se llama en el hilo de la DB por cada sentencia.
+    """
+    verb = sql.lstrip()[:8].split(None, 1)[0].upper() if sql.strip() else "?"
+    DB_STATEMENTS.inc(verb)
+    stats = _event.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+async def observe(handler: str, coro) -> None:
+    """
+    Ejecuta el handler de un evento midiendo su latencia y sus sentencias SQL.
+
+    Args:
+        handler (str): Nombre del handler (etiqueta).
+        coro: Corrutina del handler.
+    """
+    stats = EventStats()
+    token = _event.set(stats)
+    start = time.perf_counter()
+    try:
+        await coro
+    except Exception:
+        HANDLER_ERRORS.inc(handler)
+        raise
+    finally:
+        HANDLER_SECONDS.observe(time.perf_counter() - start, handler)
+        HANDLER_SQL.observe(stats.statements, handler)
+        _event.reset(token)
+
+
+# ---------- Endpoint HTTP ----------
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            body, status = render().encode(), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """
+    Arranca el endpoint /metrics en el bucle actual (solo en la interfaz local).
+
+    Returns:
+        Optional[asyncio.AbstractServer]: El servidor, o None si está desactivado o el
+        puerto no está disponible.
+    """
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle, host, port)
+    except OSError as e:
+        log.warning("No se pudo abrir el endpoint de métricas en %s:%s: %s", host, port, e)
+        return None
+    log.info("Métricas disponibles en http://%s:%s/metrics", host, port)
+    return server
+
+
+def summary(limit: int = 15) -> str:
+    """
+    Resumen legible para /metrics: handlers más usados, capa de datos y colas.
+
+    Args:
+        limit (int): Máximo de handlers listados.
+
+    Returns:
+        str: Texto en Markdown.
+    """
+    lines = ["📈 **Métricas**", "", "**Handlers** (n · p50 · p95 · SQL p95)"]
+    series = sorted(HANDLER_SECONDS.series().items(), key=lambda kv: -kv[1][2])[:limit]
+    for (name,), (_, _, n) in series:
+        p50 = HANDLER_SECONDS.quantile(0.5, name) * 1000
+        p95 = HANDLER_SECONDS.quantile(0.95, name) * 1000
+        sql = HANDLER_SQL.quantile(0.95, name)
+        errors = HANDLER_ERRORS.get(name)
+        lines.append(f"- `{name}`: {n} · ≤{p50:g} ms · ≤{p95:g} ms · ≤{sql:g}"
+                     + (f" · ❌ {errors:g}" if errors else ""))
+    if not series:
+        lines.append("- (sin eventos todavía)")
+    db = DB_SECONDS.series()
+    calls = sum(s[2] for s in db.values())
+    total = sum(s[1] for s in db.values())
+    lines += ["", "**Base de datos**",
+              f"- Llamadas: {calls} ({(total / calls * 1000) if calls else 0:.2f} ms de media)",
+              f"- Sentencias: {DB_STATEMENTS.total():g}"]
+    lines += ["", "**Colas y retrasos**"]
+    for m in REGISTRY:
+        if isinstance(m, Gauge):
+            lines.append(f"- {m.help}: {m.get():g}")
+    lines += [f"- Enviados: {OUTBOX_SENT.get('ok'):g} · fallidos: {OUTBOX_SENT.get('failed'):g}"
+              f" · FloodWait: {FLOOD_WAIT_SECONDS.get():g} s"]
+    return "\n".join(lines)
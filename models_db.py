@@ -1,172 +1,781 @@
 import sqlite3
 import datetime as dt
+import queue
+import threading
 import re
+import time
 import uuid
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional, Union
+from types import MappingProxyType
+from collections import OrderedDict
+from typing import Callable, Dict, List, Mapping, Optional, Tuple, Union
 from .config import SET
+from .metrics import on_statement
 import logging
 
-# Configurar logging para depuración y auditoría
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filename=str(SET.data_dir / "logs" / "models_db.log")
-)
+log = logging.getLogger(__name__)
 
 # Ruta de la base de datos
 DB = SET.data_dir / "state.sqlite3"
 
-def cx() -> sqlite3.Connection:
+# Perfil de PRAGMAs aplicado a cada conexión persistente
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", "-16000"),       # ~16 MB de caché de páginas
+    ("mmap_size", "268435456"),     # 256 MB mapeados en memoria
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", "5000"),
+)
+READERS = 4                 # Tamaño del pool de conexiones de solo lectura
+STATEMENT_CACHE = 256       # Sentencias preparadas reutilizadas por conexión
+
+
+def _open(readonly: bool = False) -> sqlite3.Connection:
     """
-    Crea una conexión a la base de datos SQLite con el modo de fábrica de filas activado.
+    Abre una conexión persistente con el perfil de PRAGMAs y caché de sentencias.
+
+    Args:
+        readonly (bool): Si es True, la conexión se marca como de solo lectura.
 
     Returns:
-        sqlite3.Connection: Conexión a la base de datos.
-    
+        sqlite3.Connection: Conexión configurada.
+
     Raises:
-        sqlite3.Error: Si no se puede conectar a la base de datos.
+        RuntimeError: Si no se puede abrir la base de datos.
     """
     try:
-        conn = sqlite3.connect(DB)
+        conn = sqlite3.connect(
+            DB, timeout=5.0, check_same_thread=False, cached_statements=STATEMENT_CACHE
+        )
         conn.row_factory = sqlite3.Row
-        logging.info(f"Conexión a la base de datos establecida: {DB}")
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        conn.set_trace_callback(on_statement)
+        log.debug("Conexión %s abierta: %s", 'lectura' if readonly else 'escritura', DB)
         return conn
     except sqlite3.Error as e:
-        logging.error(f"Error al conectar a la base de datos {DB}: {e}")
+        log.error("Error al conectar a la base de datos %s: %s", DB, e)
         raise RuntimeError(f"No se pudo conectar a la base de datos: {e}")
 
-def init_db() -> None:
+
+class _Pool:
+    """
+    Gestor de conexiones persistentes: un único escritor y un pool pequeño de lectores.
+
+    El escritor se protege con un RLock para que un mismo hilo pueda anidar llamadas
+    a cx() (por ejemplo, get_setting dentro de una transacción) sin abrir otra conexión;
+    solo el nivel más externo confirma o revierte la transacción.
+    """
+
+    def __init__(self, readers: int = READERS):
+        self._size = readers
+        self._writer: Optional[sqlite3.Connection] = None
+        self._wlock = threading.RLock()
+        self._depth = 0
+        self._owner: Optional[int] = None
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened = 0
+        self._olock = threading.Lock()
+
+    def writer(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self._writer = _open()
+        return self._writer
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        conn = self.try_reader()
+        return conn if conn is not None else self._idle.get()
+
+    def try_reader(self) -> Optional[sqlite3.Connection]:
+        """Como acquire_reader, pero devuelve None en vez de esperar si el pool está agotado."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._olock:
+            if self._opened < self._size:
+                self._opened += 1
+                return _open(readonly=True)
+        return None
+
+    def release_reader(self, conn: sqlite3.Connection) -> None:
+        self._idle.put(conn)
+
+    def holds_writer(self) -> bool:
+        return self._owner == threading.get_ident()
+
+    def close(self) -> None:
+        with self._wlock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._olock:
+            self._opened = 0
+
+
+_pool = _Pool()
+
+
+class _Lease:
     """
-    Inicializa la base de datos creando las tablas necesarias y estableciendo valores predeterminados.
+    Préstamo de una conexión del pool, usable como `with cx() as c:`.
+
+    Al salir del bloque se confirma la transacción (o se revierte si hubo excepción)
+    y la conexión vuelve al pool en lugar de cerrarse.
+    """
+
+    __slots__ = ("_readonly", "_conn", "_reader")
+
+    def __init__(self, readonly: bool):
+        self._readonly = readonly
+        self._conn: Optional[sqlite3.Connection] = None
+        self._reader = False
+
+    def __enter__(self) -> sqlite3.Connection:
+        # Un hilo que ya tiene el escritor lee por él para ver sus propios cambios.
+        if self._readonly and not _pool.holds_writer():
+            self._conn = _pool.acquire_reader()
+            self._reader = True
+            return self._conn
+        _pool._wlock.acquire()
+        _pool._owner = threading.get_ident()
+        _pool._depth += 1
+        try:
+            self._conn = _pool.writer()
+        except Exception:
+            self._exit_writer()
+            raise
+        return self._conn
 
-    Tablas creadas:
-        - settings: Almacena configuraciones clave-valor.
-        - resellers: Datos de los resellers (ID, plan, fechas, contacto).
-        - clients: Datos de los clientes (slug, propietario, reseller, plan, etc.).
-        - payments: Registro de pagos (ID, usuario, monto, estado, etc.).
-        - audit: Registro de auditoría para acciones del sistema.
+    def __exit__(self, exc_type, exc, tb) -> None:
+        conn = self._conn
+        if self._reader:
+            if conn.in_transaction:
+                conn.rollback()
+            _pool.release_reader(conn)
+            return
+        try:
+            if _pool._depth == 1 and conn.in_transaction:
+                if exc_type is None:
+                    conn.commit()
+                else:
+                    conn.rollback()
+        finally:
+            self._exit_writer()
 
-    Valores predeterminados:
-        - owner_id, usd_to_cup, precios de planes, límites de resellers, textos de pago.
+    @staticmethod
+    def _exit_writer() -> None:
+        _pool._depth -= 1
+        if _pool._depth == 0:
+            _pool._owner = None
+        _pool._wlock.release()
+
+
+def cx(readonly: bool = False) -> _Lease:
+    """
+    Obtiene una conexión persistente del pool (modo WAL, sentencias preparadas en caché).
+
+    Args:
+        readonly (bool): Usa una conexión del pool de lectores en lugar del escritor.
+
+    Returns:
+        _Lease: Administrador de contexto que entrega un sqlite3.Connection y lo devuelve
+        al pool al salir, confirmando la transacción si no hubo errores.
+
+    Raises:
+        RuntimeError: Si no se puede conectar a la base de datos.
+    """
+    return _Lease(readonly)
+
+
+def close_db() -> None:
+    """
+    Cierra todas las conexiones persistentes del pool (al apagar el bot).
+    """
+    _pool.close()
+    log.info("Conexiones a la base de datos cerradas.")
+
+def _m001_base(cur: sqlite3.Cursor) -> None:
+    """
+    Esquema base: tablas settings, resellers, clients, payments y audit con sus
+    valores predeterminados. Es idempotente para bases creadas antes de las migraciones.
+    """
+    # Tabla settings
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS settings(
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    
+    # Tabla resellers
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resellers(
+            id TEXT PRIMARY KEY,
+            plan TEXT NOT NULL CHECK(plan IN ('res_b', 'res_p', 'res_e')),
+            started DATE NOT NULL,
+            expires DATE NOT NULL,
+            contact TEXT
+        )
+    """)
+    
+    # Tabla clients
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS clients(
+            slug TEXT PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            username TEXT,
+            reseller_id TEXT NOT NULL,
+            plan TEXT NOT NULL CHECK(plan IN ('plan_estandar', 'plan_plus', 'plan_pro')),
+            expires DATE NOT NULL,
+            created TEXT NOT NULL,
+            workdir TEXT NOT NULL,
+            svc_status TEXT NOT NULL DEFAULT 'stopped' CHECK(svc_status IN ('active', 'stopped', 'unknown')),
+            FOREIGN KEY(reseller_id) REFERENCES resellers(id)
+        )
+    """)
     
+    # Tabla payments
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS payments(
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('client', 'reseller')),
+            type TEXT NOT NULL CHECK(type IN ('saldo', 'cup')),
+            amount_usd REAL NOT NULL CHECK(amount_usd >= 0),
+            amount_cup REAL NOT NULL CHECK(amount_cup >= 0),
+            plan TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            receipt_msg_id INTEGER,
+            status TEXT NOT NULL CHECK(status IN ('pending', 'approved', 'rejected')),
+            created TEXT NOT NULL,
+            rate_used REAL NOT NULL CHECK(rate_used >= 0)
+        )
+    """)
+    
+    # Tabla audit
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS audit(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            actor_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            meta TEXT,
+            created TEXT NOT NULL
+        )
+    """)
+    
+    # Valores predeterminados (no pisan los existentes)
+    def put(k: str, v: Union[str, int, float]) -> None:
+        try:
+            cur.execute("INSERT OR IGNORE INTO settings(key, value) VALUES(?, ?)", (k, str(v)))
+        except sqlite3.Error as e:
+            log.error("Error al insertar configuración %s: %s", k, e)
+            raise
+
+    put("owner_id", str(SET.owner_id or 0))
+    put("usd_to_cup", "450")
+    # Precios reseller (mensual, en USD)
+    put("price_res_b", "10")
+    put("price_res_p", "20")
+    put("price_res_e", "30")
+    # Límites por plan (0 = ilimitado)
+    put("limit_res_b", "3")
+    put("limit_res_p", "10")
+    put("limit_res_e", "0")
+    # Precios cliente (30/90/365 días, en USD)
+    put("price_client_30", "5")
+    put("price_client_90", "14")
+    put("price_client_365", "50")
+    # Textos de pago
+    put("pay_text_saldo", (
+        "💳 **Pagar con saldo**\n"
+        "Transfiere {monto_saldo} CUP al número 63785631.\n"
+        "Luego, adjunta el comprobante en el chat."
+    ))
+    put("pay_text_cup", (
+        "🇨🇺 **Pagar en CUP**\n"
+        "Envía {monto_cup} CUP a la cuenta 9204 1299 7691 8161.\n"
+        "🔐 Código de confirmación: 56246700\n"
+        "Luego, adjunta el comprobante en el chat."
+    ))
+    put("support_contact", SET.support_contact)
+
+
+def _m002_indexes(cur: sqlite3.Cursor) -> None:
+    """
+    Índices secundarios para los filtros que usa bot.py.
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_owner ON clients(owner_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_reseller ON clients(reseller_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_expires ON clients(expires)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments(status, created)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_created ON audit(created)")
+
+
+def _m003_notifications(cur: sqlite3.Cursor) -> None:
+    """
+    Registro de avisos enviados (uno por cliente, tipo, horizonte y vencimiento) y
+    horizontes de recordatorio configurables.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notifications(
+            slug TEXT NOT NULL,
+            kind TEXT NOT NULL CHECK(kind IN ('reminder', 'expired')),
+            horizon INTEGER NOT NULL,
+            expires DATE NOT NULL,
+            sent_at TEXT NOT NULL,
+            PRIMARY KEY(slug, kind, horizon, expires)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("INSERT OR IGNORE INTO settings(key, value) VALUES('reminder_days', '7,3,1')")
+    # Los clientes ya vencidos recibieron MSG_EXPIRED en cada vuelta del bucle anterior;
+    # se registran como avisados para no volver a escribirles.
+    cur.execute(
+        """INSERT OR IGNORE INTO notifications(slug, kind, horizon, expires, sent_at)
+           SELECT slug, 'expired', 0, expires, ? FROM clients WHERE expires < ?""",
+        (iso_now(), dt.date.today().isoformat())
+    )
+
+
+def _m004_flows(cur: sqlite3.Cursor) -> None:
+    """
+    Estado de las conversaciones en curso (persistido por flowstate.FlowStore).
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS flows(
+            uid INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            deadline REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_flows_deadline ON flows(deadline)")
+
+
+def _m005_payments_keyset(cur: sqlite3.Cursor) -> None:
+    """
+    Índices para paginar pagos por (created, id), con y sin filtro de estado.
+    """
+    cur.execute("DROP INDEX IF EXISTS idx_payments_status_created")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_created_id ON payments(created, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_status_created_id ON payments(status, created, id)")
+
+
+def _m006_listings(cur: sqlite3.Cursor) -> None:
+    """
+    Versión de datos por tabla (mantenida por triggers) para cachear listados, e
+    índices que cubren los órdenes de los listados de clientes.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions(
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    cur.execute("INSERT OR IGNORE INTO data_versions(name, version) VALUES ('clients', 0), ('resellers', 0)")
+    for table, cols in (("clients", "slug, plan, expires, reseller_id"), ("resellers", "id, plan, expires, contact")):
+        bump = f"BEGIN UPDATE data_versions SET version = version + 1 WHERE name = '{table}'; END"
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_ver_ins AFTER INSERT ON {table} {bump}")
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_ver_upd AFTER UPDATE OF {cols} ON {table} {bump}")
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_ver_del AFTER DELETE ON {table} {bump}")
+    cur.execute("DROP INDEX IF EXISTS idx_clients_expires")
+    cur.execute("DROP INDEX IF EXISTS idx_clients_reseller")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_expires_slug ON clients(expires, slug)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_reseller_slug ON clients(reseller_id, slug)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_resellers_expires ON resellers(expires, id)")
+
+
+def _m007_client_count(cur: sqlite3.Cursor) -> None:
+    """
+    Contador de clientes por reseller (resellers.client_count), mantenido por triggers
+    sobre clients para que los límites y el listado no necesiten COUNT(*).
+    """
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(resellers)").fetchall()}
+    if "client_count" not in cols:
+        cur.execute("ALTER TABLE resellers ADD COLUMN client_count INTEGER NOT NULL DEFAULT 0")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_count_ins AFTER INSERT ON clients BEGIN
+            UPDATE resellers SET client_count = client_count + 1 WHERE id = NEW.reseller_id;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_count_del AFTER DELETE ON clients BEGIN
+            UPDATE resellers SET client_count = client_count - 1 WHERE id = OLD.reseller_id;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_count_move AFTER UPDATE OF reseller_id ON clients
+        WHEN OLD.reseller_id IS NOT NEW.reseller_id BEGIN
+            UPDATE resellers SET client_count = client_count - 1 WHERE id = OLD.reseller_id;
+            UPDATE resellers SET client_count = client_count + 1 WHERE id = NEW.reseller_id;
+        END
+    """)
+    # Un reseller creado después que sus clientes (INSERT OR REPLACE) empieza con la cuenta real
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_resellers_count_ins AFTER INSERT ON resellers BEGIN
+            UPDATE resellers SET client_count = (SELECT COUNT(*) FROM clients WHERE reseller_id = NEW.id)
+            WHERE id = NEW.id;
+        END
+    """)
+    repair_client_counts(cur)
+
+
+def _m008_receipts(cur: sqlite3.Cursor) -> None:
+    """
+    Ubicación, tamaño y SHA-256 del comprobante descargado en data_dir/invoices.
+    """
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(payments)").fetchall()}
+    for name, decl in (("receipt_path", "TEXT"), ("receipt_size", "INTEGER"), ("receipt_sha256", "TEXT")):
+        if name not in cols:
+            cur.execute(f"ALTER TABLE payments ADD COLUMN {name} {decl}")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_receipt_sha256 ON payments(receipt_sha256)")
+
+
+def _m009_receipt_dhash(cur: sqlite3.Cursor) -> None:
+    """
+    Hash perceptual del comprobante y su índice por bandas para buscar casi-duplicados.
+    """
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(payments)").fetchall()}
+    if "receipt_dhash" not in cols:
+        cur.execute("ALTER TABLE payments ADD COLUMN receipt_dhash INTEGER")
+    # Cada dHash de 64 bits se guarda partido en bandas: dos hashes cercanos comparten al
+    # menos una banda idéntica, que se encuentra con una búsqueda exacta en la clave.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS receipt_bands(
+            band INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            pid TEXT NOT NULL,
+            PRIMARY KEY(band, value, pid)
+        ) WITHOUT ROWID
+    """)
+
+
+def _m010_user_prefs(cur: sqlite3.Cursor) -> None:
+    """
+    Preferencias por usuario (por ahora, el idioma de los mensajes).
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_prefs(
+            user_id INTEGER PRIMARY KEY,
+            locale TEXT NOT NULL
+        )
+    """)
+
+
+def _m011_receipt_bands16(cur: sqlite3.Cursor) -> None:
+    """
+    Índice de casi-duplicados con bandas de 16 bits en lugar de 8 (menos candidatos).
+
+    El cálculo de las bandas está copiado aquí (4 bandas de 16 bits sobre el dhash de
+    64 bits) para que la migración no cambie si dupes.py cambia más adelante.
+    """
+    cur.execute("DELETE FROM receipt_bands")
+    cur.execute("SELECT id, receipt_dhash FROM payments WHERE receipt_dhash IS NOT NULL")
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            return
+        cur.connection.executemany(
+            "INSERT OR IGNORE INTO receipt_bands(band, value, pid) VALUES (?, ?, ?)",
+            [(i, ((r[1] & 0xFFFFFFFFFFFFFFFF) >> (i * 16)) & 0xFFFF, r[0]) for r in rows for i in range(4)]
+        )
+
+
+def _m012_export_indexes(cur: sqlite3.Cursor) -> None:
+    """
+    Índices para exportar por reseller: sus pagos (por item_id) y su auditoría (por actor).
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_item_created ON payments(item_id, created)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_actor_id ON audit(actor_id, id)")
+
+
+def _m013_audit_actor_created(cur: sqlite3.Cursor) -> None:
+    """
+    La auditoría de un actor se filtra también por fecha: (actor_id, created) sirve a
+    los dos filtros y, con el rowid al final, al orden (created, id).
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_actor_created ON audit(actor_id, created)")
+    cur.execute("DROP INDEX IF EXISTS idx_audit_actor_id")
+
+
+# Migraciones en orden: (versión, descripción, función). Nunca se editan una vez publicadas;
+# los cambios de esquema se añaden como una nueva entrada al final.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "esquema base", _m001_base),
+    (2, "índices secundarios", _m002_indexes),
+    (3, "registro de avisos de vencimiento", _m003_notifications),
+    (4, "estado de conversaciones", _m004_flows),
+    (5, "paginación de pagos", _m005_payments_keyset),
+    (6, "versiones de datos e índices de listados", _m006_listings),
+    (7, "contador de clientes por reseller", _m007_client_count),
+    (8, "comprobantes descargados", _m008_receipts),
+    (9, "hash perceptual de comprobantes", _m009_receipt_dhash),
+    (10, "preferencias de usuario", _m010_user_prefs),
+    (11, "bandas de 16 bits para comprobantes", _m011_receipt_bands16),
+    (12, "índices de exportación por reseller", _m012_export_indexes),
+    (13, "auditoría por actor y fecha", _m013_audit_actor_created),
+]
+
+
+def schema_version() -> int:
+    """
+    Devuelve la versión de esquema aplicada (PRAGMA user_version).
+    """
+    with cx(readonly=True) as c:
+        return c.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate() -> int:
+    """
+    Aplica las migraciones pendientes según PRAGMA user_version.
+
+    Cada migración corre en su propia transacción BEGIN IMMEDIATE junto con la
+    actualización de user_version, así que un fallo deja la base en la versión
+    anterior y otro proceso no puede aplicar la misma migración a la vez.
+
+    Returns:
+        int: Versión de esquema resultante.
+
     Raises:
-        sqlite3.Error: Si ocurre un error al crear las tablas o insertar datos.
+        RuntimeError: Si alguna migración falla.
     """
-    try:
-        with cx() as c:
-            cur = c.cursor()
-            
-            # Tabla settings
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS settings(
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                )
-            """)
-            
-            # Tabla resellers
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS resellers(
-                    id TEXT PRIMARY KEY,
-                    plan TEXT NOT NULL CHECK(plan IN ('res_b', 'res_p', 'res_e')),
-                    started DATE NOT NULL,
-                    expires DATE NOT NULL,
-                    contact TEXT
-                )
-            """)
-            
-            # Tabla clients
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS clients(
-                    slug TEXT PRIMARY KEY,
-                    owner_id INTEGER NOT NULL,
-                    username TEXT,
-                    reseller_id TEXT NOT NULL,
-                    plan TEXT NOT NULL CHECK(plan IN ('plan_estandar', 'plan_plus', 'plan_pro')),
-                    expires DATE NOT NULL,
-                    created TEXT NOT NULL,
-                    workdir TEXT NOT NULL,
-                    svc_status TEXT NOT NULL DEFAULT 'stopped' CHECK(svc_status IN ('active', 'stopped', 'unknown')),
-                    FOREIGN KEY(reseller_id) REFERENCES resellers(id)
-                )
-            """)
-            
-            # Tabla payments
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS payments(
-                    id TEXT PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    role TEXT NOT NULL CHECK(role IN ('client', 'reseller')),
-                    type TEXT NOT NULL CHECK(type IN ('saldo', 'cup')),
-                    amount_usd REAL NOT NULL CHECK(amount_usd >= 0),
-                    amount_cup REAL NOT NULL CHECK(amount_cup >= 0),
-                    plan TEXT NOT NULL,
-                    item_id TEXT NOT NULL,
-                    receipt_msg_id INTEGER,
-                    status TEXT NOT NULL CHECK(status IN ('pending', 'approved', 'rejected')),
-                    created TEXT NOT NULL,
-                    rate_used REAL NOT NULL CHECK(rate_used >= 0)
-                )
-            """)
-            
-            # Tabla audit
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS audit(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    actor_id INTEGER NOT NULL,
-                    action TEXT NOT NULL,
-                    meta TEXT,
-                    created TEXT NOT NULL
-                )
-            """)
-            
-            # Valores predeterminados
-            def put(k: str, v: Union[str, int, float]) -> None:
-                try:
-                    cur.execute("INSERT OR IGNORE INTO settings(key, value) VALUES(?, ?)", (k, str(v)))
-                except sqlite3.Error as e:
-                    logging.error(f"Error al insertar configuración {k}: {e}")
-                    raise
-
-            put("owner_id", str(SET.owner_id or 0))
-            put("usd_to_cup", "450")
-            # Precios reseller (mensual, en USD)
-            put("price_res_b", "10")
-            put("price_res_p", "20")
-            put("price_res_e", "30")
-            # Límites por plan (0 = ilimitado)
-            put("limit_res_b", "3")
-            put("limit_res_p", "10")
-            put("limit_res_e", "0")
-            # Precios cliente (30/90/365 días, en USD)
-            put("price_client_30", "5")
-            put("price_client_90", "14")
-            put("price_client_365", "50")
-            # Textos de pago
-            put("pay_text_saldo", (
-                "💳 **Pagar con saldo**\n"
-                "Transfiere {monto_saldo} CUP al número 63785631.\n"
-                "Luego, adjunta el comprobante en el chat."
-            ))
-            put("pay_text_cup", (
-                "🇨🇺 **Pagar en CUP**\n"
-                "Envía {monto_cup} CUP a la cuenta 9204 1299 7691 8161.\n"
-                "🔐 Código de confirmación: 56246700\n"
-                "Luego, adjunta el comprobante en el chat."
-            ))
-            put("support_contact", SET.support_contact)
-
-            c.commit()
-            logging.info("Base de datos inicializada correctamente con tablas y valores predeterminados.")
-    except sqlite3.Error as e:
-        logging.error(f"Error al inicializar la base de datos: {e}")
-        raise RuntimeError(f"No se pudo inicializar la base de datos: {e}")
+    with cx() as c:
+        cur = c.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        for num, desc, fn in MIGRATIONS:
+            if num <= version:
+                continue
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                if cur.execute("PRAGMA user_version").fetchone()[0] >= num:
+                    c.commit()
+                    continue
+                fn(cur)
+                cur.execute(f"PRAGMA user_version = {num}")
+                c.commit()
+                version = num
+                log.info("Migración %s aplicada: %s", num, desc)
+            except sqlite3.Error as e:
+                c.rollback()
+                log.error("Error en la migración %s (%s): %s", num, desc, e)
+                raise RuntimeError(f"No se pudo aplicar la migración {num}: {e}")
+    invalidate_settings()
+    return version
+
+
+def init_db() -> None:
+    """
+    Prepara la base de datos al arrancar aplicando las migraciones pendientes.
+
+    Se llama una sola vez desde main(); con el esquema al día no escribe nada.
+
+    Raises:
+        RuntimeError: Si ocurre un error al migrar la base de datos.
+    """
+    version = migrate()
+    log.info("Base de datos lista (esquema v%s).", version)
+
+
+def begin_write(cur: sqlite3.Cursor) -> None:
+    """
+    Abre la transacción actual con BEGIN IMMEDIATE (bloqueo de escritura desde el
+    principio), para que lo que se lee en ella siga siendo cierto al escribir, también
+    frente a otros procesos. No hace nada si ya hay una transacción abierta.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor de la conexión escritora.
+    """
+    if not cur.connection.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+
+
+def verify_client_counts(cur: sqlite3.Cursor) -> List[Tuple[str, int, int]]:
+    """
+    Compara resellers.client_count con el número real de clientes.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor de la base de datos.
+
+    Returns:
+        List[Tuple[str, int, int]]: (reseller, guardado, real) de los que no cuadran.
+    """
+    cur.execute("""
+        SELECT r.id, r.client_count, COALESCE(c.n, 0) AS actual
+        FROM resellers r
+        LEFT JOIN (SELECT reseller_id, COUNT(*) AS n FROM clients GROUP BY reseller_id) c
+               ON c.reseller_id = r.id
+        WHERE r.client_count IS NOT COALESCE(c.n, 0)
+    """)
+    return [(r["id"], r["client_count"], r["actual"]) for r in cur.fetchall()]
+
+
+def repair_client_counts(cur: sqlite3.Cursor) -> List[Tuple[str, int, int]]:
+    """
+    Corrige los contadores de clientes que no cuadran.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor de la conexión escritora.
+
+    Returns:
+        List[Tuple[str, int, int]]: (reseller, guardado, real) de los corregidos.
+    """
+    bad = verify_client_counts(cur)
+    if bad:
+        cur.executemany("UPDATE resellers SET client_count=? WHERE id=?", [(n, rid) for rid, _, n in bad])
+        log.warning("Contadores de clientes corregidos: %s", bad)
+    return bad
+
+
+SETTINGS_RECHECK = 5.0  # Segundos entre refresh_settings() (cambios hechos por otros procesos)
+
+
+@dataclass(frozen=True)
+class SettingsSnapshot:
+    """
+    Copia inmutable y ya tipada de la tabla settings.
+
+    Atributos:
+        rev (int): Versión de los ajustes (clave settings_rev, incrementada en cada escritura).
+        values (Mapping[str, str]): Valores crudos por clave.
+        prices (Mapping[str, float]): Precios y tasa de cambio, igual que prices().
+        limits (Mapping[str, int]): Límites de clientes por plan, igual que limits().
+    """
+    rev: int
+    values: Mapping[str, str]
+    prices: Mapping[str, float]
+    limits: Mapping[str, int]
+
+
+_snap: Optional[SettingsSnapshot] = None
+_snap_lock = threading.Lock()
+
+
+def _build_snapshot(cur: sqlite3.Cursor) -> SettingsSnapshot:
+    """
+    Lee la tabla settings completa y construye un SettingsSnapshot validado.
+
+    Raises:
+        ValueError: Si algún precio o límite no es numérico o es negativo.
+    """
+    cur.execute("SELECT key, value FROM settings")
+    values = {r["key"]: r["value"] for r in cur.fetchall()}
+    prices_dict = {
+        "usd_to_cup": float(values.get("usd_to_cup", 450.0)),
+        "res_b": float(values.get("price_res_b", 10.0)),
+        "res_p": float(values.get("price_res_p", 20.0)),
+        "res_e": float(values.get("price_res_e", 30.0)),
+        "c30": float(values.get("price_client_30", 5.0)),
+        "c90": float(values.get("price_client_90", 14.0)),
+        "c365": float(values.get("price_client_365", 50.0))
+    }
+    for key, value in prices_dict.items():
+        if value < 0:
+            log.error("Precio inválido para %s: %s", key, value)
+            raise ValueError(f"El precio para {key} debe ser no negativo.")
+    limits_dict = {
+        "res_b": int(values.get("limit_res_b", 3)),
+        "res_p": int(values.get("limit_res_p", 10)),
+        "res_e": int(values.get("limit_res_e", 0))
+    }
+    return SettingsSnapshot(
+        rev=int(values.get("settings_rev", 0)),
+        values=MappingProxyType(values),
+        prices=MappingProxyType(prices_dict),
+        limits=MappingProxyType(limits_dict),
+    )
+
+
+def _install_snapshot(snap: SettingsSnapshot) -> SettingsSnapshot:
+    global _snap
+    _snap = snap
+    log.debug("Ajustes cargados en memoria (rev=%s)", snap.rev)
+    return snap
+
+
+def invalidate_settings() -> None:
+    """
+    Descarta el snapshot en memoria para que el siguiente acceso relea la tabla settings.
+    """
+    global _snap
+    with _snap_lock:
+        _snap = None
+
+
+def load_settings() -> SettingsSnapshot:
+    """
+    Lee la tabla settings y deja el snapshot en memoria (al arrancar, en el hilo de la DB).
+
+    Returns:
+        SettingsSnapshot: Ajustes vigentes.
+
+    Raises:
+        RuntimeError: Si no se pueden leer los ajustes.
+    """
+    with _snap_lock:
+        try:
+            with cx(readonly=True) as c:
+                return _install_snapshot(_build_snapshot(c.cursor()))
+        except (sqlite3.Error, ValueError) as e:
+            log.error("Error al cargar los ajustes: %s", e)
+            raise RuntimeError(f"No se pudieron cargar los ajustes: {e}")
+
+
+def refresh_settings() -> SettingsSnapshot:
+    """
+    Recarga el snapshot si otro proceso cambió los ajustes (settings_rev distinto).
+
+    Hace E/S: se llama cada SETTINGS_RECHECK segundos desde el hilo de la DB
+    (db_async.run), nunca desde el bucle de eventos.
+
+    Returns:
+        SettingsSnapshot: Ajustes vigentes.
+
+    Raises:
+        RuntimeError: Si no se pueden leer los ajustes.
+    """
+    if _snap is None:
+        return load_settings()
+    with _snap_lock:
+        try:
+            with cx(readonly=True) as c:
+                row = c.execute("SELECT value FROM settings WHERE key='settings_rev'").fetchone()
+                if int(row["value"] if row else 0) != _snap.rev:
+                    return _install_snapshot(_build_snapshot(c.cursor()))
+            return _snap
+        except (sqlite3.Error, ValueError) as e:
+            log.error("Error al recargar los ajustes: %s", e)
+            raise RuntimeError(f"No se pudieron recargar los ajustes: {e}")
+
+
+def settings_snapshot() -> SettingsSnapshot:
+    """
+    Devuelve el snapshot de ajustes en memoria, sin tocar la base de datos.
+
+    Las escrituras de este proceso (set_setting) reemplazan el snapshot al instante y
+    los cambios de otros procesos llegan con refresh_settings(). Solo si aún no se ha
+    cargado (scripts, o antes de load_settings() al arrancar) se lee la tabla aquí.
+
+    Returns:
+        SettingsSnapshot: Ajustes vigentes.
+
+    Raises:
+        RuntimeError: Si no se pueden leer los ajustes.
+    """
+    snap = _snap
+    return snap if snap is not None else load_settings()
+
 
-# ---- Helpers ----
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     """
-    Obtiene un valor de configuración de la tabla settings.
+    Obtiene un valor de configuración desde el snapshot en memoria.
 
     Args:
         key (str): Clave de la configuración.
@@ -174,46 +783,141 @@ def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
 
     Returns:
         Optional[str]: Valor de la configuración o el valor predeterminado.
-    
+
     Raises:
-        sqlite3.Error: Si ocurre un error al consultar la base de datos.
+        RuntimeError: Si no se pueden cargar los ajustes.
     """
-    try:
-        with cx() as c:
-            cur = c.cursor()
-            cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-            row = cur.fetchone()
-            value = row["value"] if row else default
-            logging.debug(f"Obtenida configuración {key}: {value}")
-            return value
-    except sqlite3.Error as e:
-        logging.error(f"Error al obtener configuración {key}: {e}")
-        raise RuntimeError(f"No se pudo obtener la configuración {key}: {e}")
+    return settings_snapshot().values.get(key, default)
 
 def set_setting(key: str, value: Union[str, int, float]) -> None:
     """
-    Establece o actualiza un valor de configuración en la tabla settings.
+    Establece o actualiza un valor de configuración e incrementa settings_rev.
+
+    El snapshot en memoria se reconstruye en la misma transacción, de modo que
+    las lecturas posteriores de este proceso ven el cambio sin consultar la DB.
 
     Args:
         key (str): Clave de la configuración.
         value (Union[str, int, float]): Valor a almacenar.
 
     Raises:
-        sqlite3.Error: Si ocurre un error al actualizar la base de datos.
+        RuntimeError: Si ocurre un error al actualizar la base de datos.
     """
     try:
         with cx() as c:
             cur = c.cursor()
             cur.execute("INSERT OR REPLACE INTO settings(key, value) VALUES(?, ?)", (key, str(value)))
-            c.commit()
-            logging.info(f"Configuración actualizada: {key} = {value}")
-    except sqlite3.Error as e:
-        logging.error(f"Error al establecer configuración {key}: {e}")
+            cur.execute(
+                """INSERT INTO settings(key, value) VALUES('settings_rev', '1')
+                   ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"""
+            )
+            snap = _build_snapshot(cur)
+        with _snap_lock:
+            _install_snapshot(snap)
+        if key == "owner_id":
+            _roles.clear()
+        log.info("Configuración actualizada: %s = %s (rev=%s)", key, value, snap.rev)
+    except (sqlite3.Error, ValueError) as e:
+        log.error("Error al establecer configuración %s: %s", key, e)
         raise RuntimeError(f"No se pudo actualizar la configuración {key}: {e}")
 
+ROLE_CACHE_SIZE = 4096    # Usuarios distintos recordados
+ROLE_CACHE_TTL = 300.0    # Segundos; cubre cambios hechos por otros procesos
+
+
+class RoleCache:
+    """
+    Caché LRU con caducidad (TTL) de roles por ID de usuario, con contadores de aciertos.
+
+    Se invalida explícitamente cuando cambia la pertenencia (alta de reseller,
+    creación de cliente o cambio de dueño); el TTL solo acota cuánto puede tardar
+    en verse un cambio hecho fuera de este proceso.
+    """
+
+    def __init__(self, maxsize: int = ROLE_CACHE_SIZE, ttl: float = ROLE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[int, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid: int) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(uid)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._data[uid]
+                self.misses += 1
+                return None
+            self._data.move_to_end(uid)
+            self.hits += 1
+            return item[0]
+
+    def put(self, uid: int, role: str) -> None:
+        with self._lock:
+            self._data[uid] = (role, time.monotonic() + self.ttl)
+            self._data.move_to_end(uid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, uid: int) -> None:
+        with self._lock:
+            self._data.pop(uid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_roles = RoleCache()
+
+
+def invalidate_role(uid: Optional[int] = None) -> None:
+    """
+    Invalida el rol cacheado de un usuario, o de todos si uid es None.
+
+    Args:
+        uid (Optional[int]): ID del usuario cuya pertenencia cambió.
+    """
+    if uid is None:
+        _roles.clear()
+    else:
+        _roles.invalidate(int(uid))
+
+
+def role_cache_stats() -> Dict[str, int]:
+    """
+    Devuelve el tamaño y los contadores de aciertos/fallos de la caché de roles.
+    """
+    return _roles.stats()
+
+
+def cached_role(uid: int) -> Optional[str]:
+    """
+    Resuelve el rol sin tocar la base de datos, si es posible.
+
+    Args:
+        uid (int): ID del usuario en Telegram.
+
+    Returns:
+        Optional[str]: "boss" o el rol cacheado; None si hay que consultar role_for().
+    """
+    snap = _snap
+    if snap is None:
+        return None  # Ajustes sin cargar: role_for() los carga en el hilo de la DB
+    if str(uid) == snap.values.get("owner_id", "0"):
+        return "boss"
+    return _roles.get(uid)
+
+
 def role_for(uid: int) -> str:
     """
-    Determina el rol de un usuario según su ID.
+    Determina el rol de un usuario según su ID, usando la caché de roles.
 
     Args:
         uid (int): ID del usuario en Telegram.
@@ -222,90 +926,124 @@ def role_for(uid: int) -> str:
         str: Rol del usuario ("boss", "reseller", "client" o "guest").
     
     Raises:
-        sqlite3.Error: Si ocurre un error al consultar la base de datos.
+        RuntimeError: Si ocurre un error al consultar la base de datos.
     """
+    if str(uid) == get_setting("owner_id", "0"):
+        return "boss"
+    role = _roles.get(uid)
+    if role is not None:
+        return role
     try:
-        if str(uid) == get_setting("owner_id", "0"):
-            logging.debug(f"Usuario {uid} identificado como boss.")
-            return "boss"
-        with cx() as c:
+        with cx(readonly=True) as c:
             cur = c.cursor()
             cur.execute("SELECT 1 FROM resellers WHERE id=?", (str(uid),))
             if cur.fetchone():
-                logging.debug(f"Usuario {uid} identificado como reseller.")
-                return "reseller"
-            cur.execute("SELECT 1 FROM clients WHERE owner_id=?", (uid,))
-            if cur.fetchone():
-                logging.debug(f"Usuario {uid} identificado como client.")
-                return "client"
-        logging.debug(f"Usuario {uid} identificado como guest.")
-        return "guest"
+                role = "reseller"
+            else:
+                cur.execute("SELECT 1 FROM clients WHERE owner_id=?", (uid,))
+                role = "client" if cur.fetchone() else "guest"
+        _roles.put(uid, role)
+        log.debug("Usuario %s identificado como %s.", uid, role)
+        return role
     except sqlite3.Error as e:
-        logging.error(f"Error al determinar rol para usuario {uid}: {e}")
+        log.error("Error al determinar rol para usuario %s: %s", uid, e)
         raise RuntimeError(f"No se pudo determinar el rol del usuario {uid}: {e}")
 
-def limits(cur: sqlite3.Cursor) -> Dict[str, int]:
+# Idioma preferido por usuario, con la misma caché LRU/TTL que los roles; "" = sin preferencia
+_locales = RoleCache()
+
+
+def cached_locale(uid: int) -> Optional[str]:
+    """
+    Devuelve el idioma guardado del usuario si está en la caché.
+
+    Returns:
+        Optional[str]: Código de idioma, "" si no eligió ninguno o None si hay que
+        consultar locale_for().
+    """
+    return _locales.get(uid)
+
+
+def locale_for(uid: int) -> str:
     """
-    Obtiene los límites de clientes por plan de reseller.
+    Obtiene el idioma elegido por un usuario (/lang), usando la caché.
 
     Args:
-        cur (sqlite3.Cursor): Cursor de la base de datos.
+        uid (int): ID del usuario en Telegram.
 
     Returns:
-        Dict[str, int]: Diccionario con los límites por plan (res_b, res_p, res_e).
-    
+        str: Código de idioma, o "" si no eligió ninguno.
+
     Raises:
-        sqlite3.Error: Si ocurre un error al consultar la base de datos.
+        RuntimeError: Si ocurre un error al consultar la base de datos.
     """
+    locale = _locales.get(uid)
+    if locale is not None:
+        return locale
     try:
-        cur.execute("SELECT key, value FROM settings WHERE key LIKE 'limit_%'")
-        settings = {r["key"]: int(r["value"]) for r in cur.fetchall()}
-        limits_dict = {
-            "res_b": settings.get("limit_res_b", 3),
-            "res_p": settings.get("limit_res_p", 10),
-            "res_e": settings.get("limit_res_e", 0)
-        }
-        logging.debug(f"Límites obtenidos: {limits_dict}")
-        return limits_dict
+        with cx(readonly=True) as c:
+            row = c.execute("SELECT locale FROM user_prefs WHERE user_id=?", (uid,)).fetchone()
+        locale = row["locale"] if row else ""
+        _locales.put(uid, locale)
+        return locale
     except sqlite3.Error as e:
-        logging.error(f"Error al obtener límites: {e}")
-        raise RuntimeError(f"No se pudieron obtener los límites: {e}")
+        log.error("Error al leer el idioma del usuario %s: %s", uid, e)
+        raise RuntimeError(f"No se pudo leer el idioma del usuario {uid}: {e}")
+
 
-def prices(cur: sqlite3.Cursor) -> Dict[str, float]:
+def set_locale(uid: int, locale: str) -> None:
     """
-    Obtiene los precios de los planes y la tasa de cambio USD a CUP.
+    Guarda el idioma elegido por un usuario.
 
     Args:
-        cur (sqlite3.Cursor): Cursor de la base de datos.
+        uid (int): ID del usuario en Telegram.
+        locale (str): Código de idioma del catálogo de mensajes.
 
-    Returns:
-        Dict[str, float]: Diccionario con precios y tasa de cambio.
-    
     Raises:
-        sqlite3.Error: Si ocurre un error al consultar la base de datos.
-        ValueError: Si los valores no son numéricos válidos.
+        RuntimeError: Si ocurre un error al escribir en la base de datos.
     """
     try:
-        cur.execute("SELECT key, value FROM settings WHERE key LIKE 'price_%' OR key='usd_to_cup'")
-        settings = {r["key"]: r["value"] for r in cur.fetchall()}
-        prices_dict = {
-            "usd_to_cup": float(settings.get("usd_to_cup", 450.0)),
-            "res_b": float(settings.get("price_res_b", 10.0)),
-            "res_p": float(settings.get("price_res_p", 20.0)),
-            "res_e": float(settings.get("price_res_e", 30.0)),
-            "c30": float(settings.get("price_client_30", 5.0)),
-            "c90": float(settings.get("price_client_90", 14.0)),
-            "c365": float(settings.get("price_client_365", 50.0))
-        }
-        for key, value in prices_dict.items():
-            if value < 0:
-                logging.error(f"Precio inválido para {key}: {value}")
-                raise ValueError(f"El precio para {key} debe ser no negativo.")
-        logging.debug(f"Precios obtenidos: {prices_dict}")
-        return prices_dict
-    except (sqlite3.Error, ValueError) as e:
-        logging.error(f"Error al obtener precios: {e}")
-        raise RuntimeError(f"No se pudieron obtener los precios: {e}")
+        with cx() as c:
+            c.execute(
+                """INSERT INTO user_prefs(user_id, locale) VALUES(?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET locale = excluded.locale""",
+                (uid, locale)
+            )
+        _locales.put(uid, locale)
+        log.info("Idioma del usuario %s: %s", uid, locale)
+    except sqlite3.Error as e:
+        log.error("Error al guardar el idioma del usuario %s: %s", uid, e)
+        raise RuntimeError(f"No se pudo guardar el idioma del usuario {uid}: {e}")
+
+def limits(cur: Optional[sqlite3.Cursor] = None) -> Mapping[str, int]:
+    """
+    Obtiene los límites de clientes por plan de reseller desde el snapshot en memoria.
+
+    Args:
+        cur (Optional[sqlite3.Cursor]): Ignorado; se mantiene por compatibilidad.
+
+    Returns:
+        Mapping[str, int]: Límites por plan (res_b, res_p, res_e), de solo lectura.
+
+    Raises:
+        RuntimeError: Si no se pueden cargar los ajustes.
+    """
+    return settings_snapshot().limits
+
+def prices(cur: Optional[sqlite3.Cursor] = None) -> Mapping[str, float]:
+    """
+    Obtiene los precios de los planes y la tasa USD a CUP desde el snapshot en memoria.
+
+    Args:
+        cur (Optional[sqlite3.Cursor]): Ignorado; se mantiene por compatibilidad.
+
+    Returns:
+        Mapping[str, float]: Precios y tasa de cambio, de solo lectura.
+
+    Raises:
+        RuntimeError: Si no se pueden cargar los ajustes o algún precio es inválido.
+    """
+    return settings_snapshot().prices
 
 def prorate(old_base: float, new_base: float, started: str, expires: str) -> float:
     """
@@ -325,21 +1063,21 @@ def prorate(old_base: float, new_base: float, started: str, expires: str) -> flo
     """
     try:
         if new_base <= old_base:
-            logging.debug(f"No se aplica prorrateo: nuevo precio ({new_base}) <= precio actual ({old_base})")
+            log.debug("No se aplica prorrateo: nuevo precio (%s) <= precio actual (%s)", new_base, old_base)
             return 0.0
         start_date = dt.date.fromisoformat(started)
         expire_date = dt.date.fromisoformat(expires)
         today = dt.date.today()
         if today >= expire_date:
-            logging.debug(f"No se aplica prorrateo: plan ya vencido ({expires})")
+            log.debug("No se aplica prorrateo: plan ya vencido (%s)", expires)
             return 0.0
         period = (expire_date - start_date).days or 30
         days_left = (expire_date - today).days
         prorate_cost = round((new_base - old_base) * days_left / period, 2)
-        logging.debug(f"Prorrateo calculado: {prorate_cost} (días restantes: {days_left}/{period})")
+        log.debug("Prorrateo calculado: %s (días restantes: %s/%s)", prorate_cost, days_left, period)
         return prorate_cost
     except ValueError as e:
-        logging.error(f"Error al calcular prorrateo: {e}")
+        log.error("Error al calcular prorrateo: %s", e)
         raise ValueError(f"Datos inválidos para prorrateo: {e}")
 
 def ensure_client_workdir(slug: str) -> Path:
@@ -358,14 +1096,14 @@ def ensure_client_workdir(slug: str) -> Path:
     """
     try:
         if not slug:
-            logging.error("Slug vacío proporcionado para ensure_client_workdir.")
+            log.error("Slug vacío proporcionado para ensure_client_workdir.")
             raise ValueError("El slug del cliente no puede estar vacío.")
         workdir = SET.data_dir / "clients" / slug
         workdir.mkdir(parents=True, exist_ok=True)
-        logging.info(f"Directorio de cliente creado/existe: {workdir}")
+        log.info("Directorio de cliente creado/existe: %s", workdir)
         return workdir
     except (ValueError, OSError) as e:
-        logging.error(f"Error al crear directorio para slug {slug}: {e}")
+        log.error("Error al crear directorio para slug %s: %s", slug, e)
         raise RuntimeError(f"No se pudo crear el directorio para el cliente {slug}: {e}")
 
 def slugify(s: str) -> str:
@@ -384,12 +1122,12 @@ def slugify(s: str) -> str:
     try:
         slug = re.sub(r"[^a-zA-Z0-9_]+", "", s.strip().lstrip("@"))[:32]
         if not slug:
-            logging.warning(f"Slug inválido generado a partir de: {s}. Usando 'tenant'.")
+            log.warning("Slug inválido generado a partir de: %s. Usando 'tenant'.", s)
             slug = "tenant"
-        logging.debug(f"Slug generado: {slug} (entrada: {s})")
+        log.debug("Slug generado: %s (entrada: %s)", slug, s)
         return slug
     except Exception as e:
-        logging.error(f"Error al generar slug para {s}: {e}")
+        log.error("Error al generar slug para %s: %s", s, e)
         raise RuntimeError(f"No se pudo generar slug: {e}")
 
 def new_id() -> str:
@@ -401,10 +1139,10 @@ def new_id() -> str:
     """
     try:
         new_id = uuid.uuid4().hex[:12]
-        logging.debug(f"ID generado: {new_id}")
+        log.debug("ID generado: %s", new_id)
         return new_id
     except Exception as e:
-        logging.error(f"Error al generar ID: {e}")
+        log.error("Error al generar ID: %s", e)
         raise RuntimeError(f"No se pudo generar un ID único: {e}")
 
 def iso_now() -> str:
@@ -416,8 +1154,94 @@ def iso_now() -> str:
     """
     try:
         timestamp = dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds")
-        logging.debug(f"Timestamp generado: {timestamp}")
+        log.debug("Timestamp generado: %s", timestamp)
         return timestamp
     except Exception as e:
-        logging.error(f"Error al generar timestamp ISO: {e}")
+        log.error("Error al generar timestamp ISO: %s", e)
         raise RuntimeError(f"No se pudo generar timestamp ISO: {e}")
+
+SLUG_HINTS = 4096   # Bases de slug cuyo siguiente sufijo libre se recuerda
+SLUG_ATTEMPTS = 5   # Reintentos ante UNIQUE antes de rendirse
+SLUG_SUFFIX_DIGITS = 6  # Cifras máximas del sufijo numérico que se busca por rango
+
+_slug_hints: "OrderedDict[str, int]" = OrderedDict()
+_slug_lock = threading.Lock()
+
+
+def _slug_candidate(base: str, n: int) -> str:
+    return base if n <= 1 else f"{base}{n}"
+
+
+def _next_suffix(cur: sqlite3.Cursor, base: str) -> int:
+    """
+    Primer sufijo libre para `base` con una sola consulta por rango sobre la clave
+    primaria: 1 (el slug base) si no existe, o el menor número libre desde 2.
+
+    Solo cuentan los slugs que este asignador puede haber generado: `base` seguido de
+    un número sin ceros a la izquierda. Un slug ajeno con el mismo prefijo (otro ID
+    más largo, "ana2024" junto a "ana") ocupa como mucho un número, no desplaza el
+    sufijo hasta después de él.
+    """
+    start = len(base) + 1
+    cur.execute(
+        """SELECT substr(slug, ?) AS rest
+           FROM clients
+           WHERE slug >= ? AND slug < ? AND length(slug) <= ?
+             AND (slug = ? OR (substr(slug, ?) GLOB '[1-9]*' AND substr(slug, ?) NOT GLOB '*[^0-9]*'))""",
+        (start, base, base + "\x7f", len(base) + SLUG_SUFFIX_DIGITS, base, start, start)
+    )
+    used = {int(r["rest"]) if r["rest"] else 1 for r in cur.fetchall()}
+    n = 1
+    while n in used:
+        n += 1
+    return n
+
+
+def allocate_client(cur: sqlite3.Cursor, owner_id: int, reseller_id: str, plan: str, expires: str) -> str:
+    """
+    Crea un cliente con el primer slug libre derivado de su ID ("12345", "123452"...).
+
+    El siguiente sufijo de cada base se recuerda en memoria, así que normalmente basta
+    con el INSERT; si otro proceso ocupó ese slug, el UNIQUE de la clave primaria lo
+    rechaza y se recalcula con una consulta por rango antes de reintentar.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor de la conexión escritora (dentro de una transacción).
+        owner_id (int): ID de Telegram del cliente.
+        reseller_id (str): Reseller (o boss) al que pertenece.
+        plan (str): Plan del cliente.
+        expires (str): Fecha de vencimiento (ISO).
+
+    Returns:
+        str: Slug asignado.
+
+    Raises:
+        RuntimeError: Si no se encuentra un slug libre tras SLUG_ATTEMPTS intentos.
+    """
+    base = slugify(str(owner_id))
+    with _slug_lock:
+        n = _slug_hints.get(base)
+    if n is None:
+        n = _next_suffix(cur, base)
+    for _ in range(SLUG_ATTEMPTS):
+        slug = _slug_candidate(base, n)
+        workdir = ensure_client_workdir(slug)
+        try:
+            cur.execute(
+                """INSERT INTO clients(slug, owner_id, username, reseller_id, plan, expires, created, workdir, svc_status)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (slug, owner_id, None, reseller_id, plan, expires, iso_now(), str(workdir), "stopped")
+            )
+        except sqlite3.IntegrityError as e:
+            if "clients.slug" not in str(e):
+                raise
+            log.info("Slug %s ocupado; recalculando sufijo para %s", slug, base)
+            n = _next_suffix(cur, base)
+            continue
+        with _slug_lock:
+            _slug_hints[base] = n + 1
+            _slug_hints.move_to_end(base)
+            while len(_slug_hints) > SLUG_HINTS:
+                _slug_hints.popitem(last=False)
+        return slug
+    raise RuntimeError(f"No se encontró un slug libre para {base} tras {SLUG_ATTEMPTS} intentos")
@@ -0,0 +1,253 @@
+"""
+Cola central de mensajes salientes.
+
+Los handlers encolan y vuelven al instante; un grupo acotado de workers envía
+respetando un token bucket global y otro por chat (límites de Telegram para bots),
+con prioridades y reintentos automáticos ante FloodWait.
+"""
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from telethon import errors
+from .metrics import FLOOD_WAIT_SECONDS, OUTBOX_SENT
+import logging
+
+log = logging.getLogger(__name__)
+
+# Prioridades: menor número = antes
+PRIO_ALERT = 0      # Avisos al boss (pagos nuevos)
+PRIO_USER = 1       # Respuestas a acciones del usuario (aprobaciones, bienvenidas)
+PRIO_REMINDER = 2   # Recordatorios de vencimiento
+
+GLOBAL_RATE = 30.0  # Mensajes/segundo para todo el bot
+CHAT_RATE = 1.0     # Mensajes/segundo por chat
+WORKERS = 8
+MAX_RETRIES = 3
+
+# Errores definitivos: reintentar no sirve de nada
+_PERMANENT = (
+    errors.UserIsBlockedError,
+    errors.InputUserDeactivatedError,
+    errors.PeerIdInvalidError,
+    errors.ChatWriteForbiddenError,
+)
+
+
+class TokenBucket:
+    """
+    Token bucket clásico.
+
+    Args:
+        rate (float): Tokens repuestos por segundo.
+        capacity (float): Ráfaga máxima.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Segundos que faltan para que haya un token disponible (0 si ya lo hay)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Vacía el bucket para que no haya tokens durante `seconds` segundos."""
+        self.tokens = -seconds * self.rate
+
+
+@dataclass(order=True)
+class _Job:
+    prio: int
+    seq: int
+    chat_id: Any = field(compare=False)
+    text: str = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False, default_factory=dict)
+    attempts: int = field(compare=False, default=0)
+
+
+class Outbox:
+    """
+    Despachador de mensajes salientes con concurrencia acotada y límites de velocidad.
+
+    Args:
+        client: TelegramClient usado para enviar.
+        workers (int): Envíos concurrentes como máximo.
+        global_rate (float): Mensajes/segundo para todo el bot.
+        chat_rate (float): Mensajes/segundo por chat.
+    """
+
+    def __init__(self, client, workers: int = WORKERS, global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE):
+        # El flood_sleep_threshold del cliente no se toca: es compartido con los handlers,
+        # las descargas y las subidas. Los FloodWait cortos los duerme Telethon dentro del
+        # envío (solo espera ese worker); los largos llegan aquí y frenan los buckets.
+        self.client = client
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        # Mensajes retenidos hasta su próximo intento, por seq
+        self._delayed: Dict[int, asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        return (self._queue.qsize() if self._queue else 0) + len(self._delayed)
+
+    def send(self, chat_id, text: str, prio: int = PRIO_USER, **kwargs) -> None:
+        """
+        Encola un mensaje y vuelve de inmediato.
+
+        Args:
+            chat_id: Destinatario.
+            text (str): Texto del mensaje.
+            prio (int): PRIO_ALERT, PRIO_USER o PRIO_REMINDER.
+            **kwargs: Argumentos extra para send_message (buttons, parse_mode...).
+        """
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._queue.put_nowait(_Job(prio, next(self._seq), chat_id, text, kwargs))
+
+    def send_many(self, messages: Iterable[Tuple[Any, ...]], prio: int = PRIO_USER, **kwargs) -> int:
+        """
+        Encola un lote de mensajes de una vez (por ejemplo, avisos de una aprobación masiva).
+
+        Args:
+            messages: Tuplas (chat_id, texto) o (chat_id, texto, kwargs propios del mensaje,
+                como formatting_entities).
+            prio (int): Prioridad común del lote.
+            **kwargs: Argumentos extra comunes para send_message.
+
+        Returns:
+            int: Número de mensajes encolados.
+        """
+        n = 0
+        for chat_id, text, *extra in messages:
+            self.send(chat_id, text, prio, **kwargs, **(extra[0] if extra else {}))
+            n += 1
+        return n
+
+    def _requeue(self, job: _Job, delay: float) -> None:
+        # Conserva su seq: al volver a la cola sigue por delante de los mensajes posteriores
+        self._delayed[job.seq] = asyncio.get_running_loop().call_later(delay, self._release, job)
+
+    def _release(self, job: _Job) -> None:
+        self._delayed.pop(job.seq, None)
+        self._queue.put_nowait(job)
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    async def _deliver(self, job: _Job) -> None:
+        now = time.monotonic()
+        bucket = self._bucket(job.chat_id)
+        wait = bucket.delay(now)
+        if wait > 0:
+            # No bloquear al worker por un chat lento: el mensaje vuelve a la cola.
+            self._requeue(job, wait)
+            return
+        bucket.take(now)  # Reservar el turno del chat antes de esperar al bucket global
+        wait = self._global.delay(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+            now = time.monotonic()
+        self._global.take(now)
+        try:
+            await self.client.send_message(job.chat_id, job.text, **job.kwargs)
+            self.sent += 1
+            OUTBOX_SENT.inc("ok")
+        except errors.FloodWaitError as e:
+            self.flood_waits += 1
+            OUTBOX_SENT.inc("flood_wait")
+            FLOOD_WAIT_SECONDS.inc(value=e.seconds)
+            # Los límites de Telegram para bots son de todo el bot: frenan todos los workers
+            bucket.pause(e.seconds)
+            self._global.pause(e.seconds)
+            log.warning("FloodWait de %ss enviando a %s; se reintentará.", e.seconds, job.chat_id)
+            self._requeue(job, e.seconds)
+        except _PERMANENT as e:
+            self.failed += 1
+            OUTBOX_SENT.inc("failed")
+            log.warning("Mensaje descartado para %s: %s", job.chat_id, e.__class__.__name__, extra={"sample": 20})
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts > MAX_RETRIES:
+                self.failed += 1
+                OUTBOX_SENT.inc("failed")
+                log.error("No se pudo enviar a %s tras %s reintentos: %s", job.chat_id, MAX_RETRIES, e)
+            else:
+                self._requeue(job, 2 ** job.attempts)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                log.error("Error en el worker de salida: %s", e)
+            finally:
+                self._queue.task_done()
+            if len(self._chats) > 10000:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if b.delay(now) > 0}
+
+    def start(self) -> None:
+        """
+        Arranca los workers en el bucle de eventos actual.
+        """
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        log.info("Cola de salida iniciada con %s workers.", self.workers)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Espera (como mucho `timeout` segundos) a que se vacíe la cola, incluidos los
+        mensajes retenidos para reintentar, y detiene los workers.
+        """
+        if self._queue is not None:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                try:
+                    await asyncio.wait_for(self._queue.join(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if not self._delayed:
+                    break
+                due = min(h.when() for h in self._delayed.values())
+                if due > deadline:
+                    break
+                await asyncio.sleep(max(due - loop.time(), 0) + 0.01)
+            if len(self):
+                log.warning("Se detiene la cola de salida con %s mensajes pendientes (%s retenidos para reintentar).",
+                            len(self), len(self._delayed))
+            for h in self._delayed.values():
+                h.cancel()
+            self._delayed.clear()
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
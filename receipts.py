@@ -0,0 +1,240 @@
+"""
+Descarga de comprobantes de pago a data_dir/invoices.
+
+El handler solo encola el pago; unos pocos workers descargan el medio por trozos
+(iter_download), calculan el SHA-256 mientras escriben y guardan el archivo con
+direccionamiento por contenido (invoices/ab/cd/<sha256>.<ext>), de modo que un mismo
+comprobante reenviado ocupa disco una sola vez. Ruta, tamaño y hash quedan en la
+fila del pago, junto con el hash perceptual para detectar repetidos (ver dupes).
+"""
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Optional
+from .config import SET
+from . import db_async as db
+from . import dupes
+import logging
+
+log = logging.getLogger(__name__)
+
+INVOICES = SET.data_dir / "invoices"
+CHUNK_SIZE = 128 * 1024            # Bytes por petición de descarga
+MAX_RECEIPT_BYTES = 20 * 1024 * 1024
+WORKERS = 2
+MAX_RETRIES = 3
+
+
+@dataclass(frozen=True)
+class Receipt:
+    """
+    Comprobante ya guardado en disco.
+
+    Attributes:
+        pid: ID del pago.
+        path: Ruta relativa a data_dir/invoices.
+        size: Tamaño en bytes.
+        sha256: Hash hexadecimal del contenido.
+        dhash: Hash perceptual (None si no es una imagen).
+    """
+    pid: str
+    path: str
+    size: int
+    sha256: str
+    dhash: Optional[int] = None
+
+
+OnStored = Callable[[Receipt], Awaitable[None]]
+OnFailed = Callable[[str], Awaitable[None]]
+
+
+def receipt_path(rel: str) -> Path:
+    """
+    Ruta absoluta de un comprobante a partir de la guardada en payments.receipt_path.
+    """
+    return INVOICES / rel
+
+
+def _open_tmp(pid: str) -> Any:
+    tmp = INVOICES / "tmp"
+    tmp.mkdir(parents=True, exist_ok=True)
+    return open(tmp / f"{pid}.part", "wb")
+
+
+def _finish(fh: Any, sha: str, ext: str) -> str:
+    """Cierra el temporal y lo mueve a su ruta por contenido; devuelve la ruta relativa."""
+    fh.close()
+    rel = f"{sha[:2]}/{sha[2:4]}/{sha}{ext}"
+    dest = INVOICES / rel
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists():
+        os.unlink(fh.name)  # Mismo contenido ya guardado
+    else:
+        os.replace(fh.name, dest)
+    return rel
+
+
+def _discard(fh: Any) -> None:
+    fh.close()
+    try:
+        os.unlink(fh.name)
+    except FileNotFoundError:
+        pass
+
+
+class ReceiptIngestor:
+    """
+    Cola de descarga de comprobantes en segundo plano.
+
+    Args:
+        client: TelegramClient usado para descargar.
+        on_stored: Corrutina opcional llamada con cada Receipt guardado.
+        on_failed: Corrutina opcional llamada con el ID del pago si la descarga se abandona.
+        workers (int): Descargas concurrentes.
+    """
+
+    def __init__(self, client, on_stored: Optional[OnStored] = None,
+                 on_failed: Optional[OnFailed] = None, workers: int = WORKERS):
+        self.client = client
+        self.on_stored = on_stored
+        self.on_failed = on_failed
+        self.workers = workers
+        self.stored = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, pid: str, message=None, chat_id: Optional[int] = None, msg_id: Optional[int] = None) -> None:
+        """
+        Encola la descarga del comprobante de un pago y vuelve de inmediato.
+
+        Args:
+            pid (str): ID del pago.
+            message: Mensaje con el medio (si se tiene a mano).
+            chat_id, msg_id: Para recuperar el mensaje si no se pasa `message`.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait((pid, message, chat_id, msg_id, 0))
+
+    async def _download(self, pid: str, message) -> Receipt:
+        size = getattr(message.file, "size", None) or 0
+        if size > MAX_RECEIPT_BYTES:
+            raise ValueError(f"comprobante demasiado grande ({size} bytes)")
+        ext = (message.file.ext if message.file else None) or ".bin"
+        sha = hashlib.sha256()
+        written = 0
+        fh = await asyncio.to_thread(_open_tmp, pid)
+        try:
+            async for chunk in self.client.iter_download(message.media, request_size=CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_RECEIPT_BYTES:
+                    raise ValueError(f"comprobante demasiado grande (>{MAX_RECEIPT_BYTES} bytes)")
+                sha.update(chunk)
+                await asyncio.to_thread(fh.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(_discard, fh)
+            raise
+        digest = sha.hexdigest()
+        rel = await asyncio.to_thread(_finish, fh, digest, ext)
+        return Receipt(pid, rel, written, digest)
+
+    async def _ingest(self, pid: str, message, chat_id, msg_id) -> Receipt:
+        if message is None:
+            message = await self.client.get_messages(chat_id, ids=msg_id)
+            if message is None or not message.media:
+                raise LookupError(f"mensaje {msg_id} de {chat_id} sin medio")
+        receipt = await self._download(pid, message)
+        dhash = await dupes.perceptual_hash(receipt_path(receipt.path))
+
+        def _tx(cur):
+            cur.execute(
+                "UPDATE payments SET receipt_path=?, receipt_size=?, receipt_sha256=? WHERE id=?",
+                (receipt.path, receipt.size, receipt.sha256, pid)
+            )
+            if dhash is not None:
+                dupes.index_receipt(cur, pid, dhash)
+
+        await db.transaction(_tx)
+        return Receipt(pid, receipt.path, receipt.size, receipt.sha256, dhash)
+
+    async def _failed(self, pid: str) -> None:
+        self.failed += 1
+        if self.on_failed is not None:
+            try:
+                await self.on_failed(pid)
+            except Exception as e:
+                log.error("Error en el aviso de comprobante fallido del pago %s: %s", pid, e)
+
+    async def _stored(self, receipt: Receipt) -> None:
+        # Fuera del try de la descarga: si falla el aviso no se vuelve a descargar
+        self.stored += 1
+        log.info("Comprobante del pago %s guardado: %s (%s bytes)", receipt.pid, receipt.path, receipt.size)
+        if self.on_stored is not None:
+            try:
+                await self.on_stored(receipt)
+            except Exception as e:
+                log.error("Error en el aviso del comprobante del pago %s: %s", receipt.pid, e)
+
+    async def _worker(self) -> None:
+        while True:
+            pid, message, chat_id, msg_id, attempts = await self._queue.get()
+            try:
+                receipt = await self._ingest(pid, message, chat_id, msg_id)
+            except (ValueError, LookupError) as e:
+                await self._failed(pid)
+                log.warning("Comprobante del pago %s descartado: %s", pid, e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempts + 1 >= MAX_RETRIES:
+                    log.error("No se pudo descargar el comprobante del pago %s: %s", pid, e)
+                    await self._failed(pid)
+                else:
+                    delay = 2 ** (attempts + 1)
+                    asyncio.get_running_loop().call_later(
+                        delay, self._queue.put_nowait, (pid, message, chat_id, msg_id, attempts + 1)
+                    )
+            else:
+                await self._stored(receipt)
+            finally:
+                self._queue.task_done()
+
+    async def requeue_pending(self) -> int:
+        """
+        Encola los pagos pendientes cuyo comprobante aún no se descargó (tras un reinicio).
+
+        Returns:
+            int: Número de pagos encolados.
+        """
+        rows = await db.query(
+            """SELECT id, user_id, receipt_msg_id FROM payments
+               WHERE status='pending' AND receipt_path IS NULL AND receipt_msg_id IS NOT NULL"""
+        )
+        for r in rows:
+            self.submit(r["id"], chat_id=r["user_id"], msg_id=r["receipt_msg_id"])
+        if rows:
+            log.info("Comprobantes pendientes de descarga reencolados: %s", len(rows))
+        return len(rows)
+
+    def start(self) -> None:
+        """
+        Arranca los workers en el bucle de eventos actual.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """
+        Detiene los workers; lo que quede en cola se reencola en el próximo arranque.
+        """
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+        dupes.shutdown()
@@ -0,0 +1,277 @@
+"""
+Enrutado de mensajes entrantes y de callbacks de botones inline.
+
+Un único handler de NewMessage consulta un diccionario con los textos exactos de
+los teclados y una tabla de comandos por nombre, así que el coste por mensaje no
+depende de cuántos comandos haya. Los argumentos de cada comando se validan con su
+propia expresión regular, cuyo resultado queda en ev.pattern_match como con los
+handlers de Telethon. Lo que no es un comando ni un botón va al handler de reserva.
+
+Los callbacks usan payloads compactos y versionados ("1:accion:arg..."), que caben
+en los 64 bytes de Telegram, y se despachan por acción y modo de flujo.
+"""
+import inspect
+import re
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Pattern, Sequence, Tuple
+from .metrics import observe
+import logging
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[..., Awaitable[None]]
+
+# /comando[@bot] [argumentos]
+_COMMAND = re.compile(r"/([A-Za-z0-9_]+)(?:@\w+)?(?:\s+(.*))?", re.S)
+
+
+class Router:
+    """
+    Despachador de mensajes: textos exactos por hash, comandos por nombre.
+    """
+
+    def __init__(self):
+        self._texts: Dict[str, Handler] = {}
+        self._commands: Dict[str, Tuple[Pattern, Handler]] = {}
+        self._fallback: Optional[Handler] = None
+
+    def text(self, *texts: str) -> Callable[[Handler], Handler]:
+        """
+        Registra un handler para uno o varios textos exactos (botones del teclado).
+
+        Raises:
+            ValueError: Si un texto ya tiene handler.
+        """
+        def deco(fn: Handler) -> Handler:
+            for t in texts:
+                if t in self._texts:
+                    raise ValueError(f"Texto ya registrado: {t}")
+                self._texts[t] = fn
+            return fn
+        return deco
+
+    def command(self, name: str, args: str = "") -> Callable[[Handler], Handler]:
+        """
+        Registra un handler para /name.
+
+        Args:
+            name (str): Nombre del comando sin la barra.
+            args (str): Expresión regular que deben cumplir los argumentos completos;
+                sus grupos quedan en ev.pattern_match. Vacía = sin argumentos.
+
+        Raises:
+            ValueError: Si el comando ya tiene handler.
+        """
+        def deco(fn: Handler) -> Handler:
+            key = name.lower()
+            if key in self._commands:
+                raise ValueError(f"Comando ya registrado: /{name}")
+            self._commands[key] = (re.compile(args), fn)
+            return fn
+        return deco
+
+    def fallback(self, fn: Handler) -> Handler:
+        """
+        Registra el handler para los mensajes que no son comando ni botón.
+        """
+        self._fallback = fn
+        return fn
+
+    def resolve(self, text: str) -> Tuple[Optional[Handler], Optional[re.Match]]:
+        """
+        Busca el handler de un texto.
+
+        Returns:
+            tuple: (handler o None, match de los argumentos o None).
+        """
+        fn = self._texts.get(text)
+        if fn is not None:
+            return fn, None
+        if text.startswith("/"):
+            m = _COMMAND.fullmatch(text.strip())
+            if m:
+                entry = self._commands.get(m.group(1).lower())
+                if entry is not None:
+                    pattern, fn = entry
+                    am = pattern.fullmatch((m.group(2) or "").strip())
+                    if am is not None:
+                        return fn, am
+        return None, None
+
+    async def dispatch(self, ev) -> None:
+        """
+        Entrega el mensaje a su handler o, si no hay ninguno, al de reserva.
+        """
+        fn, match = self.resolve(ev.raw_text or "")
+        if fn is None:
+            if self._fallback is not None:
+                await observe(self._fallback.__name__, self._fallback(ev))
+            return
+        ev.pattern_match = match
+        await observe(fn.__name__, fn(ev))
+
+    def __len__(self) -> int:
+        return len(self._texts) + len(self._commands)
+
+
+# ---------- Callbacks ----------
+CB_VERSION = "1"
+CB_MAX_BYTES = 64  # Límite de Telegram para callback_data
+
+# Payloads anteriores a CB_VERSION ("pay:plan", "pay:cli:<slug>"...), que pueden
+# seguir en teclados ya enviados. Exactos primero, luego por prefijo.
+_LEGACY_EXACT = {
+    "pay:plan": "pay.plan",
+    "pay:client": "pay.client",
+    "pay:receipt": "pay.receipt",
+    "pay:back": "pay.back",
+}
+_LEGACY_PREFIX = (
+    ("pay:cli:", "pay.cli"),
+    ("pay:c:", "pay.term"),
+    ("pay:m:", "pay.method"),
+    ("plan:", "plan"),
+    ("pay:", "pay.res"),  # pay:res_b, pay:res_p, pay:res_e
+)
+
+
+def cbdata(action: str, *args: Any) -> bytes:
+    """
+    Codifica una acción y sus argumentos como callback_data.
+
+    Args:
+        action (str): Nombre de la acción (por ejemplo, "pay.cli").
+        *args: Argumentos (slugs, códigos de plan...); no pueden contener ":".
+
+    Returns:
+        bytes: Payload listo para Button.inline.
+
+    Raises:
+        ValueError: Si un argumento contiene ":" o el payload supera 64 bytes.
+    """
+    parts = [CB_VERSION, action] + [str(a) for a in args]
+    if any(":" in p for p in parts[1:]):
+        raise ValueError(f"Argumento de callback inválido: {parts[1:]}")
+    data = ":".join(parts).encode()
+    if len(data) > CB_MAX_BYTES:
+        raise ValueError(f"callback_data de {len(data)} bytes (máximo {CB_MAX_BYTES}): {data!r}")
+    return data
+
+
+def parse_cbdata(data: bytes) -> Tuple[Optional[str], Sequence[str]]:
+    """
+    Decodifica un callback_data (versionado o antiguo).
+
+    Returns:
+        tuple: (acción o None si no se reconoce, argumentos).
+    """
+    try:
+        text = data.decode()
+    except (UnicodeDecodeError, AttributeError):
+        return None, ()
+    head, _, rest = text.partition(":")
+    if head == CB_VERSION:
+        action, *args = rest.split(":")
+        return action, args
+    action = _LEGACY_EXACT.get(text)
+    if action is not None:
+        return action, ()
+    for prefix, action in _LEGACY_PREFIX:
+        if text.startswith(prefix) and len(text) > len(prefix):
+            return action, (text[len(prefix):],)
+    return None, ()
+
+
+async def _answer(ev) -> None:
+    """Quita el reloj de espera del botón sin mostrar nada al usuario."""
+    try:
+        await ev.answer()
+    except Exception as e:
+        log.debug("No se pudo responder al callback de %s: %s", ev.sender_id, e)
+
+
+class _Route(NamedTuple):
+    fn: Handler
+    signature: inspect.Signature
+    convert: Dict[str, Callable[[str], Any]]
+
+
+class CallbackRouter:
+    """
+    Despachador de callbacks por acción.
+
+    Un handler registrado sin modo se llama como fn(ev, *args) sin consultar nada
+    más. Uno registrado con modo solo se llama si el usuario tiene un flujo activo en
+    ese modo, como fn(ev, flow, *args); el flujo se busca solo en ese caso.
+
+    Los argumentos del payload se comprueban contra la firma del handler (y se
+    convierten con los conversores de la acción) antes de llamarlo: un payload que no
+    encaja se descarta, mientras que los errores del propio handler se propagan.
+
+    Args:
+        flow_lookup: Función uid -> flujo activo (con atributo mode) o None.
+    """
+
+    def __init__(self, flow_lookup: Callable[[int], Any]):
+        self._flow = flow_lookup
+        self._actions: Dict[str, Dict[Optional[str], _Route]] = {}
+
+    def action(self, name: str, *modes: str, **convert: Callable[[str], Any]) -> Callable[[Handler], Handler]:
+        """
+        Registra un handler para una acción, opcionalmente limitado a modos de flujo.
+
+        Args:
+            name (str): Nombre de la acción.
+            *modes: Modos de flujo en los que vale el handler (ninguno = siempre).
+            **convert: Conversor por parámetro del handler (ej. page=int); si lanza
+                ValueError, el callback se descarta.
+
+        Raises:
+            ValueError: Si la acción ya tiene handler para alguno de los modos.
+        """
+        def deco(fn: Handler) -> Handler:
+            route = _Route(fn, inspect.signature(fn), convert)
+            table = self._actions.setdefault(name, {})
+            for mode in modes or (None,):
+                if mode in table:
+                    raise ValueError(f"Acción ya registrada: {name} ({mode})")
+                table[mode] = route
+            return fn
+        return deco
+
+    async def dispatch(self, ev) -> None:
+        """
+        Decodifica ev.data y llama al handler que corresponda (si hay alguno).
+
+        Si no hay handler, o los argumentos del payload no encajan con su firma o sus
+        conversores, se responde al callback en silencio para que el botón no se quede
+        esperando.
+        """
+        action, args = parse_cbdata(ev.data or b"")
+        table = self._actions.get(action) if action else None
+        if table is None:
+            log.debug("Callback sin handler de %s: %r", ev.sender_id, ev.data)
+            await _answer(ev)
+            return
+        route = table.get(None)
+        if route is not None:
+            call = (ev, *args)
+        else:
+            flow = self._flow(ev.sender_id)
+            route = table.get(flow.mode) if flow is not None else None
+            if route is None:
+                log.debug("Callback %s fuera de su flujo de %s: %r", action, ev.sender_id, ev.data)
+                await _answer(ev)
+                return
+            call = (ev, flow, *args)
+        try:
+            bound = route.signature.bind(*call)
+            for param, conv in route.convert.items():
+                if param in bound.arguments:
+                    bound.arguments[param] = conv(bound.arguments[param])
+        except (TypeError, ValueError) as e:
+            # Datos de callback manipulados o de una versión anterior de los botones:
+            # número de argumentos distinto o un valor que no se puede convertir.
+            log.debug("Callback %s inválido de %s (%r): %s", action, ev.sender_id, ev.data, e)
+            await _answer(ev)
+            return
+        await observe(route.fn.__name__, route.fn(*bound.args, **bound.kwargs))
@@ -0,0 +1,399 @@
+"""
+Pruebas de escala: base de datos de gran volumen y control de planes de consulta.
+
+generate: crea (o amplía) data_dir/state.sqlite3 con miles de resellers, cientos de
+miles de clientes y millones de pagos y registros de auditoría, con repartos
+realistas (pocos resellers con muchos clientes, vencimientos alrededor de hoy, pagos
+pendientes solo entre los recientes). Inserta con executemany en lotes grandes, cada
+uno en su transacción, y termina con ANALYZE.
+
+check: extrae con ast todas las sentencias SQL literales del código, ejecuta EXPLAIN
+QUERY PLAN de cada una y falla si alguna recorre una tabla completa. Las consultas que
+se arman en tiempo de ejecución (listados, duplicados, exportaciones) se ejercitan con
+sus funciones reales y se analizan las sentencias capturadas con el trace callback; en
+el resto de f-strings las partes dinámicas se sustituyen por marcadores.
+
+Uso:
+    DATA_DIR=/tmp/escala python -m <paquete>.scaletest generate --clients 100000 --payments 2000000
+    DATA_DIR=/tmp/escala python -m <paquete>.scaletest check
+"""
+import os
+import tempfile
+
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "scaletest")
+os.environ.setdefault("BOT_TOKEN", "scaletest")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="scaletest-"))
+os.environ.setdefault("METRICS_PORT", "0")
+
+import argparse
+import ast
+import bisect
+import datetime as dt
+import itertools
+import random
+import re
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from .models_db import DB, close_db, init_db, repair_client_counts
+from .listings import (
+    CLIENT_SORTS, RESELLER_SORTS, PaymentFilter, clients_listing, payments_page, resellers_listing
+)
+from .dupes import find_duplicates
+from .export import ExportFilter, export_sql
+
+BATCH = 50_000          # Filas por executemany
+TX_ROWS = 500_000       # Filas por transacción
+SRC = Path(__file__).resolve().parent
+
+# Tablas pequeñas por diseño: recorrerlas enteras es lo correcto
+SMALL_TABLES = {"settings", "data_versions", "sqlite_master", "sqlite_schema"}
+
+# Recorridos completos intencionados: (fragmento de la sentencia, motivo)
+ALLOWED_SCANS = (
+    ("FROM resellers r LEFT JOIN", "verify_client_counts: recuento de mantenimiento bajo demanda"),
+    ("WHERE receipt_dhash IS NOT NULL", "dupes.reindex: reconstrucción única en una migración"),
+)
+
+
+# ---------- Generador ----------
+def _batches(rows: Iterable[tuple], size: int = BATCH) -> Iterator[List[tuple]]:
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _load(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple], label: str) -> int:
+    """Inserta filas por lotes, con una transacción cada TX_ROWS filas."""
+    total, in_tx, start = 0, 0, time.perf_counter()
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    for chunk in _batches(rows):
+        cur.executemany(sql, chunk)
+        total += len(chunk)
+        in_tx += len(chunk)
+        if in_tx >= TX_ROWS:
+            conn.commit()
+            cur.execute("BEGIN")
+            in_tx = 0
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    print(f"  {label}: {total:,} filas en {elapsed:.1f}s ({total / elapsed if elapsed else 0:,.0f}/s)")
+    return total
+
+
+def _pick(weights: Sequence[float], rng: random.Random) -> Callable[[], int]:
+    """Devuelve un sorteador de índices según los pesos (con bisect sobre los acumulados)."""
+    cum = list(itertools.accumulate(weights))
+    total = cum[-1]
+    return lambda: bisect.bisect(cum, rng.random() * total)
+
+
+def _pid(i: int) -> str:
+    # Permutación de 48 bits: IDs únicos con aspecto aleatorio, como new_id()
+    return f"{(i * 0x9E3779B97F4B) & 0xFFFFFFFFFFFF:012x}"
+
+
+@dataclass
+class Volumes:
+    resellers: int = 5_000
+    clients: int = 100_000
+    payments: int = 2_000_000
+    audit: int = 2_000_000
+
+
+def generate(vol: Volumes, seed: int = 1) -> None:
+    """
+    Llena la base de datos de data_dir con el volumen pedido.
+
+    Args:
+        vol: Número de filas por tabla.
+        seed: Semilla (mismos datos en cada ejecución).
+    """
+    rng = random.Random(seed)
+    init_db()
+    close_db()
+    today = dt.date.today()
+    now = dt.datetime.now()
+    conn = sqlite3.connect(DB, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-200000")
+    base = conn.execute("SELECT COUNT(*) FROM resellers").fetchone()[0]
+    print(f"Generando en {DB} (semilla {seed})")
+
+    def days(lo: int, mode: int, hi: int) -> str:
+        return (today + dt.timedelta(days=int(rng.triangular(lo, hi, mode)))).isoformat()
+
+    res_ids = [str(7_000_000_000 + base + i) for i in range(vol.resellers)]
+    _load(conn, "INSERT INTO resellers(id, plan, started, expires, contact) VALUES (?, ?, ?, ?, ?)", (
+        (rid, rng.choices(("res_b", "res_p", "res_e"), (60, 30, 10))[0], days(-700, -60, 0),
+         days(-60, 20, 120), f"@res{rid[-6:]}" if rng.random() < 0.7 else None)
+        for rid in res_ids
+    ), "resellers")
+
+    # Pocos resellers concentran muchos clientes (Pareto)
+    pick_res = _pick([rng.paretovariate(1.2) for _ in res_ids], rng)
+    client_base = 8_000_000_000 + conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+    owners = [client_base + i for i in range(vol.clients)]
+    created = now.isoformat(timespec="seconds")
+    _load(conn, """INSERT INTO clients(slug, owner_id, username, reseller_id, plan, expires, created, workdir, svc_status)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+        (str(o), o, None, res_ids[pick_res()], rng.choices(("plan_estandar", "plan_plus", "plan_pro"), (60, 30, 10))[0],
+         days(-120, 15, 365), created, f"/srv/clients/{o}",
+         rng.choices(("active", "stopped", "unknown"), (70, 25, 5))[0])
+        for o in owners
+    ), "clients")
+
+    span = 730 * 86400
+    start = now - dt.timedelta(seconds=span)
+    payers = owners + [int(r) for r in res_ids]
+    pay_base = conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0]
+
+    def payments() -> Iterator[tuple]:
+        prev_sha = None
+        for i in range(vol.payments):
+            # Orden cronológico: el id crece con created, como en producción
+            when = start + dt.timedelta(seconds=span * i / max(vol.payments, 1) + rng.random())
+            age = (now - when).days
+            status = ("pending" if age < 7 and rng.random() < 0.6
+                      else rng.choices(("approved", "rejected"), (88, 12))[0])
+            uid = rng.choice(payers)
+            role = "reseller" if uid < 8_000_000_000 else "client"
+            usd = rng.choice((5.0, 12.0, 30.0)) if role == "client" else rng.choice((20.0, 45.0, 90.0))
+            # Cada pago trae su comprobante; ~2% reenvía uno anterior (mismo SHA-256)
+            sha = (prev_sha if prev_sha and rng.random() < 0.02 else f"{rng.getrandbits(256):064x}")
+            prev_sha = sha
+            yield (_pid(pay_base + i), uid, role, rng.choices(("saldo", "cup"), (40, 60))[0], usd, usd * 360,
+                   "res_b" if role == "reseller" else rng.choice(("client_30", "client_90", "client_365")),
+                   str(uid), rng.randint(1, 10**6), status, when.isoformat(timespec="seconds"), 360.0,
+                   f"{sha[:2]}/{sha[2:4]}/{sha}.jpg", rng.randint(40_000, 400_000), sha)
+
+    _load(conn, """INSERT INTO payments(id, user_id, role, type, amount_usd, amount_cup, plan, item_id,
+                                        receipt_msg_id, status, created, rate_used,
+                                        receipt_path, receipt_size, receipt_sha256)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", payments(), "payments")
+
+    actions = ("approve_client_renew", "approve_reseller_upgrade", "reject_payment")
+    # El boss firma una parte; el resto se reparte entre resellers con el mismo sesgo que los clientes
+    actor = lambda: 1 if rng.random() < 0.3 else int(res_ids[pick_res()])
+    _load(conn, "INSERT INTO audit(actor_id, action, meta, created) VALUES (?, ?, ?, ?)", (
+        (actor(), rng.choices(actions, (60, 28, 12))[0], f"pid={_pid(rng.randrange(vol.payments or 1))}",
+         (start + dt.timedelta(seconds=span * i / max(vol.audit, 1))).isoformat(timespec="seconds"))
+        for i in range(vol.audit)
+    ), "audit")
+
+    conn.execute("BEGIN")
+    repair_client_counts(conn.cursor())
+    conn.commit()
+    print("  ANALYZE...")
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+# ---------- Planes de consulta ----------
+_SQL = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b")
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+_CTE = re.compile(r"(?:\bWITH|,)\s*(\w+)\s*(?:\([^)]*\))?\s+AS\s*\(", re.IGNORECASE)
+
+
+@dataclass
+class Statement:
+    where: str
+    sql: str
+
+
+# Módulos cuyo SQL dinámico se analiza ejecutándolo (ver _exercise)
+EXERCISED = {"listings.py", "dupes.py", "export.py"}
+
+
+def _hole(before: str) -> str:
+    """Sustituto de una parte dinámica de un f-string SQL según lo que la precede."""
+    if before.rstrip().upper().endswith("VALUES"):
+        return "(?, ?)"  # Tabla de valores de dos columnas (ej. horizontes de aviso)
+    return "?"          # Lista de marcadores (IN ({marks})) o valor suelto
+
+
+def extract(paths: Iterable[Path]) -> Tuple[List[Statement], List[str]]:
+    """
+    Extrae las sentencias SQL literales de los módulos.
+
+    Las partes dinámicas de los f-strings se resuelven con las constantes del módulo o,
+    si no, se sustituyen por marcadores; los de EXERCISED se dejan para _exercise.
+
+    Returns:
+        tuple: (sentencias, avisos: archivos que no compilan o SQL omitido).
+    """
+    found, notes = [], []
+    for path in paths:
+        try:
+            tree = ast.parse(path.read_text(encoding="utf-8"), str(path))
+        except SyntaxError as e:
+            notes.append(f"{path.name}: no se pudo analizar ({e.msg}, línea {e.lineno})")
+            continue
+        consts = {
+            t.id: n.value.value for n in tree.body if isinstance(n, ast.Assign)
+            and isinstance(n.value, ast.Constant) and isinstance(n.value.value, str)
+            for t in n.targets if isinstance(t, ast.Name)
+        }
+        fragments = {id(v) for n in ast.walk(tree) if isinstance(n, ast.JoinedStr) for v in n.values}
+        for node in ast.walk(tree):
+            where = f"{path.name}:{getattr(node, 'lineno', 0)}"
+            if (isinstance(node, ast.Constant) and isinstance(node.value, str)
+                    and id(node) not in fragments and _SQL.match(node.value)):
+                found.append(Statement(where, node.value))
+            elif isinstance(node, ast.JoinedStr):
+                head = node.values[0] if node.values else None
+                if not (isinstance(head, ast.Constant) and _SQL.match(head.value)):
+                    continue
+                parts, dynamic = [], False
+                for v in node.values:
+                    if isinstance(v, ast.Constant):
+                        parts.append(v.value)
+                    elif isinstance(v.value, ast.Name) and v.value.id in consts:
+                        parts.append(consts[v.value.id])
+                    else:
+                        dynamic = True
+                        parts.append(_hole("".join(parts)))
+                if dynamic and path.name in EXERCISED:
+                    continue
+                found.append(Statement(where, "".join(parts)))
+    return found, notes
+
+
+def _exercise(cur: sqlite3.Cursor) -> List[Statement]:
+    """
+    Ejecuta las funciones que arman SQL en tiempo de ejecución y captura sus sentencias.
+    """
+    row = cur.execute("SELECT id FROM payments ORDER BY created DESC, id DESC LIMIT 1 OFFSET 50").fetchone()
+    pivot = row["id"] if row else None
+    rid = cur.execute("SELECT id FROM resellers ORDER BY client_count DESC LIMIT 1").fetchone()
+    captured: List[str] = []
+    cur.connection.set_trace_callback(captured.append)
+    try:
+        for status, role, method in itertools.product((None, "pending", "approved"), (None, "client"), (None, "cup")):
+            flt = PaymentFilter(status, role, method)
+            payments_page(cur, flt)
+            if pivot:
+                payments_page(cur, flt, before=pivot)
+                payments_page(cur, flt, after=pivot)
+        # Primera página, la siguiente y vuelta atrás, como los botones del listado
+        for sort in CLIENT_SORTS:
+            for reseller_id in (None, rid["id"] if rid else None):
+                lst = clients_listing(cur, sort, 0, reseller_id, f"check-{sort}")
+                if lst.next_key:
+                    lst = clients_listing(cur, sort, 1, reseller_id, f"check-{sort}", "n", lst.next_key)
+                if lst.prev_key:
+                    clients_listing(cur, sort, 0, reseller_id, f"check-{sort}", "p", lst.prev_key)
+        for sort in RESELLER_SORTS:
+            lst = resellers_listing(cur, sort, 0)
+            if lst.next_key:
+                lst = resellers_listing(cur, sort, 1, "n", lst.next_key)
+            if lst.prev_key:
+                resellers_listing(cur, sort, 0, "p", lst.prev_key)
+        find_duplicates(cur, "check", "0" * 64, 0x0123456789ABCDEF)
+        # Las exportaciones sin filtro recorren la tabla a propósito; con fechas o estado
+        # (las que piden contabilidad) tienen que ir por índice.
+        since = (dt.date.today() - dt.timedelta(days=30)).isoformat()
+        for flt in (ExportFilter(since=since), ExportFilter(since=since, until=since), ExportFilter(status="approved")):
+            captured.append(export_sql("payments", flt)[0])
+        captured.append(export_sql("audit", ExportFilter(since=since))[0])
+        if rid:
+            for flt in (ExportFilter(reseller=rid["id"]), ExportFilter(since=since, reseller=rid["id"])):
+                for kind in ("payments", "clients", "audit"):
+                    captured.append(export_sql(kind, flt)[0])
+    finally:
+        cur.connection.set_trace_callback(None)
+    return [Statement("(ejecutada)", s) for s in dict.fromkeys(captured) if _SQL.match(s)]
+
+
+def _bindings(cur: sqlite3.Cursor, sql: str) -> int:
+    try:
+        cur.execute("EXPLAIN QUERY PLAN " + sql)
+        return 0
+    except sqlite3.ProgrammingError as e:
+        m = re.search(r"uses (\d+)", str(e))
+        if not m:
+            raise
+        return int(m.group(1))
+
+
+def explain(cur: sqlite3.Cursor, sql: str) -> List[str]:
+    """
+    Returns:
+        List[str]: Líneas de detalle de EXPLAIN QUERY PLAN (parámetros a NULL).
+    """
+    n = _bindings(cur, sql)
+    return [r[3] for r in cur.execute("EXPLAIN QUERY PLAN " + sql, [None] * n).fetchall()]
+
+
+def check(paths: Optional[Iterable[Path]] = None, verbose: bool = False) -> int:
+    """
+    Comprueba el plan de cada sentencia contra la base de datos de data_dir.
+
+    Returns:
+        int: Número de sentencias con recorrido completo de tabla no permitido.
+    """
+    init_db()
+    close_db()
+    paths = sorted(paths or (p for p in SRC.glob("*.py") if p.name not in ("scaletest.py", "bench.py")))
+    statements, notes = extract(paths)
+    conn = sqlite3.connect(DB)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    statements += _exercise(cur)
+    failures = temp = 0
+    seen = set()
+    for st in statements:
+        sql = " ".join(st.sql.split())
+        if sql in seen:
+            continue
+        seen.add(sql)
+        try:
+            plan = explain(cur, sql)
+        except sqlite3.Error as e:
+            print(f"⚠️  {st.where}: no se pudo analizar: {e}\n    {sql[:160]}")
+            continue
+        ctes = set(_CTE.findall(sql))  # Tablas de valores del WITH: se recorren por diseño
+        scans = [m.group(1) for m in map(_SCAN.match, plan) if m and m.group(1) not in SMALL_TABLES | ctes]
+        allowed = next((why for frag, why in ALLOWED_SCANS if frag in sql), None)
+        temp += any("TEMP B-TREE" in d for d in plan)
+        if scans and not allowed:
+            failures += 1
+            print(f"❌ {st.where}: recorrido completo de {', '.join(scans)}\n    {sql[:200]}")
+            for d in plan:
+                print(f"      {d}")
+        elif verbose:
+            print(f"✅ {st.where}: {' | '.join(plan)}" + (f"  (permitido: {allowed})" if scans else ""))
+    conn.close()
+    for note in notes:
+        print(f"ℹ️  {note}")
+    print(f"{len(seen)} sentencias analizadas, {failures} con recorrido completo, {temp} con ordenación temporal.")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Datos de escala y control de planes de consulta.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    gen = sub.add_parser("generate", help="Llena la base de datos de DATA_DIR con datos sintéticos.")
+    for name, default in vars(Volumes()).items():
+        gen.add_argument(f"--{name}", type=int, default=default)
+    gen.add_argument("--seed", type=int, default=1)
+    chk = sub.add_parser("check", help="EXPLAIN QUERY PLAN de todas las sentencias SQL del código.")
+    chk.add_argument("-v", "--verbose", action="store_true", help="Muestra también los planes correctos.")
+    args = ap.parse_args(argv)
+    if args.cmd == "generate":
+        generate(Volumes(args.resellers, args.clients, args.payments, args.audit), args.seed)
+        return 0
+    return 1 if check(verbose=args.verbose) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
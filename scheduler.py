@@ -0,0 +1,214 @@
+"""
+Planificador de avisos de vencimiento basado en eventos.
+
+Mantiene un min-heap con los próximos instantes de aviso, cargado con una consulta
+por rango sobre idx_clients_expires_slug, y duerme exactamente hasta el siguiente aviso.
+Las renovaciones y altas de clientes actualizan el heap en el momento.
+
+Cada aviso se reclama en la tabla notifications (clave única por cliente, tipo,
+horizonte y vencimiento) antes de enviarse, así que se envía una sola vez aunque
+el bot se reinicie o corra en varios procesos.
+"""
+import asyncio
+import datetime as dt
+import heapq
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from . import db_async as db
+from .models_db import get_setting, iso_now
+from .metrics import EXPIRY_LAG
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_REMINDERS = "7,3,1"  # Días antes del vencimiento (clave reminder_days)
+CATCHUP_DAYS = 30            # Vencidos recientes sin aviso que se recuperan al cargar
+
+Notify = Callable[[str, int, int, str, str], Awaitable[None]]
+Entry = Tuple[dt.datetime, str, int, str, str]  # (instante, tipo, horizonte, slug, vencimiento)
+
+
+def _midnight(day: dt.date) -> dt.datetime:
+    return dt.datetime.combine(day, dt.time.min)
+
+
+def reminder_horizons() -> List[int]:
+    """
+    Lee los horizontes de recordatorio configurados (por ejemplo, "7,3,1").
+
+    Returns:
+        List[int]: Días antes del vencimiento, sin duplicados y en orden descendente.
+    """
+    raw = get_setting("reminder_days", DEFAULT_REMINDERS) or ""
+    days = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) > 0:
+            days.add(int(part))
+    return sorted(days, reverse=True)
+
+
+class ExpiryScheduler:
+    """
+    Planificador de recordatorios a varios horizontes y del aviso de vencido.
+
+    Args:
+        notify: Corrutina notify(kind, days, owner_id, slug, expires) que envía el aviso;
+            kind es "reminder" (days = días que faltan) o "expired" (days = 0).
+    """
+
+    def __init__(self, notify: Notify):
+        self.notify = notify
+        self.horizons: List[int] = []
+        self._heap: List[Entry] = []
+        self._queued: Set[Tuple[str, int, str, str]] = set()
+        self._current: Dict[str, Tuple[int, str]] = {}  # slug -> (owner_id, expires)
+        self._wake = asyncio.Event()
+        self._reload_at: Optional[dt.datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def window_days(self) -> int:
+        return max(self.horizons, default=0)
+
+    def _kinds(self) -> List[Tuple[str, int]]:
+        return [("reminder", d) for d in self.horizons] + [("expired", 0)]
+
+    def _push(self, kind: str, days: int, slug: str, expires: str, when: dt.datetime) -> None:
+        key = (kind, days, slug, expires)
+        if key not in self._queued:
+            self._queued.add(key)
+            heapq.heappush(self._heap, (when, kind, days, slug, expires))
+
+    def schedule(self, slug: str, owner_id: int, expires: str) -> None:
+        """
+        Registra (o actualiza) el vencimiento de un cliente.
+
+        Las entradas antiguas del mismo cliente quedan en el heap pero se descartan al
+        salir porque ya no coinciden con el vencimiento vigente.
+
+        Args:
+            slug (str): Slug del cliente.
+            owner_id (int): Chat al que se envían los avisos.
+            expires (str): Fecha de vencimiento (ISO).
+        """
+        self._current[slug] = (int(owner_id), expires)
+        try:
+            exp_date = dt.date.fromisoformat(expires)
+        except ValueError:
+            log.warning("Vencimiento inválido para %s: %s", slug, expires)
+            return
+        today = dt.date.today()
+        horizon = today + dt.timedelta(days=self.window_days)
+        for kind, days in self._kinds():
+            day = exp_date - dt.timedelta(days=days)
+            # Los recordatorios de días ya pasados se omiten; los de más allá de la
+            # ventana se programan en la recarga diaria.
+            if day < today or day > horizon:
+                continue
+            self._push(kind, days, slug, expires, _midnight(day))
+        self._wake.set()
+
+    async def load(self) -> int:
+        """
+        Carga los avisos pendientes con una única consulta anti-join contra notifications.
+
+        Incluye los recordatorios cuyo día cae en [hoy, hoy + mayor horizonte] y los
+        avisos de vencido de los últimos CATCHUP_DAYS días que nunca se enviaron.
+
+        El heap se reconstruye desde cero: las entradas de una carga anterior (por
+        ejemplo, de horizontes que ya no están configurados) no llegan a dispararse.
+
+        Returns:
+            int: Número de avisos pendientes cargados.
+        """
+        self.horizons = reminder_horizons()
+        # Antes de la consulta: lo que schedule() añada mientras tanto ya va al heap nuevo
+        self._heap = []
+        self._queued = set()
+        today = dt.date.today()
+        kinds = self._kinds()
+        values = ", ".join("(?, ?)" for _ in kinds)
+        params: List = [x for pair in kinds for x in pair]
+        rows = await db.query(
+            f"""WITH h(kind, days) AS (VALUES {values})
+                SELECT c.slug, c.owner_id, c.expires, h.kind, h.days
+                FROM clients c CROSS JOIN h
+                LEFT JOIN notifications n
+                       ON n.slug = c.slug AND n.kind = h.kind
+                      AND n.horizon = h.days AND n.expires = c.expires
+                WHERE c.expires >= ? AND c.expires <= ?
+                  AND n.slug IS NULL
+                  AND (h.kind = 'expired' OR date(c.expires, '-' || h.days || ' days') >= ?)""",
+            params + [
+                (today - dt.timedelta(days=CATCHUP_DAYS)).isoformat(),
+                (today + dt.timedelta(days=self.window_days)).isoformat(),
+                today.isoformat(),
+            ]
+        )
+        for r in rows:
+            self._current[r["slug"]] = (int(r["owner_id"]), r["expires"])
+            day = dt.date.fromisoformat(r["expires"]) - dt.timedelta(days=r["days"])
+            self._push(r["kind"], r["days"], r["slug"], r["expires"], _midnight(day))
+        self._reload_at = _midnight(today + dt.timedelta(days=1))
+        log.info("Planificador de vencimientos: %s avisos pendientes, horizontes=%s.", len(rows), self.horizons)
+        return len(rows)
+
+    def reload(self) -> None:
+        """
+        Fuerza una recarga (por ejemplo, tras cambiar reminder_days).
+        """
+        self._reload_at = dt.datetime.now()
+        self._wake.set()
+
+    async def _fire(self, kind: str, days: int, slug: str, expires: str) -> None:
+        self._queued.discard((kind, days, slug, expires))
+        if kind == "reminder" and days not in self.horizons:
+            return  # Horizonte retirado de reminder_days en una recarga
+        current = self._current.get(slug)
+        if current is None or current[1] != expires:
+            return  # Renovado o reprogramado después de encolar este aviso
+        if kind == "expired":
+            self._current.pop(slug, None)
+        claimed = await db.execute(
+            """INSERT OR IGNORE INTO notifications(slug, kind, horizon, expires, sent_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (slug, kind, days, expires, iso_now())
+        )
+        if not claimed:
+            return  # Ya enviado (por un arranque anterior u otro proceso)
+        try:
+            await self.notify(kind, days, current[0], slug, expires)
+        except Exception as e:
+            log.warning("No se pudo enviar aviso %s/%s a %s (%s): %s", kind, days, current[0], slug, e)
+
+    async def run(self) -> None:
+        """
+        Bucle principal: duerme hasta el siguiente aviso, una actualización o la recarga diaria.
+
+        La primera carga va dentro del bucle: si la DB falla al arrancar, se reintenta.
+        """
+        self._reload_at = dt.datetime.now()
+        while True:
+            try:
+                now = dt.datetime.now()
+                if self._reload_at and now >= self._reload_at:
+                    await self.load()
+                    continue
+                while self._heap and self._heap[0][0] <= now:
+                    when, kind, days, slug, expires = heapq.heappop(self._heap)
+                    EXPIRY_LAG.set((dt.datetime.now() - when).total_seconds())
+                    await self._fire(kind, days, slug, expires)
+                deadline = self._reload_at
+                if self._heap and (deadline is None or self._heap[0][0] < deadline):
+                    deadline = self._heap[0][0]
+                timeout = max((deadline - dt.datetime.now()).total_seconds(), 0) if deadline else None
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                log.error("Error en el planificador de vencimientos: %s", e)
+                await asyncio.sleep(60)
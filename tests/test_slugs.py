@@ -0,0 +1,58 @@
+"""
+Sufijos de slug: los slugs ajenos con el mismo prefijo no desplazan el siguiente libre.
+"""
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT.parent))
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="tests-"))
+os.environ.setdefault("METRICS_PORT", "0")
+models_db = importlib.import_module(f"{ROOT.name}.models_db")
+
+
+@pytest.fixture
+def cur():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE clients(slug TEXT PRIMARY KEY)")
+    yield conn.cursor()
+    conn.close()
+
+
+def _add(cur, *slugs):
+    cur.executemany("INSERT INTO clients(slug) VALUES (?)", [(s,) for s in slugs])
+
+
+def test_base_free(cur):
+    assert models_db._next_suffix(cur, "ana") == 1
+
+
+def test_sequential_suffixes(cur):
+    _add(cur, "ana", "ana2", "ana3")
+    assert models_db._next_suffix(cur, "ana") == 4
+
+
+def test_colliding_text_slug_is_ignored(cur):
+    _add(cur, "ana", "ana2024", "ana_bis", "ana02")
+    assert models_db._next_suffix(cur, "ana") == 2
+
+
+def test_colliding_numeric_id(cur):
+    # Otro cliente cuyo ID empieza por el de este: "12345" + "67890"
+    _add(cur, "12345", "1234567890", "123456")
+    assert models_db._next_suffix(cur, "12345") == 2
+
+
+def test_gap_is_reused(cur):
+    _add(cur, "ana", "ana3")
+    assert models_db._next_suffix(cur, "ana") == 2
@@ -1,13 +1,34 @@
+from collections import OrderedDict
+from functools import lru_cache
 from telethon import Button, types
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from .router import cbdata
 import logging
 
-# Configurar logging para depuración y auditoría
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filename="ui.log"
-)
+log = logging.getLogger(__name__)
+
+# Filas de botones inline inmutables: se comparten entre respuestas, nadie debe modificarlas
+Rows = Tuple[Tuple[Button, ...], ...]
+
+# ---------- Caché de menús ----------
+# Los teclados fijos se construyen una sola vez (lru_cache). Los menús que dependen de
+# los precios se guardan aquí con la versión de los ajustes (settings_rev) o los montos
+# en la clave, así que un cambio de precios nunca sirve un menú viejo y las versiones
+# anteriores salen por LRU.
+MENU_CACHE_SIZE = 64
+
+_menus: "OrderedDict[Tuple, Tuple[str, Rows]]" = OrderedDict()
+
+
+def _menu(key: Tuple, build: Callable[[], Tuple[str, Rows]]) -> Tuple[str, Rows]:
+    hit = _menus.get(key)
+    if hit is not None:
+        _menus.move_to_end(key)
+        return hit
+    menu = _menus[key] = build()
+    while len(_menus) > MENU_CACHE_SIZE:
+        _menus.popitem(last=False)
+    return menu
 
 # ---------- Reply Keyboards ----------
 def _b(t: str) -> types.KeyboardButton:
@@ -21,7 +42,7 @@ def _b(t: str) -> types.KeyboardButton:
         types.KeyboardButton: Botón de Telegram.
     """
     if not t:
-        logging.warning("Intento de crear botón con texto vacío.")
+        log.warning("Intento de crear botón con texto vacío.")
         raise ValueError("El texto del botón no puede estar vacío.")
     return types.KeyboardButton(text=t)
 
@@ -36,13 +57,16 @@ def _row(*texts: str) -> types.KeyboardButtonRow:
         types.KeyboardButtonRow: Fila de botones.
     """
     if not texts:
-        logging.warning("Intento de crear fila de botones vacía.")
+        log.warning("Intento de crear fila de botones vacía.")
         raise ValueError("La fila de botones debe contener al menos un botón.")
     return types.KeyboardButtonRow(buttons=[_b(t) for t in texts])
 
+@lru_cache(maxsize=None)
 def kb_boss() -> types.ReplyKeyboardMarkup:
     """
-    Crea el teclado para el administrador (boss) con opciones de gestión.
+    Devuelve el teclado para el administrador (boss) con opciones de gestión.
+    
+    Se construye una vez y se reutiliza en cada respuesta.
     
     Returns:
         types.ReplyKeyboardMarkup: Teclado con botones para resellers, clientes, pagos, facturas y ajustes.
@@ -57,12 +81,13 @@ def kb_boss() -> types.ReplyKeyboardMarkup:
             resize=True
         )
     except Exception as e:
-        logging.error(f"Error al crear kb_boss: {e}")
+        log.error("Error al crear kb_boss: %s", e)
         raise
 
+@lru_cache(maxsize=None)
 def kb_reseller() -> types.ReplyKeyboardMarkup:
     """
-    Crea el teclado para resellers con opciones de gestión de clientes y pagos.
+    Devuelve el teclado para resellers con opciones de gestión de clientes y pagos.
     
     Returns:
         types.ReplyKeyboardMarkup: Teclado con botones para clientes, creación, pagos y soporte.
@@ -76,12 +101,13 @@ def kb_reseller() -> types.ReplyKeyboardMarkup:
             resize=True
         )
     except Exception as e:
-        logging.error(f"Error al crear kb_reseller: {e}")
+        log.error("Error al crear kb_reseller: %s", e)
         raise
 
+@lru_cache(maxsize=None)
 def kb_client() -> types.ReplyKeyboardMarkup:
     """
-    Crea el teclado para clientes con opciones de gestión de su plan y soporte.
+    Devuelve el teclado para clientes con opciones de gestión de su plan y soporte.
     
     Returns:
         types.ReplyKeyboardMarkup: Teclado con botones para plan, provisión, pagos y soporte.
@@ -95,30 +121,44 @@ def kb_client() -> types.ReplyKeyboardMarkup:
             resize=True
         )
     except Exception as e:
-        logging.error(f"Error al crear kb_client: {e}")
+        log.error("Error al crear kb_client: %s", e)
         raise
 
 # ---------- Inline Blocks ----------
-def inline_plans_reseller(prices: Dict[str, float], rate: float) -> tuple[str, List[List[Button]]]:
+@lru_cache(maxsize=None)
+def inline_pay_pick() -> Rows:
+    """
+    Devuelve los botones inline para elegir qué pagar (plan de reseller o renovación de cliente).
+    
+    Returns:
+        Rows: Filas de botones inline (compartidas, inmutables).
+    """
+    return ((Button.inline("Plan Reseller", cbdata("pay.plan")), Button.inline("Renovar Cliente", cbdata("pay.client"))),)
+
+def inline_plans_reseller(prices: Dict[str, float], rate: float, rev: Optional[int] = None) -> Tuple[str, Rows]:
     """
     Crea el texto y los botones inline para seleccionar un plan de reseller.
     
     Args:
         prices (Dict[str, float]): Diccionario con precios de planes (res_b, res_p, res_e).
         rate (float): Tasa de cambio USD a CUP.
+        rev (Optional[int]): Versión de los ajustes de la que salen los precios y la
+            tasa; si se indica, el menú se guarda en caché con esa versión.
     
     Returns:
-        tuple[str, List[List[Button]]]: Texto con los planes y lista de botones inline.
+        Tuple[str, Rows]: Texto con los planes y filas de botones inline.
     
     Raises:
         ValueError: Si faltan precios o la tasa es inválida.
     """
+    if rev is not None:
+        return _menu(("plans", rev), lambda: inline_plans_reseller(prices, rate))
     try:
         if not prices or not all(k in prices for k in ("res_b", "res_p", "res_e")):
-            logging.error("Precios incompletos para inline_plans_reseller.")
+            log.error("Precios incompletos para inline_plans_reseller.")
             raise ValueError("Faltan precios para los planes de reseller.")
         if rate <= 0:
-            logging.error(f"Tasa de cambio inválida: {rate}")
+            log.error("Tasa de cambio inválida: %s", rate)
             raise ValueError("La tasa de cambio debe ser mayor a 0.")
 
         text = (
@@ -128,37 +168,42 @@ def inline_plans_reseller(prices: Dict[str, float], rate: float) -> tuple[str, L
             f"• **Enterprise**: {prices['res_e']} USD / {_fmt_money_cup(prices['res_e'] * rate)}\n\n"
             "Selecciona un plan para continuar:"
         )
-        buttons = [
-            [
-                Button.inline("Básico", b"pay:res_b"),
-                Button.inline("Pro", b"pay:res_p"),
-                Button.inline("Enterprise", b"pay:res_e")
-            ],
-            [Button.inline("« Volver atrás", b"pay:back")]
-        ]
-        logging.info("Botones inline de planes de reseller generados correctamente.")
+        buttons = (
+            (
+                Button.inline("Básico", cbdata("pay.res", "res_b")),
+                Button.inline("Pro", cbdata("pay.res", "res_p")),
+                Button.inline("Enterprise", cbdata("pay.res", "res_e"))
+            ),
+            (Button.inline("« Volver atrás", cbdata("pay.back")),)
+        )
+        log.debug("Botones inline de planes de reseller generados correctamente.")
         return text, buttons
     except Exception as e:
-        logging.error(f"Error en inline_plans_reseller: {e}")
+        log.error("Error en inline_plans_reseller: %s", e)
         raise
 
-def inline_pay_methods(usd: float, cup: float) -> tuple[str, List[List[Button]]]:
+def inline_pay_methods(usd: float, cup: float) -> Tuple[str, Rows]:
     """
     Crea el texto y los botones inline para seleccionar el método de pago.
     
+    El resultado depende solo de los montos, que van en la clave de la caché.
+    
     Args:
         usd (float): Monto en USD.
         cup (float): Monto en CUP (calculado con la tasa de cambio).
     
     Returns:
-        tuple[str, List[List[Button]]]: Texto con el monto y lista de botones inline.
+        Tuple[str, Rows]: Texto con el monto y filas de botones inline.
     
     Raises:
         ValueError: Si los montos son inválidos.
     """
+    return _menu(("methods", usd, cup), lambda: _build_pay_methods(usd, cup))
+
+def _build_pay_methods(usd: float, cup: float) -> Tuple[str, Rows]:
     try:
         if usd <= 0 or cup <= 0:
-            logging.error(f"Montos inválidos: USD={usd}, CUP={cup}")
+            log.error("Montos inválidos: USD=%s, CUP=%s", usd, cup)
             raise ValueError("Los montos USD y CUP deben ser mayores a 0.")
         
         text = (
@@ -166,32 +211,36 @@ def inline_pay_methods(usd: float, cup: float) -> tuple[str, List[List[Button]]]
             f"• Monto: **{usd} USD** ({_fmt_money_cup(cup)})\n"
             "Selecciona el método de pago:"
         )
-        buttons = [
-            [Button.inline("Saldo", b"pay:m:saldo"), Button.inline("CUP", b"pay:m:cup")],
-            [Button.inline("« Volver atrás", b"pay:plan")]
-        ]
-        logging.info(f"Botones inline de métodos de pago generados: USD={usd}, CUP={cup}")
+        buttons = (
+            (Button.inline("Saldo", cbdata("pay.method", "saldo")), Button.inline("CUP", cbdata("pay.method", "cup"))),
+            (Button.inline("« Volver atrás", cbdata("pay.plan")),)
+        )
+        log.debug("Botones inline de métodos de pago generados: USD=%s, CUP=%s", usd, cup)
         return text, buttons
     except Exception as e:
-        logging.error(f"Error en inline_pay_methods: {e}")
+        log.error("Error en inline_pay_methods: %s", e)
         raise
 
-def inline_client_terms(prices: Dict[str, float]) -> tuple[str, List[List[Button]]]:
+def inline_client_terms(prices: Dict[str, float], rev: Optional[int] = None) -> Tuple[str, Rows]:
     """
     Crea el texto y los botones inline para seleccionar la duración de renovación de un cliente.
     
     Args:
         prices (Dict[str, float]): Diccionario con precios de planes de cliente (c30, c90, c365).
+        rev (Optional[int]): Versión de los ajustes de la que salen los precios; si se
+            indica, el menú se guarda en caché con esa versión.
     
     Returns:
-        tuple[str, List[List[Button]]]: Texto con las duraciones y lista de botones inline.
+        Tuple[str, Rows]: Texto con las duraciones y filas de botones inline.
     
     Raises:
         ValueError: Si faltan precios de planes.
     """
+    if rev is not None:
+        return _menu(("terms", rev), lambda: inline_client_terms(prices))
     try:
         if not prices or not all(k in prices for k in ("c30", "c90", "c365")):
-            logging.error("Precios incompletos para inline_client_terms.")
+            log.error("Precios incompletos para inline_client_terms.")
             raise ValueError("Faltan precios para los planes de cliente.")
         
         text = (
@@ -201,18 +250,18 @@ def inline_client_terms(prices: Dict[str, float]) -> tuple[str, List[List[Button
             f"• 365 días: **{prices['c365']} USD**\n\n"
             "Selecciona la duración del plan:"
         )
-        buttons = [
-            [
-                Button.inline("30 días", b"pay:c:30"),
-                Button.inline("90 días", b"pay:c:90"),
-                Button.inline("365 días", b"pay:c:365")
-            ],
-            [Button.inline("« Volver atrás", b"pay:back")]
-        ]
-        logging.info("Botones inline de términos de cliente generados correctamente.")
+        buttons = (
+            (
+                Button.inline("30 días", cbdata("pay.term", 30)),
+                Button.inline("90 días", cbdata("pay.term", 90)),
+                Button.inline("365 días", cbdata("pay.term", 365))
+            ),
+            (Button.inline("« Volver atrás", cbdata("pay.back")),)
+        )
+        log.debug("Botones inline de términos de cliente generados correctamente.")
         return text, buttons
     except Exception as e:
-        logging.error(f"Error en inline_client_terms: {e}")
+        log.error("Error en inline_client_terms: %s", e)
         raise
 
 def inline_pick_client(slugs: List[str]) -> List[List[Button]]:
@@ -230,42 +279,150 @@ def inline_pick_client(slugs: List[str]) -> List[List[Button]]:
     """
     try:
         if not slugs:
-            logging.warning("Lista de slugs vacía en inline_pick_client.")
+            log.warning("Lista de slugs vacía en inline_pick_client.")
             raise ValueError("No hay clientes para seleccionar.")
         
         rows, row = [], []
         for s in slugs:
-            row.append(Button.inline(f"👤 {s}", f"pay:cli:{s}".encode()))
+            row.append(Button.inline(f"👤 {s}", cbdata("pay.cli", s)))
             if len(row) == 2:
                 rows.append(row)
                 row = []
         if row:
             rows.append(row)
-        rows.append([Button.inline("« Volver atrás", b"pay:back")])
-        logging.info(f"Botones inline para {len(slugs)} clientes generados.")
+        rows.append([Button.inline("« Volver atrás", cbdata("pay.back"))])
+        log.debug("Botones inline para %s clientes generados.", len(slugs))
         return rows
     except Exception as e:
-        logging.error(f"Error en inline_pick_client: {e}")
+        log.error("Error en inline_pick_client: %s", e)
         raise
 
-def btn_send_receipt() -> List[List[Button]]:
+@lru_cache(maxsize=None)
+def btn_send_receipt() -> Rows:
     """
-    Crea botones inline para enviar un comprobante de pago.
+    Devuelve los botones inline para enviar un comprobante de pago.
     
     Returns:
-        List[List[Button]]: Lista de botones inline.
+        Rows: Filas de botones inline (compartidas, inmutables).
     """
     try:
-        buttons = [
-            [Button.inline("📤 Enviar comprobante", b"pay:receipt")],
-            [Button.inline("« Volver atrás", b"pay:back")]
-        ]
-        logging.info("Botones inline de comprobante generados.")
+        buttons = (
+            (Button.inline("📤 Enviar comprobante", cbdata("pay.receipt")),),
+            (Button.inline("« Volver atrás", cbdata("pay.back")),)
+        )
+        log.debug("Botones inline de comprobante generados.")
         return buttons
     except Exception as e:
-        logging.error(f"Error en btn_send_receipt: {e}")
+        log.error("Error en btn_send_receipt: %s", e)
         raise
 
+@lru_cache(maxsize=None)
+def inline_client_plans() -> Rows:
+    """
+    Devuelve los botones inline para elegir el plan de un cliente nuevo (boss).
+    
+    Returns:
+        Rows: Filas de botones inline (compartidas, inmutables).
+    """
+    try:
+        buttons = (
+            (
+                Button.inline("Estándar", cbdata("plan", "estandar")),
+                Button.inline("Plus", cbdata("plan", "plus")),
+                Button.inline("Pro", cbdata("plan", "pro"))
+            ),
+            (Button.inline("« Volver atrás", cbdata("pay.back")),)
+        )
+        log.debug("Botones inline de planes de cliente generados.")
+        return buttons
+    except Exception as e:
+        log.error("Error en inline_client_plans: %s", e)
+        raise
+
+def inline_payments_nav(code: str, first_id: str, last_id: str, newer: bool, older: bool) -> List[List[Button]]:
+    """
+    Crea los botones de navegación del listado de pagos.
+    
+    Args:
+        code (str): Código del filtro activo (ver listings.PaymentFilter.code).
+        first_id (str): ID del primer pago de la página (cursor hacia los más recientes).
+        last_id (str): ID del último pago de la página (cursor hacia los más antiguos).
+        newer (bool): Si hay una página anterior (más reciente).
+        older (bool): Si hay una página siguiente (más antigua).
+    
+    Returns:
+        List[List[Button]]: Fila de botones (vacía si no hay más páginas).
+    """
+    row = []
+    if newer:
+        row.append(Button.inline("« Anteriores", cbdata("pays", code, "p", first_id)))
+    if older:
+        row.append(Button.inline("Siguientes »", cbdata("pays", code, "n", last_id)))
+    return [row] if row else []
+
+def inline_list_nav(action: str, sort: str, page: int, sorts: List[tuple],
+                    prev_key: Optional[Sequence[str]] = None,
+                    next_key: Optional[Sequence[str]] = None) -> List[List[Button]]:
+    """
+    Crea los botones de navegación y orden de un listado paginado.
+    
+    Args:
+        action (str): Acción de callback del listado (ej. "cl").
+        sort (str): Código del orden actual.
+        page (int): Página actual (desde 0).
+        sorts (List[tuple]): Órdenes disponibles como (etiqueta, código).
+        prev_key: Clave de orden de la primera fila si hay página anterior.
+        next_key: Clave de orden de la última fila si hay página siguiente.
+    
+    Returns:
+        List[List[Button]]: Filas de botones inline.
+    """
+    rows = []
+    nav = []
+    if prev_key:
+        nav.append(Button.inline("« Anterior", cbdata(action, sort, page - 1, "p", *prev_key)))
+    if next_key:
+        nav.append(Button.inline("Siguiente »", cbdata(action, sort, page + 1, "n", *next_key)))
+    if nav:
+        rows.append(nav)
+    rows.append([
+        Button.inline(f"✓ {label}" if code == sort else label, cbdata(action, code))
+        for label, code in sorts
+    ])
+    return rows
+
+def inline_review(rows: List[Dict[str, Any]], selected: List[str]) -> Tuple[str, List[List[Button]]]:
+    """
+    Crea la vista de revisión de pagos pendientes con selección múltiple.
+    
+    Args:
+        rows (List[Dict[str, Any]]): Pagos pendientes mostrados (id, user_id, amount_usd, type, plan).
+        selected (List[str]): IDs seleccionados.
+    
+    Returns:
+        Tuple[str, List[List[Button]]]: Texto y botones inline (uno por pago, más acciones).
+    """
+    if not rows:
+        return "📭 **No hay pagos pendientes.**", []
+    chosen = set(selected)
+    text = (
+        f"🧾 **Pagos pendientes** ({len(rows)} mostrados, {len(chosen)} seleccionados)\n\n"
+        + "\n".join(
+            f"{'☑️' if r['id'] in chosen else '▫️'} `{r['id']}` — {r['amount_usd']} USD ({r['type']}) · "
+            f"{r['plan']} · `{r['user_id']}`"
+            for r in rows
+        )
+        + "\n\nToca un pago para marcarlo o desmarcarlo."
+    )
+    buttons = [
+        [Button.inline(f"{'☑️' if r['id'] in chosen else '▫️'} {r['id']} · {r['amount_usd']} USD", cbdata("rv", "t", r["id"]))]
+        for r in rows
+    ]
+    buttons.append([Button.inline("Seleccionar todos", cbdata("rv", "all")), Button.inline("Ninguno", cbdata("rv", "none"))])
+    buttons.append([Button.inline("✅ Aprobar seleccionados", cbdata("rv", "a")),
+                    Button.inline("❌ Rechazar seleccionados", cbdata("rv", "r"))])
+    return text, buttons
+
 # ---------- Pretty Formatters ----------
 STATE_ICON = {
     "active": "🟢 Activo",
@@ -291,23 +448,24 @@ def _fmt_money_cup(x: float) -> str:
     try:
         return f"{int(x):,} CUP".replace(",", " ")
     except ValueError:
-        logging.error(f"Error al formatear monto CUP: {x}")
+        log.error("Error al formatear monto CUP: %s", x)
         return "0 CUP"
 
-def fmt_payments_pretty(rows: List[Dict[str, Any]]) -> str:
+def fmt_payments_pretty(rows: List[Dict[str, Any]], title: str = "🧾 **Pagos recientes**") -> str:
     """
     Formatea una lista de pagos en un texto legible para el administrador.
     
     Args:
         rows (List[Dict[str, Any]]): Lista de pagos con sus detalles.
+        title (str): Título del listado (por defecto, "Pagos recientes").
     
     Returns:
         str: Texto formateado con los pagos.
     """
     try:
         if not rows:
-            return "🧾 **Pagos recientes**\n\nNo hay pagos registrados."
-        out = ["🧾 **Pagos recientes**\n"]
+            return f"{title}\n\nNo hay pagos registrados."
+        out = [f"{title}\n"]
         for r in rows:
             out += [
                 f"🔸 **ID**: `{r['id']}`",
@@ -319,11 +477,12 @@ def fmt_payments_pretty(rows: List[Dict[str, Any]]) -> str:
                 f"   🆔 **Usuario**: `{r['user_id']}`",
                 ""
             ]
-        out.append("⚙️ **Comandos disponibles**:\n- `/approve <id>`\n- `/reject <id> <motivo>`")
-        logging.info(f"Formateo de {len(rows)} pagos completado.")
+        out.append("⚙️ **Comandos disponibles**:\n- `/approve <id>`\n- `/reject <id> <motivo>`\n"
+                   "- `/approve_many <id> <id> ...`\n- `/reject_many <id> <id> ... <motivo>`\n- `/pending` (selección múltiple)")
+        log.debug("Formateo de %s pagos completado.", len(rows))
         return "\n".join(out)
     except Exception as e:
-        logging.error(f"Error en fmt_payments_pretty: {e}")
+        log.error("Error en fmt_payments_pretty: %s", e)
         return "🧾 **Error al mostrar pagos**\nNo se pudieron formatear los pagos."
 
 def fmt_resellers_list(rows: List[Dict[str, Any]]) -> str:
@@ -345,10 +504,10 @@ def fmt_resellers_list(rows: List[Dict[str, Any]]) -> str:
                 f"🔹 **ID**: `{r['id']}` | **Plan**: {r['plan']} | **Vence**: {r['expires']} | "
                 f"**Contacto**: {r.get('contact', 'N/A')} | **Clientes**: {r.get('clients', 0)}"
             )
-        logging.info(f"Formateo de {len(rows)} resellers completado.")
+        log.debug("Formateo de %s resellers completado.", len(rows))
         return "\n".join(out)
     except Exception as e:
-        logging.error(f"Error en fmt_resellers_list: {e}")
+        log.error("Error en fmt_resellers_list: %s", e)
         return "💼 **Error al mostrar resellers**\nNo se pudieron formatear los resellers."
 
 def fmt_clients_list(rows: List[Dict[str, Any]], title: str = "👥 CLIENTES") -> str:
@@ -371,10 +530,10 @@ def fmt_clients_list(rows: List[Dict[str, Any]], title: str = "👥 CLIENTES") -
                 f"🔹 **Slug**: `{c['slug']}` | **Plan**: {c['plan']} | **Vence**: {c['expires']} | "
                 f"**Reseller**: `{c['reseller_id']}`"
             )
-        logging.info(f"Formateo de {len(rows)} clientes completado.")
+        log.debug("Formateo de %s clientes completado.", len(rows))
         return "\n".join(out)
     except Exception as e:
-        logging.error(f"Error en fmt_clients_list: {e}")
+        log.error("Error en fmt_clients_list: %s", e)
         return f"{title}\n\nError al mostrar los clientes."
 
 def fmt_client_card(c: Dict[str, Any]) -> str:
@@ -399,7 +558,7 @@ def fmt_client_card(c: Dict[str, Any]) -> str:
             f"🛰 **Estado del servicio**: {STATE_ICON.get(c.get('svc_status', 'unknown'), 'Desconocido')}"
         )
     except Exception as e:
-        logging.error(f"Error en fmt_client_card: {e}")
+        log.error("Error en fmt_client_card: %s", e)
         return "👤 **Error al mostrar cliente**\nNo se pudieron formatear los datos."
 
 def fmt_status_panel(s: Dict[str, Any]) -> str:
@@ -423,70 +582,5 @@ def fmt_status_panel(s: Dict[str, Any]) -> str:
             f"📁 **Directorio**: `{s['workdir']}`"
         )
     except Exception as e:
-        logging.error(f"Error en fmt_status_panel: {e}")
+        log.error("Error en fmt_status_panel: %s", e)
         return "📊 **Error al mostrar estado**\nNo se pudieron formatear los datos."
-
-# ---------- Messages ----------
-MSG_CLIENT_WELCOME = (
-    "🚀 **Bienvenido a tu Panel de Servicio**\n\n"
-    "🔖 **Plan**: {plan}\n"
-    "📅 **Vence**: {expires}\n"
-    "🧭 **ID**: `{slug}`\n\n"
-    "💡 Usa **💳 Pagar / Renovar** para mantener tu servicio activo o **📞 Soporte** para ayuda."
-)
-MSG_RES_LIMIT = (
-    "⛔ **Límite de clientes alcanzado**\n"
-    "Tu plan permite un máximo de {limit} clientes.\n"
-    "Actualiza tu plan en **💳 Pagar / Renovar** para crear más."
-)
-MSG_PAY_PICK = (
-    "💳 **Realizar un pago**\n\n"
-    "Selecciona una opción:\n"
-    "• **Plan Reseller**: Actualiza o renueva tu plan (Básico, Pro, Enterprise).\n"
-    "• **Renovar Cliente**: Extiende el plan de un cliente existente (30, 90 o 365 días)."
-)
-MSG_PAY_SALDO = (
-    "💵 **Pagar con saldo**\n\n"
-    "{txt}\n"
-    "Monto: **{monto_saldo} CUP**\n\n"
-    "1. Realiza el pago.\n"
-    "2. Pulsa **📤 Enviar comprobante** y adjunta la captura en el chat."
-)
-MSG_PAY_CUP = (
-    "💵 **Pagar en CUP**\n\n"
-    "{txt}\n"
-    "Monto: **{monto_cup} CUP**\n\n"
-    "1. Realiza el pago.\n"
-    "2. Pulsa **📤 Enviar comprobante** y adjunta la captura en el chat."
-)
-MSG_RECEIPT_OK = (
-    "✅ **Comprobante recibido**\n"
-    "Tu pago está en revisión. El administrador lo aprobará pronto.\n"
-    "Te notificaremos cuando esté listo."
-)
-MSG_EXPIRES_TMR = (
-    "⚠️ **Recordatorio: ¡Tu servicio vence mañana!**\n"
-    "• **ID**: `{slug}`\n"
-    "• **Fecha**: {expires}\n\n"
-    "Renueva ahora en **💳 Pagar / Renovar** para evitar interrupciones."
-)
-MSG_EXPIRED = (
-    "🔴 **Servicio pausado por vencimiento**\n"
-    "• **ID**: `{slug}`\n"
-    "• **Venció**: {expires}\n\n"
-    "Renueva en **💳 Pagar / Renovar** para reactivar tu servicio."
-)
-MSG_CREATED_CLIENT = (
-    "✅ **Cliente creado exitosamente**\n"
-    "• **Slug**: `{slug}`\n"
-    "• **Reseller**: `{rid}`\n"
-    "• **Vence**: `{expires}`\n\n"
-    "Notifica al cliente con su slug para que pueda usar el servicio."
-)
-MSG_CREATED_RESELLER = (
-    "✅ **Reseller activado**\n"
-    "• **ID**: `{rid}`\n"
-    "• **Plan**: Básico\n"
-    "• **Vence**: `{expires}`\n\n"
-    "¡Listo para crear clientes y vender! Usa **👥 Mis clientes** o **➕ Crear cliente**."
-        )